@@ -0,0 +1,87 @@
+"""
+Hypersphere Scoring
+Unsupervised anomaly score for serving: distance of a request's contrastive
+representation to the benign hypersphere center saved at training time,
+normalized by the benign distance calibration table
+"""
+
+import logging
+import time
+from typing import Any, Dict, List, Tuple
+
+import torch
+import torch.nn as nn
+
+try:
+    from ml_pipeline.training.waf_model import distance_percentile, hypersphere_distance
+    from ml_pipeline.inference.scorer_common import LatencyStats, used_length
+except Exception:
+    from waf_model import distance_percentile, hypersphere_distance  # type: ignore
+    from scorer_common import LatencyStats, used_length  # type: ignore
+
+class HypersphereScorer:
+    """Center-distance anomaly score from the encoder alone
+    
+    The score is the benign percentile (0..1) of the distance to the center,
+    so a threshold of 0.99 flags requests further out than 99% of the
+    calibration traffic. The anomaly head score comes from the same encoder
+    pass (see scores), so the two can be compared on the same batch. Same
+    call interface as ScoringGraph.
+    """
+    
+    def __init__(self, model: nn.Module, center: List[float], percentiles: List[float], device: str = 'cpu'):
+        self.model = model
+        self.device = device
+        self.center = torch.tensor(center, dtype=torch.float32, device=device)
+        self.percentiles = torch.tensor(percentiles, dtype=torch.float32, device=device)
+        self.num_layers = len(model.transformer_layers)
+        # Scores are benign percentiles
+        self.score_range = (0.0, 1.0)
+        self.logger = logging.getLogger(__name__)
+        
+        self.latency = LatencyStats()
+        self.totals = {'rows': 0, 'distance': 0.0}
+        
+    def scores(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> Dict[str, torch.Tensor]:
+        """Hypersphere score, raw distance and anomaly head score [batch] from one encoder pass"""
+        length = used_length(attention_mask)
+        with torch.no_grad():
+            hidden_states = self.model.encode(input_ids[:, :length], attention_mask[:, :length], fast_path=True)
+            pooled_output = self.model.layer_norm(hidden_states[:, 0, :])
+            distance = hypersphere_distance(self.model.contrastive_head(pooled_output), self.center)
+            return {
+                'hypersphere': distance_percentile(distance, self.percentiles),
+                'distance': distance,
+                'head': self.model.anomaly_head(pooled_output).squeeze(-1)
+            }
+            
+    def __call__(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        """Hypersphere scores [batch]"""
+        start = time.perf_counter()
+        result = self.scores(input_ids, attention_mask)
+        self.latency.record('hypersphere', time.perf_counter() - start, input_ids.shape[0])
+        self.totals['rows'] += input_ids.shape[0]
+        self.totals['distance'] += float(result['distance'].sum())
+        return result['hypersphere']
+        
+    def score_with_depth(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Hypersphere scores [batch] and encoder layers executed (always the full model)"""
+        scores = self(input_ids, attention_mask)
+        return scores, torch.full_like(scores, self.num_layers, dtype=torch.long)
+        
+    def warmup(self) -> Dict[str, float]:
+        """Score one short synthetic row so the first request does not pay one-time costs"""
+        start = time.perf_counter()
+        input_ids = torch.tensor([[1, 4, 2]], device=self.device)
+        self.scores(input_ids, torch.ones_like(input_ids))
+        return {'hypersphere': time.perf_counter() - start}
+        
+    def stats(self) -> Dict[str, Any]:
+        """Latency and distance metrics"""
+        rows = self.totals['rows']
+        return {
+            'mode': 'hypersphere',
+            'calibration_median_distance': float(self.percentiles[len(self.percentiles) // 2]),
+            'mean_distance': self.totals['distance'] / rows if rows else None,
+            'latency': self.latency.summary()
+        }
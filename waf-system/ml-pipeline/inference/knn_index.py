@@ -0,0 +1,275 @@
+"""
+Benign Embedding Index
+Pooled CLS embeddings of the deduplicated benign training corpus, stored as a
+memory-mapped numpy index (optionally float16 and/or partitioned) and
+searched in batch for the k nearest benign neighbours
+"""
+
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+try:
+    from ml_pipeline.training.waf_model import WAFTokenizer, distance_percentiles
+    from ml_pipeline.inference.scorer_common import used_length
+except Exception:
+    from waf_model import WAFTokenizer, distance_percentiles  # type: ignore
+    from scorer_common import used_length  # type: ignore
+
+INDEX_FORMAT_VERSION = 1
+INDEX_SUFFIX = '.knn'
+VECTORS_FILE = 'vectors.npy'
+CENTROIDS_FILE = 'centroids.npy'
+OFFSETS_FILE = 'offsets.npy'
+METADATA_FILE = 'metadata.json'
+INDEX_DTYPES = ('float32', 'float16')
+
+DEFAULT_K = 10
+DEFAULT_NPROBE = 8
+# Index rows compared with a query batch at a time (bounds the similarity block)
+SEARCH_BLOCK_ROWS = 16384
+# Rows sampled per partition to fit the partition centroids
+KMEANS_SAMPLE_PER_PARTITION = 64
+KMEANS_ITERATIONS = 10
+
+def index_path_for(model_path: str) -> Path:
+    """Index directory next to a training checkpoint (best_model.pt -> best_model.knn)"""
+    return Path(model_path).with_suffix(INDEX_SUFFIX)
+
+def is_index_current(index_path: Path, checkpoint_path: Optional[Path] = None) -> bool:
+    """Whether an index exists and is not older than the checkpoint whose embeddings it holds"""
+    metadata_file = Path(index_path) / METADATA_FILE
+    if not metadata_file.exists() or not (Path(index_path) / VECTORS_FILE).exists():
+        return False
+    if checkpoint_path is None or not Path(checkpoint_path).exists():
+        return True
+    return metadata_file.stat().st_mtime >= Path(checkpoint_path).stat().st_mtime
+
+def pooled_embeddings(model: nn.Module, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+    """L2-normalized pooled CLS embeddings [batch, hidden] (encoder fast path, trailing padding trimmed)"""
+    length = used_length(attention_mask)
+    with torch.no_grad():
+        hidden_states = model.encode(input_ids[:, :length], attention_mask[:, :length], fast_path=True)
+        return F.normalize(model.layer_norm(hidden_states[:, 0, :]), p=2, dim=1)
+
+def kmeans(vectors: torch.Tensor, partitions: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0) -> torch.Tensor:
+    """Spherical k-means centroids [partitions, dim] of normalized vectors"""
+    generator = torch.Generator().manual_seed(seed)
+    centroids = vectors[torch.randperm(len(vectors), generator=generator)[:partitions]].clone()
+    for _ in range(iterations):
+        assignment = (vectors @ centroids.T).argmax(dim=1)
+        sums = torch.zeros_like(centroids).index_add_(0, assignment, vectors)
+        counts = torch.bincount(assignment, minlength=len(centroids))
+        # Empty partitions keep their previous centroid
+        centroids = torch.where(counts.unsqueeze(1) > 0, F.normalize(sums, p=2, dim=1), centroids)
+    return centroids
+
+def write_index(
+    index_path: str,
+    blocks: Iterable[np.ndarray],
+    dtype: str = 'float32',
+    partitions: int = 0,
+    metadata: Optional[Dict[str, Any]] = None
+) -> Path:
+    """Write normalized embedding blocks [n, dim] as an index directory
+    
+    Blocks are streamed to a scratch file, so only one block is in memory at a
+    time. With partitions > 0 the rows are grouped by nearest k-means centroid
+    (centroids fitted on a sample) and searches only visit the closest
+    partitions.
+    """
+    if dtype not in INDEX_DTYPES:
+        raise ValueError(f"Unknown index dtype: {dtype}")
+    index_path = Path(index_path)
+    index_path.mkdir(parents=True, exist_ok=True)
+    scratch_file = index_path / 'vectors.f32'
+    
+    size, dim = 0, None
+    with open(scratch_file, 'wb') as f:
+        for block in blocks:
+            block = np.ascontiguousarray(block, dtype=np.float32)
+            dim = block.shape[1]
+            size += len(block)
+            f.write(block.tobytes())
+    if not size:
+        scratch_file.unlink()
+        raise ValueError("No embeddings to index")
+        
+    scratch = np.memmap(scratch_file, dtype=np.float32, mode='r', shape=(size, dim))
+    order = None
+    partitions = min(partitions, size)
+    if partitions > 0:
+        generator = np.random.default_rng(0)
+        sample_size = min(size, partitions * KMEANS_SAMPLE_PER_PARTITION)
+        sample = np.sort(generator.choice(size, sample_size, replace=False))
+        centroids = kmeans(torch.from_numpy(np.array(scratch[sample])), partitions)
+        assignment = np.concatenate([
+            (torch.from_numpy(np.array(scratch[i:i + SEARCH_BLOCK_ROWS])) @ centroids.T).argmax(dim=1).numpy()
+            for i in range(0, size, SEARCH_BLOCK_ROWS)
+        ])
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=partitions))])
+        np.save(index_path / CENTROIDS_FILE, centroids.numpy())
+        np.save(index_path / OFFSETS_FILE, offsets.astype(np.int64))
+    else:
+        for name in (CENTROIDS_FILE, OFFSETS_FILE):
+            (index_path / name).unlink(missing_ok=True)
+            
+    vectors = np.lib.format.open_memmap(index_path / VECTORS_FILE, mode='w+', dtype=np.dtype(dtype), shape=(size, dim))
+    for i in range(0, size, SEARCH_BLOCK_ROWS):
+        rows = order[i:i + SEARCH_BLOCK_ROWS] if order is not None else slice(i, i + SEARCH_BLOCK_ROWS)
+        vectors[i:i + SEARCH_BLOCK_ROWS] = scratch[rows]
+    vectors.flush()
+    del vectors, scratch
+    scratch_file.unlink()
+    
+    # Metadata is written last: its mtime marks the index as complete
+    metadata = {
+        **(metadata or {}),
+        'format_version': INDEX_FORMAT_VERSION,
+        'size': size,
+        'dim': dim,
+        'dtype': dtype,
+        'partitions': partitions
+    }
+    with open(index_path / METADATA_FILE, 'w') as f:
+        json.dump(metadata, f, indent=2)
+    return index_path
+
+class BenignIndex:
+    """Memory-mapped k-nearest-neighbour index of benign embeddings
+    
+    Rows are L2-normalized, so the nearest neighbours are the most similar
+    rows and the Euclidean distance is sqrt(2 - 2 * similarity). Only the
+    centroids and partition offsets are read into memory; the vectors stay
+    on disk and are paged in block by block during a search.
+    """
+    
+    def __init__(self, index_path: str, nprobe: Optional[int] = None):
+        self.index_path = Path(index_path)
+        with open(self.index_path / METADATA_FILE, 'r') as f:
+            self.metadata = json.load(f)
+        if self.metadata.get('format_version', 0) > INDEX_FORMAT_VERSION:
+            raise ValueError(f"Index format {self.metadata['format_version']} is newer than supported format {INDEX_FORMAT_VERSION}")
+            
+        self.vectors = np.load(self.index_path / VECTORS_FILE, mmap_mode='r')
+        self.partitions = self.metadata['partitions']
+        if self.partitions:
+            self.centroids = torch.from_numpy(np.load(self.index_path / CENTROIDS_FILE))
+            self.offsets = np.load(self.index_path / OFFSETS_FILE)
+        else:
+            self.centroids, self.offsets = None, None
+        self.nprobe = min(nprobe or self.metadata.get('nprobe', DEFAULT_NPROBE), max(1, self.partitions))
+        
+    def __len__(self) -> int:
+        return len(self.vectors)
+        
+    @property
+    def nbytes(self) -> Dict[str, int]:
+        """Bytes on disk (memory-mapped) and held in memory"""
+        resident = self.centroids.numel() * 4 + self.offsets.nbytes if self.partitions else 0
+        return {'mapped': int(self.vectors.nbytes), 'resident': int(resident)}
+        
+    def _merge(self, queries: torch.Tensor, start: int, end: int, best: torch.Tensor, k: int) -> torch.Tensor:
+        """Top-k similarities [batch, k] after comparing queries with index rows start..end"""
+        for i in range(start, end, SEARCH_BLOCK_ROWS):
+            block = torch.from_numpy(np.array(self.vectors[i:min(end, i + SEARCH_BLOCK_ROWS)])).float()
+            best = torch.cat([best, queries @ block.T], dim=1).topk(k, dim=1).values
+        return best
+        
+    def search(self, queries: torch.Tensor, k: int = DEFAULT_K) -> torch.Tensor:
+        """Distances [batch, k] of normalized queries to their k nearest rows (ascending)"""
+        queries = queries.detach().float().cpu()
+        k = min(k, len(self))
+        best = torch.full((len(queries), k), -1.0)
+        if not self.partitions:
+            best = self._merge(queries, 0, len(self), best, k)
+        else:
+            probes = (queries @ self.centroids.T).topk(self.nprobe, dim=1).indices
+            # Each probed partition is scanned once for all the queries probing it
+            for partition in probes.unique().tolist():
+                rows = (probes == partition).any(dim=1).nonzero(as_tuple=True)[0]
+                best[rows] = self._merge(queries[rows], int(self.offsets[partition]), int(self.offsets[partition + 1]), best[rows], k)
+        return (2 - 2 * best).clamp(min=0).sqrt()
+
+class BenignIndexBuilder:
+    """Offline job: encode a benign corpus in batches and write its index"""
+    
+    def __init__(self, model: nn.Module, tokenizer: WAFTokenizer, device: str = 'cpu', max_length: int = 128, batch_size: int = 256):
+        self.model = model.to(device).eval()
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.logger = logging.getLogger(__name__)
+        
+    def unique_batches(self, sequences: List[List[str]]) -> Iterable[Dict[str, torch.Tensor]]:
+        """Encoded batches holding each distinct token id sequence once"""
+        seen = set()
+        for i in range(0, len(sequences), self.batch_size):
+            encoded = self.tokenizer.encode_batch(sequences[i:i + self.batch_size], max_length=self.max_length)
+            lengths = encoded['attention_mask'].sum(dim=1).tolist()
+            keep = []
+            for row, (ids, length) in enumerate(zip(encoded['input_ids'].tolist(), lengths)):
+                key = tuple(ids[:length])
+                if key not in seen:
+                    seen.add(key)
+                    keep.append(row)
+            if keep:
+                yield {name: tensor[keep] for name, tensor in encoded.items()}
+                
+    def embed(self, sequences: List[List[str]]) -> Iterable[np.ndarray]:
+        """Pooled embeddings of the unique sequences, one block per batch"""
+        for batch in self.unique_batches(sequences):
+            yield pooled_embeddings(self.model, batch['input_ids'].to(self.device), batch['attention_mask'].to(self.device)).cpu().numpy()
+            
+    def calibrate(self, index: BenignIndex, sequences: List[List[str]], k: int) -> List[float]:
+        """kNN distance calibration table of held-out benign sequences (duplicates kept, as in traffic)"""
+        distances = []
+        for i in range(0, len(sequences), self.batch_size):
+            encoded = self.tokenizer.encode_batch(sequences[i:i + self.batch_size], max_length=self.max_length)
+            embeddings = pooled_embeddings(self.model, encoded['input_ids'].to(self.device), encoded['attention_mask'].to(self.device))
+            distances.append(index.search(embeddings, k).mean(dim=1))
+        return distance_percentiles(torch.cat(distances))
+        
+    def build(
+        self,
+        sequences: List[List[str]],
+        index_path: str,
+        calibration_sequences: Optional[List[List[str]]] = None,
+        k: int = DEFAULT_K,
+        dtype: str = 'float32',
+        partitions: int = 0,
+        nprobe: int = DEFAULT_NPROBE
+    ) -> Dict[str, Any]:
+        """Write the index of a corpus and calibrate its score on held-out sequences"""
+        start = time.perf_counter()
+        index_path = write_index(index_path, self.embed(sequences), dtype=dtype, partitions=partitions, metadata={
+            'source_sequences': len(sequences),
+            'max_length': self.max_length,
+            'k': k,
+            'nprobe': nprobe
+        })
+        built = time.perf_counter()
+        
+        index = BenignIndex(str(index_path))
+        percentiles = self.calibrate(index, calibration_sequences, k) if calibration_sequences else None
+        metadata = {
+            **index.metadata,
+            'calibration_sequences': len(calibration_sequences or []),
+            'percentiles': percentiles,
+            'build_s': built - start,
+            'calibration_s': time.perf_counter() - built
+        }
+        with open(index_path / METADATA_FILE, 'w') as f:
+            json.dump(metadata, f, indent=2)
+            
+        self.logger.info(f"kNN index of {metadata['size']} unique sequences ({len(sequences)} total) written to {index_path}")
+        return metadata
@@ -0,0 +1,92 @@
+"""
+kNN Scoring
+Anomaly score for serving: mean distance of a request's pooled embedding to
+its k nearest neighbours in the benign embedding index, normalized by the
+index's benign distance calibration table
+"""
+
+import logging
+import time
+from typing import Any, Dict, Tuple
+
+import torch
+import torch.nn as nn
+
+try:
+    from ml_pipeline.training.waf_model import distance_percentile
+    from ml_pipeline.inference.knn_index import BenignIndex, DEFAULT_K, pooled_embeddings
+    from ml_pipeline.inference.scorer_common import LatencyStats
+except Exception:
+    from waf_model import distance_percentile  # type: ignore
+    from knn_index import BenignIndex, DEFAULT_K, pooled_embeddings  # type: ignore
+    from scorer_common import LatencyStats  # type: ignore
+
+class KNNScorer:
+    """Nearest-benign-neighbour distance score
+    
+    The whole batch is embedded in one encoder pass and searched in one index
+    query. With a calibration table the score is the benign percentile (0..1)
+    of the distance, as for the hypersphere score; otherwise the raw distance.
+    Same call interface as ScoringGraph.
+    """
+    
+    def __init__(self, model: nn.Module, index: BenignIndex, device: str = 'cpu'):
+        self.model = model
+        self.index = index
+        self.device = device
+        self.k = index.metadata.get('k', DEFAULT_K)
+        percentiles = index.metadata.get('percentiles')
+        self.percentiles = torch.tensor(percentiles, dtype=torch.float32) if percentiles else None
+        self.num_layers = len(model.transformer_layers)
+        # Benign percentiles, or raw distances between unit vectors without a calibration table
+        self.score_range = (0.0, 1.0) if self.percentiles is not None else (0.0, 2.0)
+        self.logger = logging.getLogger(__name__)
+        
+        self.latency = LatencyStats()
+        self.totals = {'rows': 0, 'distance': 0.0}
+        
+    def distances(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        """Mean distance [batch] to the k nearest benign embeddings"""
+        start = time.perf_counter()
+        embeddings = pooled_embeddings(self.model, input_ids, attention_mask)
+        encoded = time.perf_counter()
+        distance = self.index.search(embeddings, self.k).mean(dim=1)
+        self.latency.record('encode', encoded - start, input_ids.shape[0])
+        self.latency.record('search', time.perf_counter() - encoded, input_ids.shape[0])
+        return distance
+        
+    def __call__(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        """kNN scores [batch]"""
+        distance = self.distances(input_ids, attention_mask)
+        self.totals['rows'] += input_ids.shape[0]
+        self.totals['distance'] += float(distance.sum())
+        if self.percentiles is None:
+            return distance.to(input_ids.device)
+        return distance_percentile(distance, self.percentiles).to(input_ids.device)
+        
+    def score_with_depth(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """kNN scores [batch] and encoder layers executed (always the full model)"""
+        scores = self(input_ids, attention_mask)
+        return scores, torch.full_like(scores, self.num_layers, dtype=torch.long)
+        
+    def warmup(self) -> Dict[str, float]:
+        """Score one short synthetic row so the first request does not pay one-time costs"""
+        start = time.perf_counter()
+        input_ids = torch.tensor([[1, 4, 2]], device=self.device)
+        self.distances(input_ids, torch.ones_like(input_ids))
+        return {'knn': time.perf_counter() - start}
+        
+    def stats(self) -> Dict[str, Any]:
+        """Index, latency and distance metrics"""
+        rows = self.totals['rows']
+        return {
+            'mode': 'knn',
+            'k': self.k,
+            'index_size': len(self.index),
+            'partitions': self.index.partitions,
+            'nprobe': self.index.nprobe if self.index.partitions else None,
+            'index_bytes': self.index.nbytes,
+            'calibrated': self.percentiles is not None,
+            'mean_distance': self.totals['distance'] / rows if rows else None,
+            'latency': self.latency.summary()
+        }
@@ -0,0 +1,133 @@
+"""
+Masked-Key Scoring
+LogBERT anomaly criterion for serving: every key of a sequence is masked in
+turn and the anomaly score is the fraction of keys missing from the MLM
+head's top-k predictions
+"""
+
+import logging
+import time
+from typing import Any, Dict, Tuple
+
+import torch
+import torch.nn as nn
+
+try:
+    from ml_pipeline.inference.scorer_common import LatencyStats, used_length
+except Exception:
+    from scorer_common import LatencyStats, used_length  # type: ignore
+
+DEFAULT_TOP_K = 5
+DEFAULT_MAX_VARIANTS = 4096
+
+class MaskedKeyScorer:
+    """Top-k masked-key miss ratio for WAFTransformer sequences
+    
+    All single-key masked variants of a batch are built with tensor ops and
+    scored in one encoder pass (split into chunks of max_variants to bound
+    memory); the MLM head runs only at the masked positions. A key is missed
+    when at least top_k vocabulary entries score strictly higher than it.
+    Same call interface as ScoringGraph, so the service can use either.
+    """
+    
+    def __init__(
+        self,
+        model: nn.Module,
+        special_tokens: Dict[str, int],
+        top_k: int = DEFAULT_TOP_K,
+        max_variants: int = DEFAULT_MAX_VARIANTS,
+        device: str = 'cpu'
+    ):
+        self.model = model
+        self.top_k = top_k
+        self.max_variants = max_variants
+        self.device = device
+        self.mask_token_id = special_tokens['[MASK]']
+        # Positions holding these are not keys ([UNK] is: an unknown value is a key the model cannot predict)
+        self.non_key_ids = torch.tensor(
+            [special_tokens[name] for name in ('[PAD]', '[CLS]', '[SEP]', '[MASK]')], device=device
+        )
+        self.num_layers = len(model.transformer_layers)
+        # Scores are miss ratios
+        self.score_range = (0.0, 1.0)
+        self.logger = logging.getLogger(__name__)
+        
+        self.latency = LatencyStats()
+        self.totals = {'rows': 0, 'keys': 0, 'misses': 0}
+        
+    def variants(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> Dict[str, torch.Tensor]:
+        """One masked copy of its row per key: ids/mask [V, L], row/position/target [V]"""
+        key_mask = attention_mask.bool() & ~torch.isin(input_ids, self.non_key_ids)
+        rows, positions = key_mask.nonzero(as_tuple=True)
+        index = torch.arange(len(rows), device=input_ids.device)
+        variant_ids = input_ids[rows]
+        targets = variant_ids[index, positions].clone()
+        variant_ids[index, positions] = self.mask_token_id
+        return {
+            'input_ids': variant_ids,
+            'attention_mask': attention_mask[rows],
+            'rows': rows,
+            'positions': positions,
+            'targets': targets
+        }
+        
+    def _misses(self, input_ids: torch.Tensor, attention_mask: torch.Tensor, positions: torch.Tensor, targets: torch.Tensor) -> torch.Tensor:
+        """Whether each variant's masked key falls outside the top-k predictions"""
+        length = used_length(attention_mask)
+        hidden_states = self.model.encode(input_ids[:, :length], attention_mask[:, :length], fast_path=True)
+        index = torch.arange(len(positions), device=positions.device)
+        logits = self.model.mlm_head(hidden_states[index, positions])
+        target_logits = logits.gather(1, targets.unsqueeze(1))
+        return (logits > target_logits).sum(dim=1) >= self.top_k
+        
+    def score_keys(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> Dict[str, torch.Tensor]:
+        """Missed and total keys per row [batch]"""
+        batch_size = input_ids.shape[0]
+        variants = self.variants(input_ids, attention_mask)
+        total = len(variants['rows'])
+        with torch.no_grad():
+            missed = torch.cat([
+                self._misses(
+                    variants['input_ids'][i:i + self.max_variants],
+                    variants['attention_mask'][i:i + self.max_variants],
+                    variants['positions'][i:i + self.max_variants],
+                    variants['targets'][i:i + self.max_variants]
+                )
+                for i in range(0, total, self.max_variants)
+            ]) if total else torch.zeros(0, dtype=torch.bool, device=input_ids.device)
+        misses = torch.zeros(batch_size, dtype=torch.long, device=input_ids.device).index_add_(0, variants['rows'], missed.long())
+        keys = torch.bincount(variants['rows'], minlength=batch_size)
+        return {'misses': misses, 'keys': keys}
+        
+    def __call__(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        """Miss ratios [batch] (0 for rows without keys)"""
+        start = time.perf_counter()
+        result = self.score_keys(input_ids, attention_mask)
+        self.latency.record('masked_keys', time.perf_counter() - start, input_ids.shape[0])
+        self.totals['rows'] += input_ids.shape[0]
+        self.totals['keys'] += int(result['keys'].sum())
+        self.totals['misses'] += int(result['misses'].sum())
+        return result['misses'].float() / result['keys'].clamp(min=1).float()
+        
+    def score_with_depth(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Miss ratios [batch] and encoder layers executed (always the full model)"""
+        scores = self(input_ids, attention_mask)
+        return scores, torch.full_like(scores, self.num_layers, dtype=torch.long)
+        
+    def warmup(self) -> Dict[str, float]:
+        """Score one short synthetic row so the first request does not pay one-time costs"""
+        start = time.perf_counter()
+        input_ids = torch.tensor([[1, 4, 4, 2]], device=self.device)
+        self.score_keys(input_ids, torch.ones_like(input_ids))
+        return {'masked_keys': time.perf_counter() - start}
+        
+    def stats(self) -> Dict[str, Any]:
+        """Latency and key-miss metrics"""
+        keys = self.totals['keys']
+        return {
+            'mode': 'masked_keys',
+            'top_k': self.top_k,
+            'keys_per_row': keys / self.totals['rows'] if self.totals['rows'] else None,
+            'miss_rate': self.totals['misses'] / keys if keys else None,
+            'latency': self.latency.summary()
+        }
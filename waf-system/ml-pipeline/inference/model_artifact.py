@@ -0,0 +1,123 @@
+"""
+Inference Model Artifact
+Serving-only model format: safetensors weights, a compact vocabulary table
+and the featurizer/Drain metadata the model was trained with
+"""
+
+import inspect
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+from safetensors.torch import load_file, save_file
+
+try:
+    from ml_pipeline.training.waf_model import WAFTransformer, WAFTransformerConfig, WAFTokenizer, load_tokenizer
+except Exception:
+    from waf_model import WAFTransformer, WAFTransformerConfig, WAFTokenizer, load_tokenizer  # type: ignore
+
+ARTIFACT_FORMAT_VERSION = 1
+ARTIFACT_SUFFIX = '.artifact'
+WEIGHTS_FILE = 'model.safetensors'
+VOCAB_FILE = 'vocab.json'
+METADATA_FILE = 'metadata.json'
+# load_state_dict(assign=True) needs torch 2.1; older releases copy into uninitialized storage
+LOAD_ASSIGN_SUPPORTED = 'assign' in inspect.signature(torch.nn.Module.load_state_dict).parameters
+
+logger = logging.getLogger(__name__)
+
+def artifact_path_for(model_path: str) -> Path:
+    """Artifact directory next to a training checkpoint (best_model.pt -> best_model.artifact)"""
+    return Path(model_path).with_suffix(ARTIFACT_SUFFIX)
+
+def is_artifact_current(artifact_path: Path, checkpoint_path: Optional[Path] = None) -> bool:
+    """Whether an artifact exists and is not older than its training checkpoint"""
+    metadata_file = Path(artifact_path) / METADATA_FILE
+    if not metadata_file.exists() or not (Path(artifact_path) / WEIGHTS_FILE).exists():
+        return False
+    if checkpoint_path is None or not Path(checkpoint_path).exists():
+        return True
+    return metadata_file.stat().st_mtime >= Path(checkpoint_path).stat().st_mtime
+
+def export_artifact(
+    model: WAFTransformer,
+    tokenizer: WAFTokenizer,
+    artifact_path: str,
+    featurizer_config: Optional[Dict[str, Any]] = None,
+    drain_params: Optional[Dict[str, Any]] = None,
+    hypersphere: Optional[Dict[str, Any]] = None
+) -> Path:
+    """Write an inference artifact for a trained model"""
+    artifact_path = Path(artifact_path)
+    artifact_path.mkdir(parents=True, exist_ok=True)
+    
+    state_dict = {name: tensor.detach().contiguous().cpu() for name, tensor in model.state_dict().items()}
+    save_file(state_dict, str(artifact_path / WEIGHTS_FILE))
+    tokenizer.save_vocabulary(str(artifact_path / VOCAB_FILE))
+    
+    # Metadata is written last: its mtime marks the artifact as complete
+    metadata = {
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'model_config': dict(model.config.__dict__),
+        'featurizer_config': featurizer_config,
+        'drain_params': drain_params,
+        'hypersphere': hypersphere
+    }
+    with open(artifact_path / METADATA_FILE, 'w') as f:
+        json.dump(metadata, f, indent=2)
+        
+    logger.info(f"Inference artifact written to {artifact_path}")
+    return artifact_path
+
+def export_checkpoint(checkpoint_path: str, artifact_path: Optional[str] = None, drain_params: Optional[Dict[str, Any]] = None) -> Path:
+    """Convert a training checkpoint (and its tokenizer file) into an inference artifact"""
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    config = WAFTransformerConfig(**checkpoint['model_config'])
+    model = WAFTransformer(config)
+    model.load_state_dict(checkpoint['model_state_dict'])
+    
+    tokenizer_path = str(checkpoint_path).replace('.pt', '_tokenizer.json')
+    if Path(tokenizer_path).exists():
+        tokenizer = load_tokenizer(tokenizer_path, vocab_size=config.vocab_size)
+    else:
+        tokenizer = WAFTokenizer(vocab_size=config.vocab_size)
+        
+    return export_artifact(
+        model,
+        tokenizer,
+        artifact_path or artifact_path_for(checkpoint_path),
+        featurizer_config=checkpoint.get('featurizer_config'),
+        drain_params=drain_params,
+        hypersphere=checkpoint.get('hypersphere')
+    )
+
+def load_artifact(artifact_path: str, device: str = 'cpu') -> Tuple[WAFTransformer, WAFTokenizer, Dict[str, Any]]:
+    """Load a model for inference from an artifact
+    
+    The model is built on the meta device and takes ownership of the loaded
+    tensors (no random init, no second copy of the weights). Before torch 2.1
+    it is materialized uninitialized (to_empty) and the weights are copied in.
+    """
+    artifact_path = Path(artifact_path)
+    with open(artifact_path / METADATA_FILE, 'r') as f:
+        metadata = json.load(f)
+    if metadata.get('format_version', 0) > ARTIFACT_FORMAT_VERSION:
+        raise ValueError(f"Artifact format {metadata['format_version']} is newer than supported format {ARTIFACT_FORMAT_VERSION}")
+        
+    config = WAFTransformerConfig(**metadata['model_config'])
+    with torch.device('meta'):
+        model = WAFTransformer(config)
+    state_dict = load_file(str(artifact_path / WEIGHTS_FILE), device=device)
+    if LOAD_ASSIGN_SUPPORTED:
+        model.load_state_dict(state_dict, assign=True)
+    else:
+        model.to_empty(device=device)
+        model.load_state_dict(state_dict)
+    # Non-persistent buffers are not in the weights file
+    model.reset_position_ids(device=device)
+    model.eval()
+    
+    tokenizer = load_tokenizer(str(artifact_path / VOCAB_FILE), vocab_size=config.vocab_size)
+    return model, tokenizer, metadata
@@ -0,0 +1,36 @@
+"""
+Scorer Common
+Helpers shared by the serving scorers: per-label latency counters and the
+trim of right-padded batches to their used columns
+"""
+
+from typing import Any, Dict
+
+import torch
+
+def used_length(attention_mask: torch.Tensor) -> int:
+    """Columns up to the last unmasked one of right-padded rows (at least 1)"""
+    used = attention_mask.any(dim=0).nonzero()
+    return int(used[-1]) + 1 if len(used) else 1
+
+class LatencyStats:
+    """Calls, rows, total and max milliseconds per label (bucket or scoring stage)"""
+    
+    def __init__(self):
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        
+    def record(self, label: str, elapsed: float, rows: int):
+        entry = self.entries.get(label)
+        if entry is None:
+            entry = self.entries[label] = {'calls': 0, 'rows': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+        entry['calls'] += 1
+        entry['rows'] += rows
+        entry['total_ms'] += elapsed * 1000
+        entry['max_ms'] = max(entry['max_ms'], elapsed * 1000)
+        
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Counters per label with the average milliseconds per call"""
+        return {
+            label: {**entry, 'avg_ms': entry['total_ms'] / entry['calls']}
+            for label, entry in sorted(self.entries.items())
+        }
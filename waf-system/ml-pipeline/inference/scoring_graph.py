@@ -0,0 +1,249 @@
+"""
+Scoring Graph
+Optimized scoring-only forward for serving: one traced (or compiled) graph per
+batch-size / sequence-length bucket, warmed at startup, with eager as fallback
+"""
+
+import logging
+import time
+import warnings
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import torch
+import torch.nn as nn
+
+try:
+    from ml_pipeline.inference.scorer_common import LatencyStats, used_length
+except Exception:
+    from scorer_common import LatencyStats, used_length  # type: ignore
+
+SCORING_MODES = ('trace', 'compile', 'eager')
+DEFAULT_LENGTH_BUCKETS = (16, 32, 64, 128)
+
+class ScoreForward(nn.Module):
+    """Module wrapper exposing WAFTransformer.score as forward (for tracing/compiling)"""
+    
+    def __init__(self, model: nn.Module, fast_path: bool = True):
+        super().__init__()
+        self.model = model
+        self.fast_path = fast_path
+        
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        return self.model.score(input_ids, attention_mask, fast_path=self.fast_path)
+
+class ScoringGraph:
+    """Bucketed scoring-only inference graph
+    
+    'trace' freezes a TorchScript trace per bucket and 'compile' uses
+    torch.compile with static shapes (slow to build on CPU); both run the plain
+    layer loop, since the nested-tensor fast path does not trace. Batches are
+    padded up to the smallest (batch, length) bucket holding them, so every
+    call hits a graph built at warmup. Each graph is checked against eager
+    scores and timed against eager on ragged rows when built; buckets that
+    fail to build or to match, buckets where eager is faster, and inputs that
+    fit no bucket run eagerly. 'eager' calls WAFTransformer.score with its
+    fast path on batches trimmed to their used length, without bucket padding.
+    
+    With an exit threshold and a model that has early-exit heads,
+    score_with_depth stops each row at the first confident exit (always eager:
+    the exit pattern is data dependent) and records the exit depths.
+    """
+    
+    def __init__(
+        self,
+        model: nn.Module,
+        mode: str = 'eager',
+        batch_buckets: Sequence[int] = (1, 32),
+        length_buckets: Sequence[int] = DEFAULT_LENGTH_BUCKETS,
+        device: str = 'cpu',
+        exit_threshold: Optional[float] = None
+    ):
+        if mode not in SCORING_MODES:
+            raise ValueError(f"Unknown scoring mode: {mode}")
+        self.model = model
+        self.mode = mode
+        self.device = device
+        self.batch_buckets = sorted(set(batch_buckets))
+        self.length_buckets = sorted(set(length_buckets))
+        self.logger = logging.getLogger(__name__)
+        
+        self.graphs: Dict[Tuple[int, int], Any] = {}
+        self.fallbacks: Dict[Tuple[int, int], str] = {}
+        # Buckets where eager measured faster than the built graph at warmup
+        self.eager_buckets: Dict[Tuple[int, int], Dict[str, float]] = {}
+        self.latency = LatencyStats()
+        self.num_layers = len(model.transformer_layers)
+        # Anomaly head scores are sigmoid outputs
+        self.score_range = (0.0, 1.0)
+        self.exit_threshold = exit_threshold if getattr(model, 'exit_layers', None) else None
+        # Rows scored per number of layers executed
+        self.exit_depths: Dict[int, int] = {}
+        self._forward = ScoreForward(model).eval()
+        self._graph_forward = ScoreForward(model, fast_path=False).eval()
+        
+    def bucket_for(self, batch_size: int, length: int) -> Optional[Tuple[int, int]]:
+        """Smallest (batch, length) bucket holding the input, or None if none does"""
+        batch = next((b for b in self.batch_buckets if b >= batch_size), None)
+        bucket_length = next((l for l in self.length_buckets if l >= length), None)
+        if batch is None or bucket_length is None:
+            return None
+        return batch, bucket_length
+        
+    def _example(self, bucket: Tuple[int, int]) -> Tuple[torch.Tensor, torch.Tensor]:
+        batch, length = bucket
+        input_ids = torch.zeros((batch, length), dtype=torch.long, device=self.device)
+        attention_mask = torch.zeros((batch, length), dtype=torch.long, device=self.device)
+        attention_mask[:, :2] = 1
+        return input_ids, attention_mask
+        
+    def _check_inputs(self, bucket: Tuple[int, int]) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Random right-padded rows of varying length to compare a graph against eager"""
+        batch, length = bucket
+        generator = torch.Generator().manual_seed(0)
+        vocab_size = self.model.embeddings.num_embeddings
+        input_ids = torch.randint(0, vocab_size, (batch, length), generator=generator).to(self.device)
+        lengths = torch.randint(1, length + 1, (batch,), generator=generator)
+        lengths[0] = length
+        attention_mask = (torch.arange(length) < lengths[:, None]).long().to(self.device)
+        return input_ids, attention_mask
+        
+    @staticmethod
+    def _time(graph: Any, inputs: Tuple[torch.Tensor, torch.Tensor], runs: int = 3) -> float:
+        """Best-of-runs milliseconds for one call"""
+        best = float('inf')
+        with torch.no_grad():
+            for _ in range(runs):
+                start = time.perf_counter()
+                graph(*inputs)
+                best = min(best, time.perf_counter() - start)
+        return best * 1000
+        
+    def _build(self, bucket: Tuple[int, int]) -> Any:
+        """Build the graph for one bucket"""
+        if self.mode == 'compile':
+            return torch.compile(self._graph_forward, dynamic=False)
+        with warnings.catch_warnings():
+            # TorchScript deprecation notices
+            warnings.simplefilter('ignore')
+            traced = torch.jit.trace(self._graph_forward, self._example(bucket), check_trace=False)
+            return torch.jit.freeze(traced)
+            
+    def _graph(self, bucket: Tuple[int, int]) -> Any:
+        graph = self.graphs.get(bucket)
+        if graph is None:
+            try:
+                graph = self._build(bucket)
+                inputs = self._check_inputs(bucket)
+                with torch.no_grad():
+                    expected = self._forward(*inputs)
+                    actual = graph(*inputs)
+                if not torch.allclose(actual, expected, atol=1e-4, rtol=1e-4):
+                    raise RuntimeError(f"scores differ from eager by up to {(actual - expected).abs().max().item():.3g}")
+                # Padded graphs lose to the nested-tensor eager path on ragged batches: keep the faster one
+                graph_ms, eager_ms = self._time(graph, inputs), self._time(self._forward, inputs)
+                if eager_ms < graph_ms:
+                    self.logger.info(f"Eager is faster than the {self.mode} graph for bucket {bucket} ({eager_ms:.2f} vs {graph_ms:.2f} ms)")
+                    self.eager_buckets[bucket] = {'graph_ms': graph_ms, 'eager_ms': eager_ms}
+                    graph = self._forward
+            except Exception as e:
+                self.logger.error(f"Scoring graph for bucket {bucket} failed ({self.mode}), using eager: {e}")
+                self.fallbacks[bucket] = str(e)
+                graph = self._forward
+            self.graphs[bucket] = graph
+        return graph
+        
+    def warmup(self) -> Dict[str, float]:
+        """Build and run every bucket once; returns build+first-run seconds per bucket"""
+        timings = {}
+        for batch in self.batch_buckets:
+            for length in self.length_buckets:
+                start = time.perf_counter()
+                if self.mode == 'eager':
+                    with torch.no_grad():
+                        self._forward(*self._example((batch, length)))
+                else:
+                    self._graph((batch, length))
+                timings[f"{batch}x{length}"] = time.perf_counter() - start
+        self.logger.info(f"Scoring graph warmed ({self.mode}): {len(timings)} buckets in {sum(timings.values()):.2f}s")
+        return timings
+        
+    def _score_chunk(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        batch_size = input_ids.shape[0]
+        # Right-padded rows: everything after the last unmasked column is padding
+        length = used_length(attention_mask)
+        bucket = self.bucket_for(batch_size, length)
+        
+        graph = self._graph(bucket) if bucket is not None and self.mode != 'eager' else self._forward
+        
+        start = time.perf_counter()
+        if graph is self._forward:
+            # Eager runs the batch as is (trimmed); padding only pays off for a built graph
+            scores = self._forward(input_ids[:, :length], attention_mask[:, :length])
+            label = 'eager' if bucket is None else f"{bucket[0]}x{bucket[1]}"
+        else:
+            bucket_batch, bucket_length = bucket
+            input_ids = input_ids[:, :bucket_length]
+            attention_mask = attention_mask[:, :bucket_length]
+            if input_ids.shape[1] < bucket_length or bucket_batch > batch_size:
+                padded_ids, padded_mask = self._example(bucket)
+                padded_ids[:batch_size, :input_ids.shape[1]] = input_ids
+                padded_mask[:batch_size] = 0
+                padded_mask[:batch_size, :input_ids.shape[1]] = attention_mask
+                input_ids, attention_mask = padded_ids, padded_mask
+            scores = graph(input_ids, attention_mask)[:batch_size]
+            label = f"{bucket_batch}x{bucket_length}"
+        self.latency.record(label, time.perf_counter() - start, batch_size)
+        return scores
+        
+    def __call__(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        """Anomaly scores [batch] for right-padded input ids and attention mask"""
+        largest = self.batch_buckets[-1]
+        with torch.no_grad():
+            if input_ids.shape[0] <= largest:
+                return self._score_chunk(input_ids, attention_mask)
+            chunks: List[torch.Tensor] = [
+                self._score_chunk(input_ids[i:i + largest], attention_mask[i:i + largest])
+                for i in range(0, input_ids.shape[0], largest)
+            ]
+            return torch.cat(chunks)
+            
+    def score_with_depth(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Anomaly scores [batch] and encoder layers executed per row [batch]"""
+        if self.exit_threshold is None:
+            scores = self(input_ids, attention_mask)
+            depths = torch.full_like(scores, self.num_layers, dtype=torch.long)
+        else:
+            length = used_length(attention_mask)
+            start = time.perf_counter()
+            with torch.no_grad():
+                scores, depths = self.model.score_early_exit(
+                    input_ids[:, :length], attention_mask[:, :length], threshold=self.exit_threshold
+                )
+            self.latency.record('early_exit', time.perf_counter() - start, input_ids.shape[0])
+        for depth, count in zip(*torch.unique(depths, return_counts=True)):
+            self.exit_depths[int(depth)] = self.exit_depths.get(int(depth), 0) + int(count)
+        return scores, depths
+        
+    def early_exit_stats(self) -> Dict[str, Any]:
+        """Exit depth distribution of scored rows"""
+        rows = sum(self.exit_depths.values())
+        return {
+            'enabled': self.exit_threshold is not None,
+            'exit_layers': list(getattr(self.model, 'exit_layers', [])),
+            'margin': getattr(self.model.config, 'exit_margin', None),
+            'rows': rows,
+            'avg_layers': sum(depth * count for depth, count in self.exit_depths.items()) / rows if rows else None,
+            'early_exit_rate': sum(count for depth, count in self.exit_depths.items() if depth < self.num_layers) / rows if rows else None,
+            'depths': {str(depth): count for depth, count in sorted(self.exit_depths.items())}
+        }
+        
+    def stats(self) -> Dict[str, Any]:
+        """Per-bucket latency metrics"""
+        return {
+            'mode': self.mode,
+            'buckets_built': len(self.graphs),
+            'fallbacks': {f"{b}x{l}": error for (b, l), error in self.fallbacks.items()},
+            'eager_buckets': {f"{b}x{l}": timing for (b, l), timing in self.eager_buckets.items()},
+            'latency': self.latency.summary(),
+            'early_exit': self.early_exit_stats()
+        }
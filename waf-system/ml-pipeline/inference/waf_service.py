@@ -7,7 +7,11 @@ import asyncio
 import json
 import logging
 import time
-from typing import Dict, List, Any, Optional
+
+# Start of the startup timeline (import -> model load -> warmup -> ready)
+IMPORT_STARTED_AT = time.perf_counter()
+
+from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime, timedelta
 from pathlib import Path
 import numpy as np
@@ -18,8 +22,6 @@ import uvicorn
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-import redis
-from torch.utils.data import DataLoader
 
 import os
 import sys
@@ -29,18 +31,50 @@ current_dir = os.path.dirname(__file__)
 project_root = os.path.abspath(os.path.join(current_dir, '../..'))  # points to waf-system
 
 # Try absolute package imports first; fall back to path-based imports if needed
+# (serving modules only: training code is imported by the training endpoints on use)
 try:
     from ml_pipeline.preprocessing.log_processor import LogPreprocessor
-    from ml_pipeline.training.waf_model import WAFTransformer, WAFTokenizer, create_waf_model, WAFTransformerConfig
-    from ml_pipeline.training.trainer import WAFTrainer, prepare_training_data, collate_fn
+    from ml_pipeline.preprocessing.featurizer import SequenceFeaturizer
+    from ml_pipeline.training.waf_model import WAFTransformer, WAFTokenizer, EncodeBuffer, create_waf_model, load_tokenizer, WAFTransformerConfig
+    from ml_pipeline.inference.model_artifact import artifact_path_for, export_artifact, is_artifact_current, load_artifact
+    from ml_pipeline.inference.scoring_graph import ScoringGraph, DEFAULT_LENGTH_BUCKETS
+    from ml_pipeline.inference.masked_key_scorer import MaskedKeyScorer, DEFAULT_TOP_K
+    from ml_pipeline.inference.hypersphere_scorer import HypersphereScorer
+    from ml_pipeline.inference.knn_index import BenignIndex, index_path_for, is_index_current
+    from ml_pipeline.inference.knn_scorer import KNNScorer
 except Exception:
     # Fallback: insert paths for the hyphenated package directory
     sys.path.insert(0, os.path.join(project_root, 'ml-pipeline'))
     sys.path.insert(0, os.path.join(project_root, 'ml-pipeline', 'training'))
     sys.path.insert(0, os.path.join(project_root, 'ml-pipeline', 'preprocessing'))
     from log_processor import LogPreprocessor  # type: ignore
-    from waf_model import WAFTransformer, WAFTokenizer, create_waf_model, WAFTransformerConfig  # type: ignore
-    from trainer import WAFTrainer, prepare_training_data, collate_fn  # type: ignore
+    from featurizer import SequenceFeaturizer  # type: ignore
+    from waf_model import WAFTransformer, WAFTokenizer, EncodeBuffer, create_waf_model, load_tokenizer, WAFTransformerConfig  # type: ignore
+    sys.path.insert(0, current_dir)
+    from model_artifact import artifact_path_for, export_artifact, is_artifact_current, load_artifact  # type: ignore
+    from scoring_graph import ScoringGraph, DEFAULT_LENGTH_BUCKETS  # type: ignore
+    from masked_key_scorer import MaskedKeyScorer, DEFAULT_TOP_K  # type: ignore
+    from hypersphere_scorer import HypersphereScorer  # type: ignore
+    from knn_index import BenignIndex, index_path_for, is_index_current  # type: ignore
+    from knn_scorer import KNNScorer  # type: ignore
+
+# Time spent importing the serving stack (torch, fastapi, model code)
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED_AT
+
+# Anomaly score sources: the anomaly head, the LogBERT top-k masked-key miss ratio,
+# or the benign percentile of the distance to the hypersphere center / the k nearest
+# benign embeddings (index built offline by scripts/build_knn_index.py)
+SCORE_METHODS = ('head', 'masked_keys', 'hypersphere', 'knn')
+
+def import_training_modules():
+    """Import the training-only modules (trainer, columnar log loading)"""
+    try:
+        from ml_pipeline.preprocessing.columnar_processor import ColumnarLogProcessor
+        from ml_pipeline.training.trainer import WAFTrainer, prepare_training_data, create_dataloader
+    except Exception:
+        from columnar_processor import ColumnarLogProcessor  # type: ignore
+        from trainer import WAFTrainer, prepare_training_data, create_dataloader  # type: ignore
+    return ColumnarLogProcessor, WAFTrainer, prepare_training_data, create_dataloader
 
 class RequestData(BaseModel):
     """Model for incoming HTTP request data"""
@@ -51,6 +85,7 @@ class RequestData(BaseModel):
     user_agent: str = ""
     body: Optional[str] = None
     timestamp: Optional[str] = None
+    include_features: bool = False  # Extracted features are only computed when requested
 
 class AnomalyResponse(BaseModel):
     """Model for anomaly detection response"""
@@ -61,6 +96,7 @@ class AnomalyResponse(BaseModel):
     template_id: Optional[int] = None
     features: Dict[str, Any] = {}
     processing_time_ms: float
+    exit_layer: Optional[int] = None  # Encoder layers executed (fewer than the model depth on an early exit)
 
 class BatchRequest(BaseModel):
     """Model for batch inference requests"""
@@ -88,18 +124,49 @@ class WAFInferenceService:
         redis_url: str = "redis://localhost:6379/0",
         max_queue_size: int = 1000,
         batch_size: int = 32,
-        batch_timeout: float = 0.01  # 10ms
+        batch_timeout: float = 0.01,  # 10ms
+        cache_size: int = 10000,
+        cold_start_budget_s: float = 5.0,
+        scoring_mode: str = 'trace',
+        length_buckets: Tuple[int, ...] = DEFAULT_LENGTH_BUCKETS,
+        early_exit: Optional[bool] = None,
+        score_method: str = 'head',
+        top_k: int = DEFAULT_TOP_K,
+        knn_index_path: Optional[str] = None
     ):
+        if score_method not in SCORE_METHODS:
+            raise ValueError(f"Unknown score method: {score_method}")
+        init_started = time.perf_counter()
         self.model_path = model_path
         self.threshold = threshold
         self.batch_size = batch_size
         self.batch_timeout = batch_timeout
         self.max_queue_size = max_queue_size
+        self.cache_size = cache_size
+        self.cold_start_budget_s = cold_start_budget_s
+        self.scoring_mode = scoring_mode
+        self.length_buckets = length_buckets
+        # Stop at a confident early-exit head: None enables it only for exit heads whose
+        # margin was calibrated at this threshold, True for any exit heads, False never
+        self.early_exit = early_exit
+        # With 'masked_keys' the threshold applies to the fraction of missed keys,
+        # with 'hypersphere' and 'knn' to the benign distance percentile (e.g. 0.99)
+        self.score_method = score_method
+        self.top_k = top_k
+        self.knn_index_path = Path(knn_index_path) if knn_index_path else index_path_for(model_path)
         
         # Initialize components
-        self.preprocessor = LogPreprocessor()
+        self.preprocessor = LogPreprocessor(cache_size=cache_size)
+        # Replaced by the checkpoint's featurizer config when a model is loaded
+        self.featurizer = SequenceFeaturizer(cache_size=cache_size)
+        # Reused [batch, length] id/mask block for the batch scoring path
+        self.encode_buffer = EncodeBuffer(max_length=128, capacity=batch_size)
         self.model = None
         self.tokenizer = None
+        # Hypersphere center and distance calibration saved with the model (if any)
+        self.hypersphere = None
+        # Bucketed scoring-only graph (or masked-key scorer), rebuilt whenever a model is loaded
+        self.scorer = None
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
         
         # Request queue for batching
@@ -108,6 +175,7 @@ class WAFInferenceService:
         
         # Redis for caching and statistics
         try:
+            import redis
             self.redis_client = redis.from_url(redis_url, decode_responses=True)
             self.redis_available = True
         except:
@@ -139,16 +207,87 @@ class WAFInferenceService:
             'finished_at': None
         }
         
+        # Startup timeline in seconds (filled in by initialize)
+        self.startup_timeline: Dict[str, Any] = {'service_init_s': time.perf_counter() - init_started}
+        
     async def initialize(self):
         """Initialize the service"""
-        await self.load_model()
+        started = time.perf_counter()
+        await self.load_model(warmup=False)
+        loaded = time.perf_counter()
+        await self.warmup()
+        warm = time.perf_counter()
         
         # Start background batch processor
         asyncio.create_task(self.batch_processor())
         
+        # Report the startup timeline against the cold-start budget
+        ready = time.perf_counter() - IMPORT_STARTED_AT
+        self.startup_timeline.update({
+            'import_s': IMPORT_SECONDS,
+            'model_load_s': loaded - started,
+            'warmup_s': warm - loaded,
+            'ready_s': ready,
+            'budget_s': self.cold_start_budget_s,
+            'within_budget': ready <= self.cold_start_budget_s
+        })
+        timeline = ', '.join(f"{name[:-2]}={self.startup_timeline[name]:.3f}s" for name in ('import_s', 'service_init_s', 'model_load_s', 'warmup_s', 'ready_s'))
+        if ready > self.cold_start_budget_s:
+            self.logger.warning(f"Cold start exceeded budget of {self.cold_start_budget_s:.1f}s: {timeline}")
+        else:
+            self.logger.info(f"Startup timeline: {timeline}")
+            
         self.logger.info("WAF Inference Service initialized")
         
-    async def load_model(self):
+    async def warmup(self):
+        """Build the scoring graph buckets and score one synthetic request so clients do not pay one-time costs"""
+        self.scorer.warmup()
+        encoded = self.tokenizer.encode(['GET', '/', '200'], max_length=128)
+        await self._run_inference(encoded)
+        
+    async def load_model(self, warmup: bool = True):
+        """Load the trained model and build its scoring graph"""
+        await self._load_model()
+        score_method = self.score_method
+        if score_method == 'hypersphere' and not (self.hypersphere and self.hypersphere.get('percentiles')):
+            self.logger.warning("Model has no hypersphere calibration, scoring with the anomaly head")
+            score_method = 'head'
+        if score_method == 'knn' and not (Path(self.model_path).exists() and is_index_current(self.knn_index_path, Path(self.model_path))):
+            self.logger.warning(f"No kNN index for the current model at {self.knn_index_path}, scoring with the anomaly head")
+            score_method = 'head'
+        if score_method == 'masked_keys':
+            self.scorer = MaskedKeyScorer(self.model, self.tokenizer.special_tokens, top_k=self.top_k, device=self.device)
+        elif score_method == 'hypersphere':
+            self.scorer = HypersphereScorer(self.model, self.hypersphere['center'], self.hypersphere['percentiles'], device=self.device)
+        elif score_method == 'knn':
+            self.scorer = KNNScorer(self.model, BenignIndex(str(self.knn_index_path)), device=self.device)
+        else:
+            self.scorer = ScoringGraph(
+                self.model,
+                mode=self.scoring_mode,
+                batch_buckets=(1, self.batch_size),
+                length_buckets=self.length_buckets,
+                device=self.device,
+                exit_threshold=self.threshold if self._use_early_exit() else None
+            )
+        if warmup:
+            await self.warmup()
+            
+    def _use_early_exit(self) -> bool:
+        """Whether to score with the model's early-exit heads"""
+        if not getattr(self.model, 'exit_layers', None) or self.early_exit is False:
+            return False
+        calibrated = getattr(self.model.config, 'exit_calibrated_threshold', None)
+        if calibrated == self.threshold:
+            return True
+        reason = "not calibrated" if calibrated is None else f"calibrated for threshold {calibrated}, serving at {self.threshold}"
+        if self.early_exit is None:
+            self.logger.info(f"Early exit off: exit margin {reason}")
+            return False
+        self.logger.warning(f"Early exit forced on: exit margin {reason}")
+        return True
+        
+    async def _load_model(self):
         """Load the trained model"""
         try:
             model_path = Path(self.model_path)
@@ -161,8 +300,15 @@ class WAFInferenceService:
                 else:
                     self.logger.warning(f"Model not found at {model_path}, creating new model")
                     self.model, self.tokenizer = create_waf_model()
+                    self.hypersphere = None
                     return
                 
+            # Prefer the inference artifact (safetensors weights, compact vocabulary) when it is up to date
+            artifact_path = artifact_path_for(model_path)
+            if is_artifact_current(artifact_path, model_path):
+                self._load_artifact(artifact_path)
+                return
+                
             # Load model
             checkpoint = torch.load(str(model_path), map_location=self.device)
             model_config = checkpoint['model_config']
@@ -173,11 +319,29 @@ class WAFInferenceService:
             self.model.load_state_dict(checkpoint['model_state_dict'])
             self.model.eval()
             
-            # Load tokenizer
+            # Serve with the featurization the model was trained on (older checkpoints use the default)
+            self.featurizer = SequenceFeaturizer.from_checkpoint(checkpoint.get('featurizer_config'), cache_size=self.cache_size)
+            self.hypersphere = checkpoint.get('hypersphere')
+            
+            # Load tokenizer (word-level or subword, as saved with the checkpoint)
             tokenizer_path = str(model_path).replace('.pt', '_tokenizer.json')
-            self.tokenizer = WAFTokenizer(vocab_size=config.vocab_size)
             if Path(tokenizer_path).exists():
-                self.tokenizer.load_vocabulary(tokenizer_path)
+                self.tokenizer = load_tokenizer(tokenizer_path, vocab_size=config.vocab_size)
+            else:
+                self.tokenizer = WAFTokenizer(vocab_size=config.vocab_size)
+                
+            # Export an artifact so the next start skips the optimizer state and pickle load
+            try:
+                export_artifact(
+                    self.model,
+                    self.tokenizer,
+                    artifact_path,
+                    featurizer_config=self.featurizer.to_config(),
+                    drain_params=self.preprocessor.template_miner.drain_params,
+                    hypersphere=self.hypersphere
+                )
+            except Exception as e:
+                self.logger.warning(f"Could not export inference artifact: {e}")
             
             self.logger.info(f"Model loaded from {model_path}")
             
@@ -185,7 +349,18 @@ class WAFInferenceService:
             self.logger.error(f"Error loading model: {e}")
             # Fallback to new model
             self.model, self.tokenizer = create_waf_model()
+            self.hypersphere = None
             
+    def _load_artifact(self, artifact_path: Path):
+        """Load model, tokenizer and preprocessing settings from an inference artifact"""
+        self.model, self.tokenizer, metadata = load_artifact(str(artifact_path), device=self.device)
+        self.featurizer = SequenceFeaturizer.from_checkpoint(metadata.get('featurizer_config'), cache_size=self.cache_size)
+        self.hypersphere = metadata.get('hypersphere')
+        drain_params = metadata.get('drain_params')
+        if drain_params and drain_params != self.preprocessor.template_miner.drain_params:
+            self.preprocessor = LogPreprocessor(cache_size=self.cache_size, drain_params=drain_params)
+        self.logger.info(f"Model loaded from artifact {artifact_path}")
+        
     async def predict_single(self, request_data: RequestData) -> AnomalyResponse:
         """Predict anomaly for a single request"""
         start_time = time.time()
@@ -201,13 +376,13 @@ class WAFInferenceService:
                 raise ValueError("Failed to process request")
                 
             # Create sequence tokens
-            sequence = self._create_sequence_from_processed(processed)
+            sequence = self.featurizer.featurize(processed['parsed'])
             
             # Tokenize
             encoded = self.tokenizer.encode(sequence, max_length=128)
             
             # Inference
-            anomaly_score, confidence = await self._run_inference(encoded)
+            anomaly_score, confidence, exit_layer = await self._run_inference(encoded)
             is_anomalous = anomaly_score > self.threshold
             
             # Update statistics
@@ -230,8 +405,9 @@ class WAFInferenceService:
                 is_anomalous=is_anomalous,
                 confidence=float(confidence),
                 template_id=processed.get('template_id'),
-                features=processed.get('features', {}),
-                processing_time_ms=processing_time
+                features=processed.get('features', {}) if request_data.include_features else {},
+                processing_time_ms=processing_time,
+                exit_layer=exit_layer
             )
             
             return response
@@ -260,43 +436,32 @@ class WAFInferenceService:
             for req in requests:
                 log_line = self._request_to_log_format(req)
                 processed = self.preprocessor.process_log_entry(log_line)
-                if processed:
-                    sequence = self._create_sequence_from_processed(processed)
-                    encoded = self.tokenizer.encode(sequence, max_length=128)
-                    processed_requests.append((req, processed, encoded))
-                else:
-                    processed_requests.append((req, None, None))
+                processed_requests.append((req, processed if processed else None))
                     
             # Batch inference
             if processed_requests:
-                batch_inputs = []
-                batch_masks = []
-                valid_indices = []
+                valid_indices = [i for i, (req, processed) in enumerate(processed_requests) if processed is not None]
                 
-                for i, (req, processed, encoded) in enumerate(processed_requests):
-                    if encoded is not None:
-                        batch_inputs.append(encoded['input_ids'])
-                        batch_masks.append(encoded['attention_mask'])
-                        valid_indices.append(i)
-                        
-                if batch_inputs:
-                    # Stack tensors
-                    input_ids = torch.stack(batch_inputs).to(self.device)
-                    attention_mask = torch.stack(batch_masks).to(self.device)
+                if valid_indices:
+                    # Featurize and encode straight into the reused [batch, length] buffer
+                    encoded = self.featurizer.encode_batch(
+                        [processed_requests[i][1]['parsed'] for i in valid_indices],
+                        self.tokenizer,
+                        max_length=128,
+                        buffer=self.encode_buffer
+                    )
+                    input_ids = encoded['input_ids'].to(self.device)
+                    attention_mask = encoded['attention_mask'].to(self.device)
                     
                     # Run batch inference
-                    with torch.no_grad():
-                        outputs = self.model(
-                            input_ids=input_ids,
-                            attention_mask=attention_mask
-                        )
-                        anomaly_scores = outputs['anomaly_score'].cpu().numpy()
+                    anomaly_scores, exit_layers = self.scorer.score_with_depth(input_ids, attention_mask)
+                    anomaly_scores = anomaly_scores.cpu().numpy()
+                    exit_layers = exit_layers.tolist()
                         
-                    # Calculate confidences (simplified)
-                    confidences = np.abs(anomaly_scores - 0.5) * 2  # Distance from decision boundary
+                    confidences = self.confidence(anomaly_scores)
                     
                     # Create responses
-                    for i, (req, processed, encoded) in enumerate(processed_requests):
+                    for i, (req, processed) in enumerate(processed_requests):
                         request_id = f"batch_{int(start_time)}_{i}"
                         
                         if i in valid_indices:
@@ -311,8 +476,9 @@ class WAFInferenceService:
                                 is_anomalous=is_anomalous,
                                 confidence=float(confidence),
                                 template_id=processed.get('template_id') if processed else None,
-                                features=processed.get('features', {}) if processed else {},
-                                processing_time_ms=(time.time() - start_time) * 1000 / len(requests)
+                                features=processed.get('features', {}) if processed and req.include_features else {},
+                                processing_time_ms=(time.time() - start_time) * 1000 / len(requests),
+                                exit_layer=exit_layers[batch_idx]
                             )
                         else:
                             # Failed to process
@@ -342,21 +508,22 @@ class WAFInferenceService:
                 for i in range(len(requests))
             ]
             
+    def confidence(self, scores: np.ndarray) -> np.ndarray:
+        """Distance of scores from the threshold, as a fraction of the scorer's range on that side (0..1)"""
+        low, high = self.scorer.score_range
+        span = np.where(scores > self.threshold, high - self.threshold, self.threshold - low)
+        return np.clip(np.abs(scores - self.threshold) / np.maximum(span, 1e-12), 0.0, 1.0)
+        
     async def _run_inference(self, encoded: Dict[str, torch.Tensor]) -> tuple:
         """Run inference on encoded input"""
-        with torch.no_grad():
-            input_ids = encoded['input_ids'].unsqueeze(0).to(self.device)
-            attention_mask = encoded['attention_mask'].unsqueeze(0).to(self.device)
-            
-            outputs = self.model(
-                input_ids=input_ids,
-                attention_mask=attention_mask
-            )
-            
-            anomaly_score = outputs['anomaly_score'].item()
-            confidence = abs(anomaly_score - 0.5) * 2  # Distance from decision boundary
-            
-            return anomaly_score, confidence
+        input_ids = encoded['input_ids'].unsqueeze(0).to(self.device)
+        attention_mask = encoded['attention_mask'].unsqueeze(0).to(self.device)
+        
+        anomaly_scores, exit_layers = self.scorer.score_with_depth(input_ids, attention_mask)
+        anomaly_score = anomaly_scores.item()
+        confidence = float(self.confidence(np.array(anomaly_score)))
+        
+        return anomaly_score, confidence, int(exit_layers.item())
             
     async def batch_processor(self):
         """Background task to process requests in batches"""
@@ -408,30 +575,16 @@ class WAFInferenceService:
         
         return log_line
         
-    def _create_sequence_from_processed(self, processed: Dict[str, Any]) -> List[str]:
-        """Create token sequence from processed log entry"""
-        parsed = processed['parsed']
+    def get_cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get hit-rate metrics for all memoization caches"""
+        cache_stats = self.preprocessor.cache_stats()
+        cache_stats.update(self.featurizer.cache_stats())
+        return cache_stats
         
-        sequence = [
-            parsed.get('method', 'GET'),
-            parsed.get('path_only', '/'),
-            str(parsed.get('status', 200)),
-        ]
-        
-        # Add user agent tokens (simplified)
-        user_agent = parsed.get('http_user_agent', '')
-        if user_agent and user_agent != '-':
-            # Extract browser/tool name
-            if 'Mozilla' in user_agent:
-                sequence.append('Mozilla')
-            elif 'curl' in user_agent:
-                sequence.append('curl')
-            elif 'python' in user_agent:
-                sequence.append('python')
-            else:
-                sequence.append('Other-Agent')
-                
-        return sequence
+    def clear_caches(self):
+        """Clear all memoization caches"""
+        self.preprocessor.clear_caches()
+        self.featurizer.clear_caches()
         
     def _update_stats(self, processing_time: float, is_anomalous: bool):
         """Update service statistics"""
@@ -459,13 +612,20 @@ class WAFInferenceService:
             self.stats['anomalous_requests'] / max(1, self.stats['total_requests'])
         )
         stats['uptime'] = time.time() - getattr(self, 'start_time', time.time())
+        stats['caches'] = self.get_cache_stats()
+        stats['featurizer'] = self.featurizer.stats()
+        stats['startup'] = self.startup_timeline
+        stats['scoring'] = self.scorer.stats() if self.scorer is not None else None
         
         return stats
 
     # Helper: build sequences from log files
     def _build_sequences_from_logs(self, log_paths: List[str], max_lines: int = 5000) -> List[List[str]]:
+        ColumnarLogProcessor = import_training_modules()[0]
         sequences: List[List[str]] = []
-        read_lines = 0
+        # Columnar batch mode: same sequences as the per-line path, built per file chunk;
+        # the rows are still mined by Drain so templates keep tracking the training logs
+        columnar = ColumnarLogProcessor(self.preprocessor, featurizer=self.featurizer)
         for p in log_paths:
             try:
                 # Expand globs robustly (supports absolute patterns)
@@ -474,20 +634,13 @@ class WAFInferenceService:
                     path = Path(path_str)
                     if not path.exists() or not path.is_file():
                         continue
-                    with path.open('r', errors='ignore') as f:
-                        for line in f:
-                            if read_lines >= max_lines:
-                                break
-                            processed = self.preprocessor.process_log_entry(line.strip())
-                            if processed:
-                                seq = self._create_sequence_from_processed(processed)
-                                sequences.append(seq)
-                                read_lines += 1
-                    if read_lines >= max_lines:
+                    remaining = max_lines - len(sequences)
+                    if remaining <= 0:
                         break
+                    sequences.extend(columnar.build_sequences([str(path)], max_sequences=remaining, mine_templates=True))
             except Exception as e:
                 self.logger.warning(f"Failed reading logs from {p}: {e}")
-            if read_lines >= max_lines:
+            if len(sequences) >= max_lines:
                 break
         self.logger.info(f"Collected {len(sequences)} sequences from logs")
         return sequences
@@ -528,12 +681,13 @@ class WAFInferenceService:
             
             # Prepare datasets
             self.training_status['status'] = 'preparing dataset'
+            _, WAFTrainer, prepare_training_data, create_dataloader = import_training_modules()
             train_dataset, val_dataset = prepare_training_data(sequences, self.tokenizer)
-            train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, collate_fn=collate_fn)
-            val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, collate_fn=collate_fn)
+            train_loader = create_dataloader(train_dataset, batch_size=batch_size, shuffle=True)
+            val_loader = create_dataloader(val_dataset, batch_size=batch_size, shuffle=False)
             
             # Trainer
-            trainer = WAFTrainer(self.model, self.tokenizer, device=self.device)
+            trainer = WAFTrainer(self.model, self.tokenizer, device=self.device, featurizer_config=self.featurizer.to_config())
             
             # Train epochs
             for epoch in range(epochs):
@@ -564,10 +718,10 @@ class WAFInferenceService:
             self.training_status['running'] = False
             self.training_status['finished_at'] = datetime.utcnow().isoformat()
 
-# Initialize service
-waf_service = WAFInferenceService(
-    model_path=str((Path(project_root) / 'data' / 'models' / 'best_model.pt').resolve())
-)
+DEFAULT_MODEL_PATH = str((Path(project_root) / 'data' / 'models' / 'best_model.pt').resolve())
+
+# Service is built at startup, not import, so importing the app stays cheap
+waf_service: Optional[WAFInferenceService] = None
 
 # FastAPI app
 app = FastAPI(
@@ -588,8 +742,18 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_event():
     """Initialize service on startup"""
-    waf_service.start_time = time.time()
-    await waf_service.initialize()
+    global waf_service
+    service = WAFInferenceService(model_path=DEFAULT_MODEL_PATH)
+    service.start_time = time.time()
+    await service.initialize()
+    # Published only once initialized: handlers answer 503 until then
+    waf_service = service
+
+def ready_service() -> WAFInferenceService:
+    """Get the initialized service or fail with 503 while it is starting"""
+    if waf_service is None:
+        raise HTTPException(status_code=503, detail="Service is starting")
+    return waf_service
 
 @app.get("/")
 async def index():
@@ -597,15 +761,16 @@ async def index():
         "service": "WAF Anomaly Detection API",
         "endpoints": [
             "/health", "/stats", "/score", "/score/batch", "/model/update",
-            "/train_from_logs", "/train/status", "/model/reload"
+            "/train_from_logs", "/train/status", "/model/reload", "/cache/clear"
         ]
     }
 
 @app.post("/score", response_model=AnomalyResponse)
 async def score_request(request_data: RequestData):
     """Score a single HTTP request for anomaly detection"""
+    service = ready_service()
     try:
-        response = await waf_service.predict_single(request_data)
+        response = await service.predict_single(request_data)
         return response
     except Exception as e:
         logging.error(f"Error scoring request: {e}")
@@ -614,8 +779,9 @@ async def score_request(request_data: RequestData):
 @app.post("/score/batch", response_model=List[AnomalyResponse])
 async def score_batch(batch_request: BatchRequest):
     """Score multiple HTTP requests for anomaly detection"""
+    service = ready_service()
     try:
-        responses = await waf_service.predict_batch(batch_request.requests)
+        responses = await service.predict_batch(batch_request.requests)
         return responses
     except Exception as e:
         logging.error(f"Error scoring batch: {e}")
@@ -624,7 +790,7 @@ async def score_batch(batch_request: BatchRequest):
 @app.get("/stats")
 async def get_stats():
     """Get service statistics"""
-    return await waf_service.get_stats()
+    return await ready_service().get_stats()
 
 @app.get("/health")
 async def health_check():
@@ -632,7 +798,7 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat(),
-        "model_loaded": waf_service.model is not None
+        "model_loaded": waf_service is not None and waf_service.model is not None
     }
 
 @app.post("/model/update")
@@ -659,9 +825,10 @@ async def _process_model_update(log_entries: List[str], is_benign: bool):
 # New endpoint: trigger training from logs
 @app.post("/train_from_logs")
 async def train_from_logs(req: TrainFromLogsRequest, background_tasks: BackgroundTasks):
+    service = ready_service()
     try:
         background_tasks.add_task(
-            waf_service._train_from_logs_async,
+            service._train_from_logs_async,
             req.log_paths or [],
             req.epochs,
             req.max_lines,
@@ -674,17 +841,25 @@ async def train_from_logs(req: TrainFromLogsRequest, background_tasks: Backgroun
 # Training status endpoint
 @app.get("/train/status")
 async def train_status():
-    return waf_service.training_status
+    return ready_service().training_status
 
 # Reload model endpoint
 @app.post("/model/reload")
 async def reload_model():
+    service = ready_service()
     try:
-        await waf_service.load_model()
-        return {"status": "reloaded", "model_loaded": waf_service.model is not None}
+        await service.load_model()
+        return {"status": "reloaded", "model_loaded": service.model is not None}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Clear memoization caches (e.g. after replacing the Drain snapshot)
+@app.post("/cache/clear")
+async def clear_caches():
+    service = ready_service()
+    service.clear_caches()
+    return {"status": "cleared", "caches": service.get_cache_stats()}
+
 if __name__ == "__main__":
     # Configure logging
     logging.basicConfig(level=logging.INFO)
@@ -11,9 +11,17 @@ from typing import AsyncGenerator, Dict, Any
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import aiofiles
+import sys
 import time
 from datetime import datetime
 
+try:
+    from ml_pipeline.preprocessing.log_processor import HTTPLogParser
+except Exception:
+    # Fallback for running outside the package: use the sibling preprocessing dir
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'preprocessing'))
+    from log_processor import HTTPLogParser  # type: ignore
+
 class LogTailHandler(FileSystemEventHandler):
     """File system event handler for log tailing"""
     
@@ -27,10 +35,13 @@ class LogTailHandler(FileSystemEventHandler):
 class LogIngestion:
     """Real-time log ingestion service"""
     
-    def __init__(self, log_paths: list, queue_size: int = 1000):
+    def __init__(self, log_paths: list, queue_size: int = 1000, log_format: str = 'auto'):
         self.log_paths = [Path(path) for path in log_paths]
         self.queue = asyncio.Queue(maxsize=queue_size)
         self.file_positions = {}
+        # Log format per source ('combined' or 'json'), detected once per file
+        self.log_format = log_format
+        self.file_formats = {}
         self.observers = []
         self.logger = logging.getLogger(__name__)
         
@@ -75,8 +86,14 @@ class LogIngestion:
                 async for line in f:
                     line = line.strip()
                     if line:
+                        log_format = self.file_formats.get(file_path)
+                        if log_format is None:
+                            log_format = self._detect_format(line)
+                            self.file_formats[file_path] = log_format
+                            
                         log_entry = {
                             'raw_log': line,
+                            'log_format': log_format,
                             'source_file': file_path,
                             'timestamp': datetime.utcnow().isoformat(),
                             'ingestion_time': time.time()
@@ -92,6 +109,12 @@ class LogIngestion:
         except Exception as e:
             self.logger.error(f"Error reading log file {file_path}: {e}")
             
+    def _detect_format(self, sample_line: str) -> str:
+        """Detect the log format of a source from its first line"""
+        if self.log_format != 'auto':
+            return self.log_format
+        return HTTPLogParser.detect_format(sample_line)
+        
     async def get_log_stream(self) -> AsyncGenerator[Dict[str, Any], None]:
         """Get stream of log entries"""
         while True:
@@ -0,0 +1,298 @@
+"""
+Columnar Log Preprocessing
+Batch mode that loads chunks of access log lines into field columns and
+derives normalized fields, security features and token sequences per column.
+Derivations are memoized per distinct value (plain Python string work, not
+numpy vectorization): access logs repeat a small set of requests, agents and
+statuses, so each distinct value is processed once per chunk
+"""
+
+import logging
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from log_processor import LogPreprocessor, HTTPLogParser
+from featurizer import SequenceFeaturizer
+
+RAW_FIELDS = (
+    'remote_addr', 'remote_user', 'time_local', 'request', 'status', 'body_bytes_sent',
+    'http_referer', 'http_user_agent', 'request_time'
+)
+
+SQL_KEYWORDS = ('union', 'select', 'insert', 'delete', 'drop')
+XSS_PATTERNS = ('javascript:', 'vbscript:', 'onload=', 'onerror=')
+SCANNER_AGENTS = ('sqlmap', 'nmap', 'dirb', 'nikto')
+
+def as_array(values: List[Any], dtype) -> np.ndarray:
+    """Build a typed column array, falling back to object dtype for irregular values"""
+    try:
+        return np.array(values, dtype=dtype)
+    except (TypeError, ValueError):
+        return np.array(values, dtype=object)
+
+def is_error_status(status: Any) -> bool:
+    """Error flag for a converted status value (missing counts as 200)"""
+    if status is None:
+        return False
+    return isinstance(status, int) and status >= 400
+
+def map_unique(values: List[Any], fn: Callable[[Any], Any]) -> List[Any]:
+    """Apply fn once per distinct value and broadcast the results back to the column"""
+    table = {value: fn(value) for value in dict.fromkeys(values)}
+    return list(map(table.__getitem__, values))
+
+class ColumnarLogBatch:
+    """A chunk of parsed log lines stored as field columns
+    
+    Raw regex fields are held as lists (one entry per row). Derived columns
+    (request split, URL split, numeric status, query params) are
+    computed on first use over the whole column through a memo of distinct
+    values, so the per-row cost is a dict lookup. Values match the per-line
+    LogPreprocessor path exactly; rows that the combined-format regex cannot
+    parse are processed per line.
+    """
+    
+    def __init__(self, columns: Dict[str, List[Any]], num_rows: int, preprocessor: LogPreprocessor, fallback: Optional[Dict[int, Any]] = None):
+        self.num_rows = num_rows
+        self.preprocessor = preprocessor
+        self._columns = columns
+        # Rows parsed by the per-line fallback (row index -> parsed mapping)
+        self.fallback = fallback or {}
+        
+    def __len__(self) -> int:
+        return self.num_rows
+        
+    def column(self, name: str) -> List[Any]:
+        """Get a raw or derived column; missing values are None"""
+        if name not in self._columns:
+            deriver = self._DERIVERS.get(name)
+            if deriver is None:
+                raise KeyError(name)
+            getattr(self, deriver)()
+            for row, parsed in self.fallback.items():
+                for field in self._DERIVED_FIELDS[deriver]:
+                    self._columns[field][row] = parsed.get(field)
+        return self._columns[name]
+        
+    def _derive_request(self):
+        """Split request lines into method, path and protocol"""
+        def split_request(request):
+            parts = request.split(' ', 2) if request else ()
+            if len(parts) < 2:
+                return (None, None, None)
+            return (parts[0], parts[1], parts[2] if len(parts) == 3 else None)
+        split = map_unique(self._columns['request'], split_request)
+        self._columns['method'] = [parts[0] for parts in split]
+        self._columns['path'] = [parts[1] for parts in split]
+        self._columns['protocol'] = [parts[2] for parts in split]
+        
+    def _derive_url(self):
+        """Split request targets into path and query string"""
+        split = map_unique(self.column('path'), lambda path: HTTPLogParser._split_url(path) if path else (None, None))
+        self._columns['path_only'] = [parts[0] for parts in split]
+        self._columns['query_string'] = [parts[1] for parts in split]
+        
+    def _derive_query_params(self):
+        """Parse query strings into parameter dicts"""
+        parse_query = HTTPLogParser._parse_query
+        self._columns['query_params'] = map_unique(
+            self.column('query_string'),
+            lambda query: None if query is None else (parse_query(query) if query else {})
+        )
+        
+    def _derive_numeric(self):
+        """Convert numeric fields"""
+        def to_int(value):
+            if value is None:
+                return None
+            try:
+                return int(value)
+            except ValueError:
+                return value
+        self._columns['status'] = map_unique(self._columns['raw_status'], to_int)
+        self._columns['body_bytes_sent'] = list(map(to_int, self._columns['raw_body_bytes_sent']))
+        
+    _DERIVERS = {
+        'method': '_derive_request',
+        'path': '_derive_request',
+        'protocol': '_derive_request',
+        'path_only': '_derive_url',
+        'query_string': '_derive_url',
+        'query_params': '_derive_query_params',
+        'status': '_derive_numeric',
+        'body_bytes_sent': '_derive_numeric',
+    }
+    _DERIVED_FIELDS = {
+        '_derive_request': ('method', 'path', 'protocol'),
+        '_derive_url': ('path_only', 'query_string'),
+        '_derive_query_params': ('query_params',),
+        '_derive_numeric': ('status', 'body_bytes_sent'),
+    }
+    
+    def sequences(self, featurizer: Optional[SequenceFeaturizer] = None) -> List[List[str]]:
+        """Build model token sequences for every row"""
+        return (featurizer or SequenceFeaturizer()).featurize_columns(self)
+        
+    def features(self) -> Dict[str, Any]:
+        """Extract the ML feature columns (numeric/bool columns as numpy arrays)"""
+        methods = self.column('method')
+        statuses = self.column('status')
+        paths = self.column('path')
+        path_only = self.column('path_only')
+        query_strings = self.column('query_string')
+        query_params = self.column('query_params')
+        agents = self.column('http_user_agent')
+        referers = self.column('http_referer')
+        body_sizes = self.column('body_bytes_sent')
+        categorize = self.preprocessor.parser._categorize_method
+        
+        status_codes = [0 if status is None else status for status in statuses]
+        lowered = map_unique(
+            [(p or '') + (q or '') for p, q in zip(path_only, query_strings)],
+            str.lower
+        )
+        agents_lower = map_unique([agent or '' for agent in agents], str.lower)
+        
+        features = {
+            'method': ['' if method is None else method for method in methods],
+            'status_code': as_array(status_codes, np.int64),
+            'path_depth': np.array(map_unique(paths, lambda path: len([p for p in path.split('/') if p]) if path else 0), dtype=np.int64),
+            'query_param_count': np.array([len(params) if params else 0 for params in query_params], dtype=np.int64),
+            'user_agent_length': np.array([len(agent) if agent else 0 for agent in agents], dtype=np.int64),
+            'is_error': np.array(map_unique(statuses, is_error_status), dtype=bool),
+            'method_category': map_unique(methods, lambda method: categorize(method or '')),
+            'has_referer': np.array([bool(ref and ref != '-') for ref in referers], dtype=bool),
+            'body_size': as_array([0 if size is None else size for size in body_sizes], np.int64),
+            'contains_script_tags': np.array(map_unique(lowered, lambda text: '<script' in text), dtype=bool),
+            'contains_sql_keywords': np.array(map_unique(lowered, lambda text: any(k in text for k in SQL_KEYWORDS)), dtype=bool),
+            'contains_xss_patterns': np.array(map_unique(lowered, lambda text: any(p in text for p in XSS_PATTERNS)), dtype=bool),
+            'suspicious_user_agent': np.array(map_unique(agents_lower, lambda text: any(b in text for b in SCANNER_AGENTS)), dtype=bool),
+        }
+        # Fallback rows may carry arbitrary fields: use the per-line extractor for them
+        if self.fallback:
+            features = {name: column.astype(object) if isinstance(column, np.ndarray) else column for name, column in features.items()}
+        for row, parsed in self.fallback.items():
+            for name, value in self.preprocessor._extract_features(parsed).items():
+                features[name][row] = value
+        return features
+        
+    def request_signatures(self) -> List[str]:
+        """Build Drain request signatures for every row"""
+        methods = self.column('method')
+        paths = self.column('path_only')
+        statuses = self.column('status')
+        params = map_unique(
+            self.column('query_string'),
+            lambda query: ','.join(sorted(HTTPLogParser._parse_query(query).keys())) or 'NO_PARAMS' if query else 'NO_PARAMS'
+        )
+        agents = self.column('http_user_agent')
+        signatures = [
+            f"{'UNKNOWN' if m is None else m} {'/' if p is None else p} {0 if s is None else s} {q} {'' if a is None else a}"
+            for m, p, s, q, a in zip(methods, paths, statuses, params, agents)
+        ]
+        for row, parsed in self.fallback.items():
+            signatures[row] = self.preprocessor._create_request_signature(parsed)
+        return signatures
+        
+    def normalized_signatures(self) -> List[str]:
+        """Normalize request signatures (once per distinct signature)"""
+        return map_unique(self.request_signatures(), self.preprocessor.normalizer.normalize)
+        
+    def mine_templates(self, limit: Optional[int] = None) -> List[Tuple[str, int, int]]:
+        """Feed the normalized signatures of the first limit rows to Drain, in row order
+        Drain is order-dependent, so this runs row by row like the per-line path.
+        """
+        extract = self.preprocessor.template_miner.extract_template
+        return [extract(signature) for signature in self.normalized_signatures()[:limit]]
+
+class ColumnarLogProcessor:
+    """Loads log files in chunks and processes them column-wise"""
+    
+    def __init__(self, preprocessor: Optional[LogPreprocessor] = None, chunk_size: int = 100_000, featurizer: Optional[SequenceFeaturizer] = None):
+        self.preprocessor = preprocessor or LogPreprocessor()
+        self.featurizer = featurizer or SequenceFeaturizer()
+        self.chunk_size = chunk_size
+        self.patterns = [HTTPLogParser.NGINX_COMBINED, HTTPLogParser.APACHE_COMBINED]
+        self.logger = logging.getLogger(__name__)
+        
+    def load_chunk(self, lines: List[str], log_format: Optional[str] = None) -> ColumnarLogBatch:
+        """Parse a chunk of raw lines into a columnar batch"""
+        if (log_format or self.preprocessor.parser.log_format) == 'json':
+            return self._load_json_chunk(lines)
+            
+        rows = []
+        fallback = {}
+        primary = self.patterns[0].match
+        for line in lines:
+            line = line.strip()
+            match = primary(line)
+            if match is None:
+                for pattern in self.patterns[1:]:
+                    match = pattern.match(line)
+                    if match is not None:
+                        break
+            if match is not None:
+                rows.append(match.groups())
+                continue
+            # Rare non-combined lines go through the per-line parser
+            parsed = self.preprocessor.parser.parse_log_line(line, log_format)
+            if parsed:
+                fallback[len(rows)] = parsed
+                rows.append(tuple(parsed.get(field) for field in RAW_FIELDS))
+        return self._build_batch(rows, fallback)
+        
+    def _load_json_chunk(self, lines: List[str]) -> ColumnarLogBatch:
+        """Decode structured JSON lines straight into columns (no regex parsing)"""
+        rows = []
+        to_fields = self.preprocessor.parser.json_to_fields
+        for line in lines:
+            fields = to_fields(line.strip())
+            if fields is None:
+                self.logger.warning(f"Could not parse JSON log line: {line.strip()}")
+                continue
+            rows.append(tuple(fields.get(field) for field in RAW_FIELDS))
+        return self._build_batch(rows, {})
+        
+    def _build_batch(self, rows: List[tuple], fallback: Dict[int, Any]) -> ColumnarLogBatch:
+        """Transpose parsed rows into field columns"""
+        if rows:
+            columns = {field: list(values) for field, values in zip(RAW_FIELDS, zip(*rows))}
+        else:
+            columns = {field: [] for field in RAW_FIELDS}
+        # Numeric fields are converted lazily; keep the raw strings under separate names
+        columns['raw_status'] = columns.pop('status')
+        columns['raw_body_bytes_sent'] = columns.pop('body_bytes_sent')
+        return ColumnarLogBatch(columns, len(rows), self.preprocessor, fallback)
+        
+    def iter_file_batches(self, path: str) -> Iterator[ColumnarLogBatch]:
+        """Yield columnar batches of chunk_size lines from a log file
+        The log format is detected once per file unless the parser has a fixed format.
+        """
+        log_format = self.preprocessor.parser.log_format
+        with Path(path).open('r', errors='ignore') as f:
+            while True:
+                lines = list(islice(f, self.chunk_size))
+                if not lines:
+                    break
+                if log_format == 'auto':
+                    sample = next((line for line in lines if line.strip()), None)
+                    if sample is not None:
+                        log_format = HTTPLogParser.detect_format(sample)
+                yield self.load_chunk(lines, log_format)
+                
+    def build_sequences(self, paths: List[str], max_sequences: Optional[int] = None, mine_templates: bool = False) -> List[List[str]]:
+        """Build token sequences from log files in bulk
+        With mine_templates the kept rows are also fed to the preprocessor's Drain miner.
+        """
+        sequences: List[List[str]] = []
+        for path in paths:
+            for batch in self.iter_file_batches(path):
+                if mine_templates:
+                    batch.mine_templates(None if max_sequences is None else max_sequences - len(sequences))
+                sequences.extend(batch.sequences(self.featurizer))
+                if max_sequences is not None and len(sequences) >= max_sequences:
+                    return sequences[:max_sequences]
+        return sequences
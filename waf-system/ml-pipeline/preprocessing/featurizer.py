@@ -0,0 +1,290 @@
+"""
+Sequence Featurizer
+Turns parsed log entries into model token sequences (and token ids) with one
+set of rules shared by training, serving and the demo scripts
+"""
+
+import logging
+import re
+import time
+from itertools import repeat
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from log_processor import BoundedCache, classify_user_agent
+
+FEATURIZER_VERSION = 3
+
+# Named rule sets; checkpoints store the resolved options, not just the name
+FEATURIZER_PRESETS = {
+    # Raw path, browser/tool family, agent token only when a user agent is present
+    'waf': {
+        'normalize_ids': False,
+        'agent_scheme': 'family',
+        'always_emit_agent': False,
+        'emit_flags': False,
+        'include_query': False
+    },
+    # Numeric IDs collapsed, coarse agent category, referer/error flag tokens
+    # (include_query adds a '?query' token, meant for subword tokenizers)
+    'pipeline': {
+        'normalize_ids': True,
+        'agent_scheme': 'category',
+        'always_emit_agent': True,
+        'emit_flags': True,
+        'include_query': False
+    },
+    # Demo script rules: raw path, browser/tool family with a case-insensitive
+    # python match, and an agent token even when the user agent is absent ('-')
+    'demo': {
+        'normalize_ids': False,
+        'agent_scheme': 'family_ci',
+        'always_emit_agent': True,
+        'emit_flags': False,
+        'include_query': False
+    },
+}
+DEFAULT_PRESET = 'waf'
+
+NUMERIC_ID_PATTERN = re.compile(r'/\d+')
+
+logger = logging.getLogger(__name__)
+
+def classify_agent_category(user_agent: str) -> str:
+    """Map a user agent to a coarse client category"""
+    if 'Mozilla' in user_agent:
+        return 'BROWSER'
+    lowered = user_agent.lower()
+    if 'curl' in lowered or 'wget' in lowered or 'python' in lowered:
+        return 'API_CLIENT'
+    return 'OTHER_AGENT'
+
+def classify_agent_family_ci(user_agent: str) -> str:
+    """Browser/tool family, matching python case-insensitively"""
+    if 'Mozilla' in user_agent:
+        return 'Mozilla'
+    if 'curl' in user_agent:
+        return 'curl'
+    if 'python' in user_agent.lower():
+        return 'python'
+    return 'Other-Agent'
+
+AGENT_SCHEMES = {
+    'family': classify_user_agent,
+    'family_ci': classify_agent_family_ci,
+    'category': classify_agent_category,
+}
+
+class SequenceFeaturizer:
+    """Builds token sequences from parsed log entries
+    
+    Rules are resolved once from a versioned config that is saved with model
+    checkpoints, so a model is always served with the featurization it was
+    trained on. Token sequences are cached per input shape (method, path,
+    status, agent, referer flag, query) and token ids per shape and vocabulary.
+    """
+    
+    def __init__(self, config: Optional[Dict[str, Any]] = None, cache_size: int = 10000):
+        config = dict(config or {})
+        version = config.pop('version', FEATURIZER_VERSION)
+        if version > FEATURIZER_VERSION:
+            raise ValueError(f"Featurizer config version {version} is newer than supported version {FEATURIZER_VERSION}")
+        preset = config.pop('preset', DEFAULT_PRESET)
+        if preset not in FEATURIZER_PRESETS:
+            raise ValueError(f"Unknown featurizer preset: {preset}")
+        options = dict(FEATURIZER_PRESETS[preset])
+        unknown = set(config) - set(options)
+        if unknown:
+            raise ValueError(f"Unknown featurizer options: {sorted(unknown)}")
+        options.update(config)
+        if options['agent_scheme'] not in AGENT_SCHEMES:
+            raise ValueError(f"Unknown agent scheme: {options['agent_scheme']}")
+            
+        self.preset = preset
+        self.options = options
+        self.normalize_ids = options['normalize_ids']
+        self.always_emit_agent = options['always_emit_agent']
+        self.emit_flags = options['emit_flags']
+        self.include_query = options['include_query']
+        self._classify_agent = AGENT_SCHEMES[options['agent_scheme']]
+        
+        self.sequence_cache = BoundedCache('sequence_shape', cache_size)
+        self.agent_cache = BoundedCache('user_agent', cache_size)
+        self.id_cache = BoundedCache('sequence_ids', cache_size)
+        self._id_cache_owner = None
+        
+        # Featurization cost counters
+        self.sequences_built = 0
+        self.featurize_seconds = 0.0
+        
+    @classmethod
+    def from_preset(cls, preset: str, cache_size: int = 10000) -> 'SequenceFeaturizer':
+        """Create a featurizer from a named rule set"""
+        return cls({'preset': preset}, cache_size=cache_size)
+        
+    @classmethod
+    def from_checkpoint(cls, config: Optional[Dict[str, Any]], expected: Optional[Dict[str, Any]] = None, cache_size: int = 10000) -> 'SequenceFeaturizer':
+        """Create the featurizer a checkpoint was trained with
+        
+        Checkpoints without a featurizer_config fall back to expected (or the
+        default preset) with a warning. When expected is given, a checkpoint
+        built with different token rules raises ValueError.
+        """
+        if config is None:
+            fallback = expected or {'preset': DEFAULT_PRESET}
+            logger.warning(f"Checkpoint has no featurizer_config; assuming {fallback}")
+            return cls(fallback, cache_size=cache_size)
+        featurizer = cls(config, cache_size=cache_size)
+        if expected is not None and featurizer.to_config() != cls(expected, cache_size=1).to_config():
+            raise ValueError(
+                f"Checkpoint featurizer {featurizer.to_config()} does not match the configured featurizer {cls(expected, cache_size=1).to_config()}"
+            )
+        return featurizer
+        
+    def to_config(self) -> Dict[str, Any]:
+        """Get the versioned config to store alongside a model checkpoint"""
+        return {'version': FEATURIZER_VERSION, 'preset': self.preset, **self.options}
+        
+    def _shape(self, method: Any, path: Any, status: Any, user_agent: Any, referer: Any, query: Any) -> Tuple:
+        """Reduce raw field values to the cache key the token rules depend on"""
+        has_referer = bool(referer and referer != '-') if self.emit_flags else False
+        query = (query or '') if self.include_query else ''
+        if user_agent and user_agent != '-':
+            agent = self.agent_cache.get_or_compute(user_agent, self._classify_agent)
+        elif self.always_emit_agent:
+            agent = self._classify_agent(user_agent or '')
+        else:
+            agent = None
+        return (method, path, status, agent, has_referer, query)
+        
+    def _build(self, shape: Tuple) -> Tuple[str, ...]:
+        """Apply the token rules to one input shape"""
+        method, path, status, agent, has_referer, query = shape
+        if self.normalize_ids:
+            path = NUMERIC_ID_PATTERN.sub('/<ID>', path)
+        tokens = [method, path]
+        if query:
+            tokens.append('?' + query)
+        tokens.append(str(status))
+        if self.emit_flags:
+            if has_referer:
+                tokens.append('HAS_REFERER')
+            if isinstance(status, int) and status >= 400:
+                tokens.append('ERROR_STATUS')
+        if agent is not None:
+            tokens.append(agent)
+        return tuple(tokens)
+        
+    def _tokens(self, shape: Tuple) -> Tuple[str, ...]:
+        tokens = self.sequence_cache.get(shape)
+        if tokens is None:
+            tokens = self._build(shape)
+            self.sequence_cache.put(shape, tokens)
+        return tokens
+        
+    def _parsed_shape(self, parsed: Any) -> Tuple:
+        return self._shape(
+            parsed.get('method', 'GET'),
+            parsed.get('path_only', '/'),
+            parsed.get('status', 200),
+            parsed.get('http_user_agent', ''),
+            parsed.get('http_referer') if self.emit_flags else None,
+            parsed.get('query_string') if self.include_query else None
+        )
+        
+    def featurize(self, parsed: Any) -> List[str]:
+        """Create the token sequence for one parsed log entry"""
+        start = time.perf_counter()
+        tokens = list(self._tokens(self._parsed_shape(parsed)))
+        self.featurize_seconds += time.perf_counter() - start
+        self.sequences_built += 1
+        return tokens
+        
+    def featurize_processed(self, processed: Any) -> List[str]:
+        """Create the token sequence for a processed log entry"""
+        return self.featurize(processed['parsed'])
+        
+    def featurize_many(self, entries: Iterable[Any]) -> List[List[str]]:
+        """Create token sequences for many parsed log entries"""
+        return [self.featurize(parsed) for parsed in entries]
+        
+    def featurize_columns(self, batch: Any) -> List[List[str]]:
+        """Create token sequences for every row of a columnar batch"""
+        start = time.perf_counter()
+        methods = batch.column('method')
+        paths = batch.column('path_only')
+        statuses = batch.column('status')
+        agents = batch.column('http_user_agent')
+        referers = batch.column('http_referer') if self.emit_flags else repeat(None)
+        queries = batch.column('query_string') if self.include_query else repeat(None)
+        
+        # Rows repeat heavily: resolve each distinct raw row once
+        table: Dict[Tuple, Tuple[str, ...]] = {}
+        sequences = []
+        for row in zip(methods, paths, statuses, agents, referers, queries):
+            tokens = table.get(row)
+            if tokens is None:
+                method, path, status, agent, referer, query = row
+                tokens = table[row] = self._tokens(self._shape(
+                    'GET' if method is None else method,
+                    '/' if path is None else path,
+                    200 if status is None else status,
+                    agent,
+                    referer,
+                    query
+                ))
+            sequences.append(list(tokens))
+        self.featurize_seconds += time.perf_counter() - start
+        self.sequences_built += len(sequences)
+        return sequences
+        
+    def _token_ids(self, shape: Tuple, tokenizer: Any) -> np.ndarray:
+        """Token ids for one input shape (without [CLS]/[SEP])"""
+        # Ids depend on the vocabulary: drop them whenever it changes
+        owner = (id(tokenizer), id(tokenizer.token_to_id), tokenizer.next_id)
+        if owner != self._id_cache_owner:
+            self.id_cache.clear()
+            self._id_cache_owner = owner
+        ids = self.id_cache.get(shape)
+        if ids is None:
+            ids = np.array(tokenizer.convert_tokens_to_ids(list(self._tokens(shape))), dtype=np.int64)
+            self.id_cache.put(shape, ids)
+        return ids
+        
+    def encode_batch(self, entries: List[Any], tokenizer: Any, max_length: int = 128, buffer: Any = None) -> Dict[str, Any]:
+        """Featurize and encode parsed log entries straight into token-id tensors
+        
+        Returns input_ids and attention_mask of shape [len(entries), max_length],
+        identical to stacking tokenizer.encode() of each featurized sequence.
+        An EncodeBuffer is reused for the output when given.
+        """
+        if tokenizer.is_subword:
+            # Subword pieces come from the Rust batch encoder
+            return tokenizer.encode_batch(self.featurize_many(entries), max_length=max_length, buffer=buffer)
+            
+        start = time.perf_counter()
+        id_sequences = [self._token_ids(self._parsed_shape(parsed), tokenizer) for parsed in entries]
+        encoded = tokenizer.encode_ids_batch(id_sequences, max_length=max_length, buffer=buffer)
+        self.featurize_seconds += time.perf_counter() - start
+        self.sequences_built += len(entries)
+        return encoded
+        
+    def stats(self) -> Dict[str, Any]:
+        """Get featurization cost metrics"""
+        return {
+            'config': self.to_config(),
+            'sequences_built': self.sequences_built,
+            'featurize_seconds': self.featurize_seconds,
+            'avg_featurize_us': self.featurize_seconds * 1e6 / self.sequences_built if self.sequences_built else 0.0
+        }
+        
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get hit-rate metrics for the featurizer caches"""
+        return {cache.name: cache.stats() for cache in (self.sequence_cache, self.agent_cache, self.id_cache)}
+        
+    def clear_caches(self):
+        """Clear all featurizer caches"""
+        self.sequence_cache.clear()
+        self.agent_cache.clear()
+        self.id_cache.clear()
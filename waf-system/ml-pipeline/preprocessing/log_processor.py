@@ -11,9 +11,339 @@ from typing import Dict, List, Any, Optional, Tuple
 from urllib.parse import parse_qs, urlparse
 from datetime import datetime
 import hashlib
-from drain3 import TemplateMiner
-from drain3.template_miner_config import TemplateMinerConfig
+from collections import OrderedDict
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+    _JSON_DECODE_ERRORS: Tuple[type, ...] = (orjson.JSONDecodeError, ValueError)
+except ImportError:
+    _json_loads = json.loads
+    _JSON_DECODE_ERRORS = (json.JSONDecodeError, ValueError)
+
+_MISSING = object()
+
+# Canonical log field -> JSON key(s) in structured access logs. Candidates are
+# tried in order; dotted keys address nested objects. Matches the common nginx
+# `log_format ... escape=json` layouts.
+DEFAULT_JSON_FIELD_MAP: Dict[str, Any] = {
+    'remote_addr': ['remote_addr', 'client_ip'],
+    'remote_user': 'remote_user',
+    'time_local': ['time_local', 'time_iso8601', 'timestamp'],
+    'request': 'request',
+    'status': 'status',
+    'body_bytes_sent': ['body_bytes_sent', 'bytes_sent'],
+    'http_referer': ['http_referer', 'referer'],
+    'http_user_agent': ['http_user_agent', 'user_agent'],
+    'request_time': 'request_time',
+    # Used to rebuild the request line when `request` is not logged
+    'request_method': ['request_method', 'method'],
+    'request_uri': ['request_uri', 'uri'],
+    'server_protocol': ['server_protocol', 'protocol'],
+}
+
+LOG_FORMATS = ('auto', 'combined', 'json')
+
+def classify_user_agent(user_agent: str) -> str:
+    """Extract browser/tool name from a user agent"""
+    if 'Mozilla' in user_agent:
+        return 'Mozilla'
+    elif 'curl' in user_agent:
+        return 'curl'
+    elif 'python' in user_agent:
+        return 'python'
+    else:
+        return 'Other-Agent'
+
+class BoundedCache:
+    """Bounded LRU cache with hit/miss instrumentation
+    
+    Used to memoize pure per-shape computations (URL parsing, user-agent
+    classification, Drain matches) that repeat constantly in production traffic.
+    Cached values are shared between callers and must be treated as read-only.
+    """
+    
+    def __init__(self, name: str, max_size: int = 10000):
+        self.name = name
+        self.max_size = max_size
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+    def get(self, key: Any, default: Any = None) -> Any:
+        """Look up a key, counting the hit or miss"""
+        value = self._data.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+        
+    def put(self, key: Any, value: Any):
+        """Store a value, evicting the least recently used entry when full"""
+        if self.max_size <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+            
+    def get_or_compute(self, key: Any, compute) -> Any:
+        """Return the cached value for key, computing and storing it on a miss"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute(key)
+            self.put(key, value)
+        return value
+        
+    def clear(self):
+        """Drop all cached entries (counters are kept)"""
+        self._data.clear()
+        
+    def __len__(self) -> int:
+        return len(self._data)
+        
+    def stats(self) -> Dict[str, Any]:
+        """Get cache size and hit-rate metrics"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+class SlottedRecord:
+    """Base for compact __slots__ records with dict-compatible access
+    
+    Subclasses list their known keys in FIELDS; unset slots read as missing
+    keys and may be filled lazily by _derive(). Unknown keys go to a small
+    overflow dict so arbitrary extra fields are still accepted.
+    """
+    
+    __slots__ = ('_extra',)
+    FIELDS: Tuple[str, ...] = ()
+    _FIELD_SET: frozenset = frozenset()
+    
+    def __getitem__(self, key: str) -> Any:
+        if key in self._FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+            if self._derive(key):
+                try:
+                    return getattr(self, key)
+                except AttributeError:
+                    pass
+            raise KeyError(key)
+        extra = self._extra
+        if extra is not None and key in extra:
+            return extra[key]
+        raise KeyError(key)
+        
+    def __setitem__(self, key: str, value: Any):
+        if key in self._FIELD_SET:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+            
+    def _derive(self, key: str) -> bool:
+        """Compute a missing field; returns True if a computation ran"""
+        return False
+        
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+            
+    def __contains__(self, key: object) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+        
+    def keys(self) -> List[str]:
+        keys = [key for key in self.FIELDS if key in self]
+        if self._extra:
+            keys.extend(self._extra)
+        return keys
+        
+    def values(self) -> List[Any]:
+        return [self[key] for key in self.keys()]
+        
+    def items(self) -> List[Tuple[str, Any]]:
+        return [(key, self[key]) for key in self.keys()]
+        
+    def __iter__(self):
+        return iter(self.keys())
+        
+    def __len__(self) -> int:
+        return len(self.keys())
+        
+    def __bool__(self) -> bool:
+        # Records are always truthy; avoids computing every field via __len__
+        return True
+        
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to a plain dict with all fields computed"""
+        return dict(self.items())
+        
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+class ParsedLogEntry(SlottedRecord):
+    """Compact parsed log entry whose derived fields are computed on first access
+    
+    Raw regex fields are stored as-is; derived fields (method, path_only,
+    query_params, numeric status, path_depth, ...) are only computed when read.
+    Values match the previous eagerly enriched dict.
+    """
+    
+    FIELDS = (
+        'remote_addr', 'remote_user', 'time_local', 'request', 'status', 'body_bytes_sent',
+        'http_referer', 'http_user_agent', 'request_time',
+        'method', 'path', 'protocol', 'path_only', 'query_string', 'query_params',
+        'is_error', 'method_category', 'path_depth'
+    )
+    _FIELD_SET = frozenset(FIELDS)
+    # Numeric conversion is deferred: the raw strings are kept aside until read
+    _RAW_NUMERIC = {'status': '_raw_status', 'body_bytes_sent': '_raw_body_bytes_sent'}
+    
+    __slots__ = FIELDS + ('_raw_status', '_raw_body_bytes_sent', '_parser', '_derived')
+    
+    def __init__(self, fields: Dict[str, Any], parser: 'HTTPLogParser'):
+        self._extra = None
+        self._parser = parser
+        self._derived = 0
+        raw_numeric = self._RAW_NUMERIC
+        for key, value in fields.items():
+            if key in raw_numeric:
+                setattr(self, raw_numeric[key], value)
+            else:
+                self[key] = value
+                
+    def materialize(self) -> 'ParsedLogEntry':
+        """Compute all derived fields"""
+        for bit, method_name in self._DERIVER_ORDER:
+            if not self._derived & bit:
+                self._derived |= bit
+                getattr(self, method_name)()
+        return self
+        
+    def _derive(self, key: str) -> bool:
+        deriver = self._DERIVERS.get(key)
+        if deriver is None:
+            return False
+        bit, method_name = deriver
+        if self._derived & bit:
+            return False
+        self._derived |= bit
+        getattr(self, method_name)()
+        return True
+        
+    def _derive_request(self):
+        """Parse request line"""
+        request = self.get('request', '')
+        if request:
+            request_parts = request.split(' ', 2)
+            if len(request_parts) >= 2:
+                self.method = request_parts[0]
+                self.path = request_parts[1]
+                if len(request_parts) == 3:
+                    self.protocol = request_parts[2]
+                    
+    def _derive_url(self):
+        """Parse URL components"""
+        path = self.get('path', '')
+        if path:
+            self.path_only, self.query_string = self._parser.url_cache.get_or_compute(path, self._parser._split_url)
+            
+    def _derive_query_params(self):
+        """Parse query parameters"""
+        if 'query_string' in self:
+            query_string = self.query_string
+            self.query_params = self._parser.query_cache.get_or_compute(query_string, self._parser._parse_query) if query_string else {}
+            
+    def _derive_numeric(self):
+        """Convert numeric fields"""
+        for field, raw_slot in self._RAW_NUMERIC.items():
+            try:
+                value = getattr(self, raw_slot)
+            except AttributeError:
+                continue
+            try:
+                value = int(value)
+            except ValueError:
+                pass
+            setattr(self, field, value)
+            
+    def _derive_is_error(self):
+        self.is_error = self.get('status', 200) >= 400
+        
+    def _derive_method_category(self):
+        self.method_category = self._parser._categorize_method(self.get('method', ''))
+        
+    def _derive_path_depth(self):
+        path = self.get('path', '')
+        self.path_depth = len([p for p in path.split('/') if p]) if path else 0
+        
+    _DERIVERS = {
+        'method': (1, '_derive_request'),
+        'path': (1, '_derive_request'),
+        'protocol': (1, '_derive_request'),
+        'path_only': (2, '_derive_url'),
+        'query_string': (2, '_derive_url'),
+        'query_params': (4, '_derive_query_params'),
+        'status': (8, '_derive_numeric'),
+        'body_bytes_sent': (8, '_derive_numeric'),
+        'is_error': (16, '_derive_is_error'),
+        'method_category': (32, '_derive_method_category'),
+        'path_depth': (64, '_derive_path_depth'),
+    }
+    _DERIVER_ORDER = tuple(dict.fromkeys(_DERIVERS.values()))
+
+class ProcessedLogEntry(SlottedRecord):
+    """Compact processed log entry whose ML feature dict is only built when read"""
+    
+    FIELDS = (
+        'parsed', 'request_signature', 'normalized_signature',
+        'template', 'template_id', 'cluster_count', 'features'
+    )
+    _FIELD_SET = frozenset(FIELDS)
+    
+    __slots__ = FIELDS + ('_feature_extractor',)
+    
+    def __init__(
+        self,
+        parsed: Any,
+        request_signature: str,
+        normalized_signature: str,
+        template: str,
+        template_id: int,
+        cluster_count: int,
+        feature_extractor=None
+    ):
+        self._extra = None
+        self.parsed = parsed
+        self.request_signature = request_signature
+        self.normalized_signature = normalized_signature
+        self.template = template
+        self.template_id = template_id
+        self.cluster_count = cluster_count
+        self._feature_extractor = feature_extractor
+        
+    def _derive(self, key: str) -> bool:
+        if key != 'features' or self._feature_extractor is None:
+            return False
+        self.features = self._feature_extractor(self.parsed)
+        return True
+        
 class HTTPLogParser:
     """Parser for HTTP access logs in various formats"""
     
@@ -32,11 +362,31 @@ class HTTPLogParser:
         r'(?:\s+(?P<request_time>[\d\.]+))?$'
     )
     
-    def __init__(self):
+    def __init__(self, cache_size: int = 10000, log_format: str = 'auto', json_field_map: Optional[Dict[str, Any]] = None):
+        if log_format not in LOG_FORMATS:
+            raise ValueError(f"Unknown log format: {log_format}")
         self.logger = logging.getLogger(__name__)
+        self.log_format = log_format
+        self.json_field_map = json_field_map or DEFAULT_JSON_FIELD_MAP
         
-    def parse_log_line(self, log_line: str) -> Optional[Dict[str, Any]]:
+        # Memoized URL splitting and query parsing keyed on the raw strings
+        self.url_cache = BoundedCache('url_parse', cache_size)
+        self.query_cache = BoundedCache('query_params', cache_size)
+        
+    @staticmethod
+    def detect_format(sample_line: str) -> str:
+        """Detect the log format of a source from one of its lines"""
+        return 'json' if sample_line.lstrip().startswith('{') else 'combined'
+        
+    def parse_log_line(self, log_line: str, log_format: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """Parse a single log line into structured data"""
+        log_format = log_format or self.log_format
+        if log_format == 'json':
+            parsed = self.parse_json_line(log_line)
+            if parsed is None:
+                self.logger.warning(f"Could not parse JSON log line: {log_line}")
+            return parsed
+            
         # Try different log formats
         for pattern in [self.NGINX_COMBINED, self.APACHE_COMBINED]:
             match = pattern.match(log_line)
@@ -45,50 +395,85 @@ class HTTPLogParser:
                 return self._enrich_parsed_log(parsed)
                 
         # If no pattern matches, try to parse as JSON
+        if log_format == 'auto':
+            parsed = self.parse_json_line(log_line)
+            if parsed is not None:
+                return parsed
+                
+        self.logger.warning(f"Could not parse log line: {log_line}")
+        return None
+        
+    def parse_json_line(self, log_line: str) -> Optional[Dict[str, Any]]:
+        """Parse a structured JSON log line into the same fields as the combined format"""
+        fields = self.json_to_fields(log_line)
+        return self._enrich_parsed_log(fields) if fields is not None else None
+        
+    def json_to_fields(self, log_line: str) -> Optional[Dict[str, str]]:
+        """Decode a JSON log line and map it onto combined-format field names (None without a request)"""
         try:
-            return json.loads(log_line)
-        except json.JSONDecodeError:
-            pass
+            record = _json_loads(log_line)
+        except _JSON_DECODE_ERRORS:
+            return None
+        if not isinstance(record, dict):
+            return None
             
-        self.logger.warning(f"Could not parse log line: {log_line}")
+        fields = {}
+        for field, keys in self.json_field_map.items():
+            value = self._lookup_json(record, keys)
+            if value is not None:
+                fields[field] = value if isinstance(value, str) else str(value)
+                
+        # Rebuild the request line from its parts when only those are logged
+        method = fields.pop('request_method', None)
+        uri = fields.pop('request_uri', None)
+        protocol = fields.pop('server_protocol', None)
+        if 'request' not in fields:
+            if not (method and uri):
+                # Not an access log record (e.g. an error or application log line)
+                return None
+            fields['request'] = f"{method} {uri} {protocol}" if protocol else f"{method} {uri}"
+        return fields
+        
+    @staticmethod
+    def _lookup_json(record: Dict[str, Any], keys: Any) -> Any:
+        """Find the first present key (dotted keys address nested objects)"""
+        for key in ([keys] if isinstance(keys, str) else keys):
+            value: Any = record
+            for part in key.split('.'):
+                if not isinstance(value, dict) or part not in value:
+                    value = None
+                    break
+                value = value[part]
+            if value is not None:
+                return value
         return None
         
     def _enrich_parsed_log(self, parsed: Dict[str, str]) -> Dict[str, Any]:
-        """Enrich parsed log with additional fields"""
-        enriched = parsed.copy()
+        """Enrich parsed log with additional fields (computed lazily on first access)"""
+        return ParsedLogEntry(parsed, self)
         
-        # Parse request line
-        request = parsed.get('request', '')
-        if request:
-            request_parts = request.split(' ', 2)
-            if len(request_parts) >= 2:
-                enriched['method'] = request_parts[0]
-                enriched['path'] = request_parts[1]
-                if len(request_parts) == 3:
-                    enriched['protocol'] = request_parts[2]
-                    
-        # Parse URL components
-        path = enriched.get('path', '')
-        if path:
-            parsed_url = urlparse(path)
-            enriched['path_only'] = parsed_url.path
-            enriched['query_string'] = parsed_url.query
-            enriched['query_params'] = parse_qs(parsed_url.query) if parsed_url.query else {}
-            
-        # Convert numeric fields
-        for field in ['status', 'body_bytes_sent']:
-            if field in enriched:
-                try:
-                    enriched[field] = int(enriched[field])
-                except ValueError:
-                    pass
-                    
-        # Add derived features
-        enriched['is_error'] = enriched.get('status', 200) >= 400
-        enriched['method_category'] = self._categorize_method(enriched.get('method', ''))
-        enriched['path_depth'] = len([p for p in path.split('/') if p]) if path else 0
+    @staticmethod
+    def _split_url(path: str) -> Tuple[str, str]:
+        """Split a request target into path and query string"""
+        parsed_url = urlparse(path)
+        return parsed_url.path, parsed_url.query
+        
+    @staticmethod
+    def _parse_query(query_string: str) -> Dict[str, List[str]]:
+        """Parse a query string into a parameter dict"""
+        return parse_qs(query_string)
         
-        return enriched
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get URL parsing cache metrics"""
+        return {
+            self.url_cache.name: self.url_cache.stats(),
+            self.query_cache.name: self.query_cache.stats()
+        }
+        
+    def clear_caches(self):
+        """Clear URL parsing caches"""
+        self.url_cache.clear()
+        self.query_cache.clear()
         
     def _categorize_method(self, method: str) -> str:
         """Categorize HTTP method"""
@@ -131,30 +516,70 @@ class LogNormalizer:
             normalized = pattern.sub(replacement, normalized)
         return normalized
 
+DEFAULT_DRAIN_PARAMS = {
+    'drain_depth': 4,
+    'sim_th': 0.4,
+    'max_children': 100,
+    'max_clusters': 1000
+}
+
 class TemplateMiningEngine:
     """Template mining using Drain algorithm"""
     
-    def __init__(self, config_path: Optional[str] = None):
+    def __init__(self, config_path: Optional[str] = None, cache_size: int = 10000, drain_params: Optional[Dict[str, Any]] = None):
+        # Drain is imported on use so parsing-only users (ingestion, columnar featurization) skip it
+        from drain3 import TemplateMiner
+        from drain3.template_miner_config import TemplateMinerConfig
+        
         # Configure Drain
         if (config_path):
             config = TemplateMinerConfig()
             config.load(config_path)
         else:
             config = TemplateMinerConfig()
-            config.drain_depth = 4
-            config.sim_th = 0.4
-            config.max_children = 100
-            config.max_clusters = 1000
-            
+            for name, value in {**DEFAULT_DRAIN_PARAMS, **(drain_params or {})}.items():
+                setattr(config, name, value)
+                
+        # Effective Drain parameters (shipped with inference artifacts)
+        self.drain_params = {name: getattr(config, name) for name in DEFAULT_DRAIN_PARAMS}
         self.template_miner = TemplateMiner(config=config)
         self.logger = logging.getLogger(__name__)
         
+        # Drain matches for identical normalized signatures. Only valid while the
+        # Drain state is unchanged, so it is cleared whenever a cluster is created
+        # or a template changes; hits still count towards the matched cluster.
+        self.match_cache = BoundedCache('drain_match', cache_size)
+        
     def extract_template(self, log_message: str) -> Tuple[str, int, int]:
-        """Extract template from log message
+        """Extract template from log message, reusing the cached match when possible"""
+        cached = self.match_cache.get(log_message)
+        if cached is not None:
+            clusters = self.template_miner.drain.id_to_cluster
+            cluster = clusters.get(cached[1])
+            if cluster is not None:
+                # Same bookkeeping as a Drain match: grow the cluster and touch it in Drain's LRU
+                cluster.size += 1
+                clusters[cached[1]]
+                return cached
+            # Cluster evicted (max_clusters): Drain will assign a new id
+            self.match_cache.clear()
+            
+        result = self.template_miner.add_log_message(log_message)
+        change_type = result.get("change_type") if isinstance(result, dict) else getattr(result, "change_type", None)
+        if change_type != "none":
+            # Drain snapshot changed: earlier matches may carry stale templates
+            self.match_cache.clear()
+            
+        extracted = self._parse_drain_result(result)
+        if extracted[1] != -1:
+            self.match_cache.put(log_message, extracted)
+        return extracted
+        
+    def _parse_drain_result(self, result: Any) -> Tuple[str, int, int]:
+        """Normalize a Drain3 result
         Supports Drain3 return structure (dict) and falls back to attribute-style if present.
         Returns (template, cluster_id, cluster_count).
         """
-        result = self.template_miner.add_log_message(log_message)
         # Drain3 returns a Mapping with keys: change_type, cluster_id, cluster_size, template_mined, cluster_count
         try:
             if isinstance(result, dict):
@@ -179,21 +604,27 @@ class TemplateMiningEngine:
         for cluster_id, cluster in self.template_miner.drain.clusters.items():
             templates[cluster_id] = cluster.get_template()
         return templates
+        
+    def clear_cache(self):
+        """Clear cached Drain matches (call after loading or replacing a Drain snapshot)"""
+        self.match_cache.clear()
 
 class LogPreprocessor:
     """Main preprocessing pipeline"""
     
-    def __init__(self):
-        self.parser = HTTPLogParser()
+    def __init__(self, cache_size: int = 10000, log_format: str = 'auto', json_field_map: Optional[Dict[str, Any]] = None, drain_params: Optional[Dict[str, Any]] = None):
+        self.parser = HTTPLogParser(cache_size=cache_size, log_format=log_format, json_field_map=json_field_map)
         self.normalizer = LogNormalizer()
-        self.template_miner = TemplateMiningEngine()
+        self.template_miner = TemplateMiningEngine(cache_size=cache_size, drain_params=drain_params)
         self.logger = logging.getLogger(__name__)
         
-    def process_log_entry(self, raw_log: str) -> Optional[Dict[str, Any]]:
-        """Process a single log entry through the full pipeline"""
+    def process_log_entry(self, raw_log: str, log_format: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Process a single log entry through the full pipeline
+        log_format overrides the parser's format (e.g. as detected per source).
+        """
         try:
             # Parse the log line
-            parsed = self.parser.parse_log_line(raw_log)
+            parsed = self.parser.parse_log_line(raw_log, log_format)
             if not parsed:
                 return None
                 
@@ -204,16 +635,16 @@ class LogPreprocessor:
             # Extract template
             template, cluster_id, cluster_count = self.template_miner.extract_template(normalized_signature)
             
-            # Create processed entry
-            processed = {
-                'parsed': parsed,
-                'request_signature': request_signature,
-                'normalized_signature': normalized_signature,
-                'template': template,
-                'template_id': cluster_id,
-                'cluster_count': cluster_count,
-                'features': self._extract_features(parsed)
-            }
+            # Create processed entry; features are extracted on first access
+            processed = ProcessedLogEntry(
+                parsed=parsed,
+                request_signature=request_signature,
+                normalized_signature=normalized_signature,
+                template=template,
+                template_id=cluster_id,
+                cluster_count=cluster_count,
+                feature_extractor=self._extract_features
+            )
             
             return processed
             
@@ -273,6 +704,17 @@ class LogPreprocessor:
             'total_templates': len(templates),
             'templates': templates
         }
+        
+    def cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Get hit-rate metrics for all preprocessing caches"""
+        stats = self.parser.cache_stats()
+        stats[self.template_miner.match_cache.name] = self.template_miner.match_cache.stats()
+        return stats
+        
+    def clear_caches(self):
+        """Clear all preprocessing caches"""
+        self.parser.clear_caches()
+        self.template_miner.clear_cache()
 
 if __name__ == "__main__":
     # Test the preprocessor
@@ -290,4 +732,5 @@ if __name__ == "__main__":
             print(f"Template ID: {processed['template_id']}")
             print(f"Template: {processed['template']}")
             print(f"Features: {json.dumps(processed['features'], indent=2)}")
+            print(f"Parsed: {json.dumps(processed['parsed'].to_dict(), indent=2)}")
             print("-" * 50)
@@ -0,0 +1,295 @@
+"""
+Knowledge Distillation for WAF Transformer
+Trains a small student model to reproduce a trained teacher's anomaly scores
+and CLS representations for low-latency serving
+"""
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, TensorDataset
+from typing import Dict, List, Any, Optional, Tuple
+import numpy as np
+import logging
+import time
+from datetime import datetime
+
+from waf_model import WAFTransformer, WAFTransformerConfig, WAFTokenizer
+
+# Student sizes (the teacher default is 4 layers, hidden 256, FFN 1024)
+STUDENT_PRESETS = {
+    'tiny': {'hidden_size': 64, 'num_hidden_layers': 1, 'num_attention_heads': 2, 'intermediate_size': 256},
+    'small': {'hidden_size': 128, 'num_hidden_layers': 2, 'num_attention_heads': 4, 'intermediate_size': 512},
+}
+
+def create_student_config(teacher_config: WAFTransformerConfig, preset: str = 'small', **overrides) -> WAFTransformerConfig:
+    """Student config sharing the teacher's vocabulary and positions"""
+    if preset not in STUDENT_PRESETS:
+        raise ValueError(f"Unknown student preset: {preset}")
+    config = dict(teacher_config.__dict__)
+    # The teacher's early-exit heads do not carry over to a different depth
+    config['exit_layers'] = []
+    config.update(STUDENT_PRESETS[preset])
+    config.update(overrides)
+    return WAFTransformerConfig(**config)
+
+def parameter_bytes(model: nn.Module) -> int:
+    """Memory held by a model's parameters and buffers"""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+class DistillationTrainer:
+    """Distills a trained WAF teacher into a smaller student
+    
+    The student is trained on the teacher's outputs for the training corpus:
+    anomaly score logits (MSE), the pooled CLS representation (MSE through a
+    learned projection to the teacher width, discarded after training) and
+    optionally the MLM distribution at unpadded positions (temperature KL),
+    so the student keeps a usable MLM head.
+    """
+    
+    def __init__(
+        self,
+        teacher: WAFTransformer,
+        student: WAFTransformer,
+        tokenizer: WAFTokenizer,
+        device: str = 'cpu',
+        learning_rate: float = 1e-3,
+        weight_decay: float = 0.01,
+        score_weight: float = 1.0,
+        cls_weight: float = 1.0,
+        mlm_weight: float = 0.5,
+        temperature: float = 2.0,
+        max_length: int = 128,
+        featurizer_config: Optional[Dict[str, Any]] = None
+    ):
+        if student.config.vocab_size != teacher.config.vocab_size:
+            raise ValueError("Student and teacher must share the tokenizer vocabulary")
+        self.teacher = teacher.to(device).eval()
+        for param in self.teacher.parameters():
+            param.requires_grad_(False)
+        self.student = student.to(device)
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_length = max_length
+        self.featurizer_config = featurizer_config
+        
+        # Loss weights
+        self.score_weight = score_weight
+        self.cls_weight = cls_weight
+        self.mlm_weight = mlm_weight
+        self.temperature = temperature
+        
+        # Maps student CLS vectors into the teacher's representation space
+        self.projection = nn.Linear(student.config.hidden_size, teacher.config.hidden_size).to(device)
+        self.optimizer = torch.optim.AdamW(
+            list(self.student.parameters()) + list(self.projection.parameters()),
+            lr=learning_rate,
+            weight_decay=weight_decay
+        )
+        
+        self.training_history = []
+        self.logger = logging.getLogger(__name__)
+        
+    def build_dataloader(self, sequences: List[List[str]], batch_size: int = 64, shuffle: bool = True) -> DataLoader:
+        """Encode token sequences into an (input_ids, attention_mask) loader"""
+        encoded = self.tokenizer.encode_batch(sequences, max_length=self.max_length)
+        dataset = TensorDataset(encoded['input_ids'], encoded['attention_mask'])
+        return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle)
+        
+    @staticmethod
+    def _trim(input_ids: torch.Tensor, attention_mask: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Drop padding columns beyond the longest sequence of the batch"""
+        length = max(1, int(attention_mask.sum(dim=1).max()))
+        return input_ids[:, :length], attention_mask[:, :length]
+        
+    @staticmethod
+    def _heads(model: WAFTransformer, hidden_states: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Pooled CLS representation and anomaly score logit"""
+        pooled = model.layer_norm(hidden_states[:, 0, :])
+        # anomaly_head ends in a Sigmoid: distill the pre-sigmoid logit
+        logit = model.anomaly_head[:-1](pooled).squeeze(-1)
+        return pooled, logit
+        
+    def _losses(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> Dict[str, torch.Tensor]:
+        with torch.no_grad():
+            teacher_hidden = self.teacher.encode(input_ids, attention_mask, fast_path=True)
+            teacher_cls, teacher_logit = self._heads(self.teacher, teacher_hidden)
+            
+        student_hidden = self.student.encode(input_ids, attention_mask)
+        student_cls, student_logit = self._heads(self.student, student_hidden)
+        
+        losses = {
+            'score_loss': F.mse_loss(student_logit, teacher_logit),
+            'cls_loss': F.mse_loss(self.projection(student_cls), teacher_cls)
+        }
+        if self.mlm_weight > 0:
+            # Soft MLM targets at unpadded positions only
+            positions = attention_mask.bool()
+            with torch.no_grad():
+                teacher_logits = self.teacher.mlm_head(teacher_hidden[positions]) / self.temperature
+            student_logits = self.student.mlm_head(student_hidden[positions]) / self.temperature
+            losses['mlm_loss'] = F.kl_div(
+                F.log_softmax(student_logits, dim=-1),
+                F.log_softmax(teacher_logits, dim=-1),
+                log_target=True,
+                reduction='batchmean'
+            ) * self.temperature ** 2
+        else:
+            losses['mlm_loss'] = torch.zeros((), device=input_ids.device)
+            
+        losses['total_loss'] = (
+            self.score_weight * losses['score_loss'] +
+            self.cls_weight * losses['cls_loss'] +
+            self.mlm_weight * losses['mlm_loss']
+        )
+        return losses
+        
+    def distill_epoch(self, dataloader: DataLoader) -> Dict[str, float]:
+        """Train the student for one epoch"""
+        self.student.train()
+        totals: Dict[str, float] = {}
+        num_batches = 0
+        
+        for input_ids, attention_mask in dataloader:
+            self.optimizer.zero_grad()
+            input_ids, attention_mask = self._trim(input_ids.to(self.device), attention_mask.to(self.device))
+            losses = self._losses(input_ids, attention_mask)
+            losses['total_loss'].backward()
+            torch.nn.utils.clip_grad_norm_(self.student.parameters(), max_norm=1.0)
+            self.optimizer.step()
+            
+            for name, value in losses.items():
+                totals[name] = totals.get(name, 0.0) + value.item()
+            num_batches += 1
+            
+        return {name: total / max(1, num_batches) for name, total in totals.items()}
+        
+    def evaluate(self, dataloader: DataLoader, threshold: float = 0.5) -> Dict[str, float]:
+        """Agreement between student and teacher on held-out sequences"""
+        self.student.eval()
+        teacher_scores, student_scores, cosines = [], [], []
+        
+        with torch.no_grad():
+            for input_ids, attention_mask in dataloader:
+                input_ids, attention_mask = self._trim(input_ids.to(self.device), attention_mask.to(self.device))
+                teacher_cls, teacher_logit = self._heads(self.teacher, self.teacher.encode(input_ids, attention_mask, fast_path=True))
+                student_cls, student_logit = self._heads(self.student, self.student.encode(input_ids, attention_mask, fast_path=True))
+                teacher_scores.append(torch.sigmoid(teacher_logit).cpu())
+                student_scores.append(torch.sigmoid(student_logit).cpu())
+                cosines.append(F.cosine_similarity(self.projection(student_cls), teacher_cls, dim=-1).cpu())
+                
+        teacher_scores = torch.cat(teacher_scores).numpy()
+        student_scores = torch.cat(student_scores).numpy()
+        # Flag agreement at the serving threshold and at the teacher's own 99th percentile
+        teacher_p99 = np.percentile(teacher_scores, 99)
+        return {
+            'sequences': len(teacher_scores),
+            'agreement_rate': float(np.mean((teacher_scores > threshold) == (student_scores > threshold))),
+            'agreement_rate_p99': float(np.mean((teacher_scores > teacher_p99) == (student_scores > np.percentile(student_scores, 99)))),
+            'score_mae': float(np.mean(np.abs(teacher_scores - student_scores))),
+            'score_correlation': float(np.corrcoef(teacher_scores, student_scores)[0, 1]) if teacher_scores.std() > 0 and student_scores.std() > 0 else 0.0,
+            'cls_cosine': float(torch.cat(cosines).mean())
+        }
+        
+    def distill(
+        self,
+        sequences: List[List[str]],
+        num_epochs: int = 5,
+        batch_size: int = 64,
+        val_split: float = 0.1
+    ) -> Dict[str, Any]:
+        """Distill on a token-sequence corpus and report agreement on a held-out split"""
+        start_time = time.time()
+        order = np.random.permutation(len(sequences))
+        val_size = max(1, int(len(sequences) * val_split))
+        val_sequences = [sequences[i] for i in order[:val_size]]
+        train_sequences = [sequences[i] for i in order[val_size:]]
+        
+        train_loader = self.build_dataloader(train_sequences, batch_size=batch_size)
+        val_loader = self.build_dataloader(val_sequences, batch_size=batch_size, shuffle=False)
+        
+        for epoch in range(num_epochs):
+            train_metrics = self.distill_epoch(train_loader)
+            val_metrics = self.evaluate(val_loader)
+            self.training_history.append({'epoch': epoch + 1, 'train': train_metrics, 'val': val_metrics})
+            self.logger.info(
+                f"Epoch {epoch+1}/{num_epochs}, Loss: {train_metrics['total_loss']:.4f}, "
+                f"Agreement: {val_metrics['agreement_rate']:.4f}, Score MAE: {val_metrics['score_mae']:.4f}"
+            )
+            
+        return {
+            'timestamp': datetime.utcnow().isoformat(),
+            'train_sequences': len(train_sequences),
+            'val_sequences': len(val_sequences),
+            'num_epochs': num_epochs,
+            'training_time': time.time() - start_time,
+            'agreement': self.training_history[-1]['val'] if self.training_history else {},
+            'footprint': self.compare_footprint(val_loader)
+        }
+        
+    def compare_footprint(self, dataloader: DataLoader, repeat: int = 3) -> Dict[str, Any]:
+        """Scoring latency and parameter memory of teacher vs student"""
+        self.student.eval()
+        batches = [(ids.to(self.device), mask.to(self.device)) for ids, mask in dataloader]
+        
+        def latency(model: WAFTransformer) -> float:
+            best = float('inf')
+            with torch.no_grad():
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    for input_ids, attention_mask in batches:
+                        model.score(input_ids, attention_mask)
+                    best = min(best, time.perf_counter() - start)
+            return best * 1000 / max(1, len(batches))
+            
+        teacher_ms, student_ms = latency(self.teacher), latency(self.student)
+        teacher_bytes, student_bytes = parameter_bytes(self.teacher), parameter_bytes(self.student)
+        return {
+            'teacher_batch_ms': teacher_ms,
+            'student_batch_ms': student_ms,
+            'latency_reduction': 1 - student_ms / teacher_ms if teacher_ms else 0.0,
+            'teacher_parameter_bytes': teacher_bytes,
+            'student_parameter_bytes': student_bytes,
+            'memory_reduction': 1 - student_bytes / teacher_bytes
+        }
+        
+    def save_student(self, path: str, report: Optional[Dict[str, Any]] = None):
+        """Save the student in the standard checkpoint format (loadable by the inference service)"""
+        torch.save({
+            'model_state_dict': self.student.state_dict(),
+            'model_config': self.student.config.__dict__,
+            'tokenizer_vocab_size': self.tokenizer.vocab_size,
+            'featurizer_config': self.featurizer_config,
+            'distillation': {
+                'teacher_config': self.teacher.config.__dict__,
+                'report': report,
+                'training_history': self.training_history
+            }
+        }, path)
+        
+        # Save tokenizer vocabulary
+        tokenizer_path = str(path).replace('.pt', '_tokenizer.json')
+        self.tokenizer.save_vocabulary(tokenizer_path)
+        
+        self.logger.info(f"Student model saved to {path}")
+
+if __name__ == "__main__":
+    # Test distillation
+    logging.basicConfig(level=logging.INFO)
+    
+    from waf_model import create_waf_model
+    
+    teacher, tokenizer = create_waf_model(vocab_size=1000)
+    sample_sequences = [
+        ['GET', '/api/users', '200', 'Chrome'],
+        ['POST', '/api/users', '201', 'curl'],
+        ['GET', '/api/posts', '200', 'Firefox'],
+        ['DELETE', '/api/users', '204', 'curl'],
+    ] * 50
+    tokenizer.build_vocabulary(sample_sequences)
+    
+    student = WAFTransformer(create_student_config(teacher.config, 'tiny'))
+    distiller = DistillationTrainer(teacher, student, tokenizer)
+    report = distiller.distill(sample_sequences, num_epochs=2, batch_size=32)
+    print("Distillation report:", report)
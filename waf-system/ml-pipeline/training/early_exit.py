@@ -0,0 +1,202 @@
+"""
+Early-Exit Heads for WAF Transformer
+Post hoc training and margin calibration of per-layer anomaly heads so that
+confidently benign or anomalous requests stop before the last encoder layer
+"""
+
+import torch
+import torch.nn.functional as F
+from typing import Dict, List, Any, Optional, Tuple
+import numpy as np
+import logging
+import time
+from datetime import datetime
+
+from waf_model import WAFTransformer, WAFTokenizer
+
+# Quantiles of the exit scores' distance from the threshold tried as exit margins
+# (data-derived, since the score spread depends on how the model was trained)
+MARGIN_QUANTILES = tuple(q / 20 for q in range(1, 20))
+
+class ExitHeadTrainer:
+    """Trains early-exit heads on a frozen model and calibrates the exit margin
+    
+    The backbone is not updated, so the intermediate CLS states and the final
+    anomaly scores are computed once; each exit head is then fitted to the
+    final score (BCE on soft targets). Calibration picks the smallest margin
+    whose early-exit decisions agree with the full model on held-out traffic.
+    """
+    
+    def __init__(
+        self,
+        model: WAFTransformer,
+        tokenizer: WAFTokenizer,
+        device: str = 'cpu',
+        learning_rate: float = 1e-3,
+        max_length: int = 128,
+        featurizer_config: Optional[Dict[str, Any]] = None
+    ):
+        if not model.exit_layers:
+            raise ValueError("Model has no early-exit layers (see WAFTransformer.add_exit_heads)")
+        self.model = model.to(device).eval()
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_length = max_length
+        self.featurizer_config = featurizer_config
+        self.optimizer = torch.optim.AdamW(self.model.exit_heads.parameters(), lr=learning_rate)
+        
+        self.training_history = []
+        self.logger = logging.getLogger(__name__)
+        
+    def collect(self, sequences: List[List[str]], batch_size: int = 64) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Intermediate CLS states [num_exits, n, hidden] and final anomaly scores [n]"""
+        states, scores = [], []
+        with torch.no_grad():
+            for i in range(0, len(sequences), batch_size):
+                encoded = self.tokenizer.encode_batch(sequences[i:i + batch_size], max_length=self.max_length)
+                length = max(1, int(encoded['attention_mask'].sum(dim=1).max()))
+                input_ids = encoded['input_ids'][:, :length].to(self.device)
+                attention_mask = encoded['attention_mask'][:, :length].to(self.device)
+                
+                hidden_states = self.model.embed(input_ids)
+                start = 0
+                batch_states = []
+                for layer in self.model.exit_layers:
+                    hidden_states = self.model.run_layers(hidden_states, attention_mask, start, layer + 1, fast_path=True)
+                    start = layer + 1
+                    batch_states.append(hidden_states[:, 0, :])
+                hidden_states = self.model.run_layers(hidden_states, attention_mask, start, fast_path=True)
+                states.append(torch.stack(batch_states))
+                scores.append(self.model.anomaly_head(self.model.layer_norm(hidden_states[:, 0, :])).squeeze(-1))
+        return torch.cat(states, dim=1), torch.cat(scores)
+        
+    def exit_scores(self, states: torch.Tensor) -> torch.Tensor:
+        """Exit head scores [num_exits, n] for collected CLS states"""
+        with torch.no_grad():
+            return torch.stack([
+                self.model.exit_heads[str(layer)](states[index]).squeeze(-1)
+                for index, layer in enumerate(self.model.exit_layers)
+            ])
+            
+    def fit_epoch(self, states: torch.Tensor, scores: torch.Tensor, batch_size: int = 256) -> float:
+        """One pass over the collected states; returns the mean BCE"""
+        self.model.exit_heads.train()
+        order = torch.randperm(scores.shape[0], device=scores.device)
+        total, num_batches = 0.0, 0
+        for i in range(0, len(order), batch_size):
+            index = order[i:i + batch_size]
+            self.optimizer.zero_grad()
+            loss = sum(
+                F.binary_cross_entropy_with_logits(self.model.exit_heads[str(layer)][:-1](states[e, index]).squeeze(-1), scores[index])
+                for e, layer in enumerate(self.model.exit_layers)
+            ) / len(self.model.exit_layers)
+            loss.backward()
+            self.optimizer.step()
+            total += loss.item()
+            num_batches += 1
+        self.model.exit_heads.eval()
+        return total / max(1, num_batches)
+        
+    def simulate(self, exit_scores: torch.Tensor, final_scores: torch.Tensor, threshold: float, margin: float) -> Dict[str, Any]:
+        """Decisions and depths of early-exit scoring, compared with the full model"""
+        num_layers = len(self.model.transformer_layers)
+        scores = final_scores.clone()
+        depths = torch.full_like(final_scores, num_layers, dtype=torch.long)
+        pending = torch.ones_like(final_scores, dtype=torch.bool)
+        for index, layer in enumerate(self.model.exit_layers):
+            done = pending & ((exit_scores[index] - threshold).abs() > margin)
+            scores[done] = exit_scores[index][done]
+            depths[done] = layer + 1
+            pending &= ~done
+        flagged, full_flagged = scores > threshold, final_scores > threshold
+        agreement = (flagged == full_flagged).float().mean()
+        # Flagged requests are rare, so their recall is checked on its own
+        flag_recall = flagged[full_flagged].float().mean() if full_flagged.any() else torch.tensor(1.0)
+        return {
+            'margin': margin,
+            'agreement_rate': float(agreement),
+            'flag_recall': float(flag_recall),
+            'avg_layers': float(depths.float().mean()),
+            'exit_rate': float((depths < num_layers).float().mean()),
+            'score_mae': float((scores - final_scores).abs().mean())
+        }
+        
+    def calibrate(
+        self,
+        states: torch.Tensor,
+        final_scores: torch.Tensor,
+        threshold: float = 0.5,
+        min_agreement: float = 0.995,
+        margins: Optional[Tuple[float, ...]] = None
+    ) -> Dict[str, Any]:
+        """Set config.exit_margin to the smallest margin meeting min_agreement
+        
+        Both the overall decision agreement and the recall of requests the
+        full model flags must reach min_agreement.
+        """
+        exit_scores = self.exit_scores(states)
+        if margins is None:
+            distance = (exit_scores - threshold).abs().flatten()
+            margins = tuple(sorted(set(distance.quantile(torch.tensor(MARGIN_QUANTILES)).tolist())))
+        candidates = [self.simulate(exit_scores, final_scores, threshold, margin) for margin in sorted(margins)]
+        chosen = next((c for c in candidates if min(c['agreement_rate'], c['flag_recall']) >= min_agreement), None)
+        if chosen is None:
+            # No margin is safe enough: exits are effectively disabled
+            chosen = {**self.simulate(exit_scores, final_scores, threshold, 1.0), 'margin': 1.0}
+            self.logger.warning(f"No exit margin reaches {min_agreement:.2%} agreement; early exit disabled")
+        self.model.config.exit_margin = chosen['margin']
+        self.model.config.exit_calibrated_threshold = threshold
+        return {'threshold': threshold, 'min_agreement': min_agreement, 'chosen': chosen, 'candidates': candidates}
+        
+    def train(
+        self,
+        sequences: List[List[str]],
+        num_epochs: int = 100,
+        batch_size: int = 256,
+        val_split: float = 0.2,
+        threshold: float = 0.5,
+        min_agreement: float = 0.995
+    ) -> Dict[str, Any]:
+        """Fit the exit heads on a corpus and calibrate the margin on a held-out split"""
+        start_time = time.time()
+        order = np.random.permutation(len(sequences))
+        val_size = max(1, int(len(sequences) * val_split))
+        train_states, train_scores = self.collect([sequences[i] for i in order[val_size:]])
+        val_states, val_scores = self.collect([sequences[i] for i in order[:val_size]])
+        
+        for epoch in range(num_epochs):
+            train_loss = self.fit_epoch(train_states, train_scores, batch_size=batch_size)
+            val_mae = (self.exit_scores(val_states) - val_scores).abs().mean(dim=1)
+            self.training_history.append({'epoch': epoch + 1, 'train_loss': train_loss, 'val_score_mae': val_mae.tolist()})
+        self.logger.info(f"Exit heads trained for {num_epochs} epochs, val score MAE per exit: {self.training_history[-1]['val_score_mae']}")
+        
+        return {
+            'timestamp': datetime.utcnow().isoformat(),
+            'exit_layers': self.model.exit_layers,
+            'train_sequences': len(order) - val_size,
+            'val_sequences': val_size,
+            'num_epochs': num_epochs,
+            'training_time': time.time() - start_time,
+            'calibration': self.calibrate(val_states, val_scores, threshold=threshold, min_agreement=min_agreement)
+        }
+        
+    def save_model(self, path: str, report: Optional[Dict[str, Any]] = None, hypersphere: Optional[Dict[str, Any]] = None):
+        """Save the model in the standard checkpoint format (loadable by the inference service)"""
+        torch.save({
+            'model_state_dict': self.model.state_dict(),
+            'model_config': self.model.config.__dict__,
+            'tokenizer_vocab_size': self.tokenizer.vocab_size,
+            'featurizer_config': self.featurizer_config,
+            # The backbone is unchanged, so its hypersphere calibration still holds
+            'hypersphere': hypersphere,
+            'early_exit': {
+                'report': report,
+                'training_history': self.training_history
+            }
+        }, path)
+        
+        # Save tokenizer vocabulary
+        tokenizer_path = str(path).replace('.pt', '_tokenizer.json')
+        self.tokenizer.save_vocabulary(tokenizer_path)
+        
+        self.logger.info(f"Model with early-exit heads saved to {path}")
@@ -13,11 +13,10 @@ import time
 from datetime import datetime
 
 from peft import LoraConfig, get_peft_model, PeftModel, TaskType
-from torch.utils.data import DataLoader
 import numpy as np
 
 from waf_model import WAFTransformer, WAFTokenizer
-from trainer import LogSequenceDataset, collate_fn
+from trainer import LogSequenceDataset, create_dataloader, masked_mlm_loss
 
 class LoRATrainer:
     """LoRA-based incremental trainer for WAF model"""
@@ -31,11 +30,13 @@ class LoRATrainer:
         lora_dropout: float = 0.1,
         target_modules: List[str] = None,
         learning_rate: float = 1e-4,
-        device: str = 'cpu'
+        device: str = 'cpu',
+        featurizer_config: Optional[Dict[str, Any]] = None
     ):
         self.base_model = base_model
         self.tokenizer = tokenizer
         self.device = device
+        self.featurizer_config = featurizer_config
         self.logger = logging.getLogger(__name__)
         
         # Default target modules for LoRA
@@ -107,7 +108,7 @@ class LoRATrainer:
         
         # Create dataset and dataloader
         dataset = LogSequenceDataset(training_sequences, self.tokenizer, max_length=256)
-        dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=True, collate_fn=collate_fn)
+        dataloader = create_dataloader(dataset, batch_size=batch_size, shuffle=True)
         
         # Training loop
         self.lora_model.train()
@@ -125,19 +126,17 @@ class LoRATrainer:
                 input_ids = batch['input_ids'].to(self.device)
                 attention_mask = batch['attention_mask'].to(self.device)
                 labels = batch['labels'].to(self.device)
+                masked = labels != -100
                 
-                # Forward pass
+                # Forward pass (vocabulary logits at the masked positions only)
                 outputs = self.lora_model(
                     input_ids=input_ids,
-                    attention_mask=attention_mask
+                    attention_mask=attention_mask,
+                    mlm_positions=masked
                 )
                 
                 # Compute MLM loss
-                mlm_logits = outputs['mlm_logits']
-                loss = self.loss_fn(
-                    mlm_logits.view(-1, self.base_model.config.vocab_size),
-                    labels.view(-1)
-                )
+                loss = masked_mlm_loss(self.loss_fn, outputs['mlm_logits'], labels[masked])
                 
                 # Backward pass
                 loss.backward()
@@ -184,6 +183,7 @@ class LoRATrainer:
             'model_state_dict': merged_model.state_dict(),
             'model_config': self.base_model.config.__dict__,
             'tokenizer_vocab_size': self.tokenizer.vocab_size,
+            'featurizer_config': self.featurizer_config,
             'training_history': self.training_history
         }, save_path)
         
@@ -244,14 +244,16 @@ class IncrementalUpdateManager:
         self.pending_sequences = []
         self.replay_buffer = []
         
-        # Load base model
+        # Load base model (and the featurization it was trained with)
+        self.featurizer_config = None
         self.base_model = self._load_base_model()
         
         # Initialize LoRA trainer
         self.lora_trainer = LoRATrainer(
             self.base_model,
             self.tokenizer,
-            device=self.device
+            device=self.device,
+            featurizer_config=self.featurizer_config
         )
         
         self.logger = logging.getLogger(__name__)
@@ -265,6 +267,7 @@ class IncrementalUpdateManager:
             return model
             
         checkpoint = torch.load(self.model_path, map_location=self.device)
+        self.featurizer_config = checkpoint.get('featurizer_config')
         
         from waf_model import WAFTransformerConfig
         config = WAFTransformerConfig(**checkpoint['model_config'])
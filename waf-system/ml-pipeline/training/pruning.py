@@ -0,0 +1,354 @@
+"""
+Structured Pruning for WAF Transformer
+Scores attention heads, encoder layers and FFN channels on validation data,
+rebuilds a physically smaller model and fine-tunes it with the standard recipe
+"""
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from typing import Dict, List, Any, Optional, Tuple
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from waf_model import WAFTransformer, WAFTransformerConfig, WAFTokenizer
+from trainer import WAFTrainer, LogSequenceDataset, create_dataloader
+from distillation import parameter_bytes
+
+class StructuredPruner:
+    """Importance-guided structured pruning of a trained WAFTransformer
+    
+    Impact of a component is measured by ablating it on validation data: the
+    increase in token reconstruction NLL plus the mean absolute change in
+    anomaly score. Heads are ablated by zeroing their slice of the attention
+    output projection and layers by skipping them; FFN channels are ranked by
+    mean activation times outgoing weight norm.
+    
+    Layers, heads and FFN channels are removed physically. Layers with fewer
+    heads use PrunedSelfAttention (q/k/v and output projections sliced to the
+    kept heads); such models run the layer loop instead of the nested-tensor
+    fast path, so head removal is opt-in and its latency shows in compare().
+    """
+    
+    def __init__(
+        self,
+        model: WAFTransformer,
+        tokenizer: WAFTokenizer,
+        val_sequences: List[List[str]],
+        device: str = 'cpu',
+        max_length: int = 128,
+        batch_size: int = 64
+    ):
+        self.model = model.to(device).eval()
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_length = max_length
+        self.logger = logging.getLogger(__name__)
+        
+        # Validation batches, trimmed to their longest sequence
+        self.val_batches = []
+        for i in range(0, len(val_sequences), batch_size):
+            encoded = tokenizer.encode_batch(val_sequences[i:i + batch_size], max_length=max_length)
+            length = max(1, int(encoded['attention_mask'].sum(dim=1).max()))
+            self.val_batches.append((
+                encoded['input_ids'][:, :length].to(device),
+                encoded['attention_mask'][:, :length].to(device)
+            ))
+        self.baseline = self.evaluate(self.model)
+        
+    def evaluate(self, model: WAFTransformer) -> Dict[str, Any]:
+        """Token reconstruction NLL and anomaly scores on the validation set"""
+        model.eval()
+        nll_total, tokens, scores = 0.0, 0, []
+        with torch.no_grad():
+            for input_ids, attention_mask in self.val_batches:
+                hidden_states = model.encode(input_ids, attention_mask, fast_path=True)
+                positions = attention_mask.bool()
+                logits = model.mlm_head(hidden_states[positions])
+                nll_total += F.cross_entropy(logits, input_ids[positions], reduction='sum').item()
+                tokens += int(positions.sum())
+                pooled = model.layer_norm(hidden_states[:, 0, :])
+                scores.append(model.anomaly_head(pooled).squeeze(-1))
+        return {'nll': nll_total / max(1, tokens), 'scores': torch.cat(scores)}
+        
+    def _impact(self, result: Dict[str, Any]) -> float:
+        return (result['nll'] - self.baseline['nll']) + float((result['scores'] - self.baseline['scores']).abs().mean())
+        
+    def drift(self, model: WAFTransformer) -> Dict[str, float]:
+        """Score drift and NLL change of a model against the unpruned baseline"""
+        result = self.evaluate(model)
+        delta = (result['scores'] - self.baseline['scores']).abs()
+        return {
+            'nll': result['nll'],
+            'nll_increase': result['nll'] / self.baseline['nll'] - 1 if self.baseline['nll'] else 0.0,
+            'mean_score_drift': float(delta.mean()),
+            'max_score_drift': float(delta.max())
+        }
+        
+    def head_importance(self) -> List[List[float]]:
+        """Impact of ablating each attention head ([layer][head])"""
+        head_dim = self.model.config.hidden_size // self.model.config.num_attention_heads
+        importance = []
+        for layer in self.model.transformer_layers:
+            weight = layer.self_attn.out_proj.weight
+            layer_scores = []
+            for head in range(layer.self_attn.num_heads):
+                columns = slice(head * head_dim, (head + 1) * head_dim)
+                saved = weight.data[:, columns].clone()
+                weight.data[:, columns] = 0
+                layer_scores.append(self._impact(self.evaluate(self.model)))
+                weight.data[:, columns] = saved
+            importance.append(layer_scores)
+        return importance
+        
+    def layer_importance(self) -> List[float]:
+        """Impact of skipping each encoder layer"""
+        layers = self.model.transformer_layers
+        importance = []
+        try:
+            for index in range(len(layers)):
+                self.model.transformer_layers = nn.ModuleList([layer for i, layer in enumerate(layers) if i != index])
+                importance.append(self._impact(self.evaluate(self.model)))
+        finally:
+            self.model.transformer_layers = layers
+        return importance
+        
+    def ffn_importance(self) -> List[torch.Tensor]:
+        """Per-layer FFN channel importance: mean |activation| x outgoing weight norm"""
+        sums = [torch.zeros(layer.linear1.out_features, device=self.device) for layer in self.model.transformer_layers]
+        current_mask = {}
+        
+        def make_hook(index: int):
+            def hook(module, inputs, output):
+                positions = current_mask['mask']
+                sums[index] += F.relu(output.detach())[positions].sum(dim=0)
+            return hook
+            
+        handles = [layer.linear1.register_forward_hook(make_hook(i)) for i, layer in enumerate(self.model.transformer_layers)]
+        tokens = 0
+        try:
+            # Grad mode keeps the layers off the fused kernel so the hooks see the FFN
+            with torch.enable_grad():
+                for input_ids, attention_mask in self.val_batches:
+                    current_mask['mask'] = attention_mask.bool()
+                    self.model.encode(input_ids, attention_mask)
+                    tokens += int(attention_mask.sum())
+        finally:
+            for handle in handles:
+                handle.remove()
+        return [
+            (channel_sum.detach() / max(1, tokens)) * layer.linear2.weight.detach().norm(dim=0)
+            for channel_sum, layer in zip(sums, self.model.transformer_layers)
+        ]
+        
+    def _layer_heads(self, index: int) -> int:
+        return self.model.transformer_layers[index].self_attn.num_heads
+        
+    def build_pruned(
+        self,
+        keep_layers: List[int],
+        keep_channels: Optional[List[torch.Tensor]] = None,
+        keep_heads: Optional[List[List[int]]] = None
+    ) -> WAFTransformer:
+        """Rebuild a physically smaller model keeping the given layers, FFN channels and heads
+        
+        keep_channels holds, per kept layer, the FFN channel indices to keep
+        (the same count in every layer, since the config has one intermediate size).
+        keep_heads holds, per kept layer, the attention head indices to keep.
+        """
+        config = dict(self.model.config.__dict__)
+        config['num_hidden_layers'] = len(keep_layers)
+        heads = [len(keep_heads[i]) if keep_heads is not None else self._layer_heads(old) for i, old in enumerate(keep_layers)]
+        config['attention_heads'] = heads if any(h != self.model.config.num_attention_heads for h in heads) else None
+        # Early-exit heads follow their layer; heads of removed layers are dropped
+        exit_map = {
+            str(old_index): str(new_index) for new_index, old_index in enumerate(keep_layers)
+            if old_index in self.model.exit_layers and new_index < len(keep_layers) - 1
+        }
+        config['exit_layers'] = [int(new_index) for new_index in exit_map.values()]
+        # The exit margin was calibrated for the unpruned backbone
+        config['exit_calibrated_threshold'] = None
+        if keep_channels is not None:
+            sizes = {len(channels) for channels in keep_channels}
+            if len(sizes) != 1:
+                raise ValueError("Every layer must keep the same number of FFN channels")
+            config['intermediate_size'] = sizes.pop()
+        pruned = WAFTransformer(WAFTransformerConfig(**config)).to(self.device)
+        
+        state = self.model.state_dict()
+        new_state = OrderedDict()
+        for name, tensor in state.items():
+            if name.startswith('exit_heads.'):
+                _, layer, rest = name.split('.', 2)
+                if layer in exit_map:
+                    new_state[f'exit_heads.{exit_map[layer]}.{rest}'] = tensor
+            elif not name.startswith('transformer_layers.'):
+                new_state[name] = tensor
+        head_dim = self.model.config.hidden_size // self.model.config.num_attention_heads
+        for new_index, old_index in enumerate(keep_layers):
+            prefix = f'transformer_layers.{old_index}.'
+            channels = keep_channels[new_index] if keep_channels is not None else None
+            if keep_heads is not None:
+                # Columns of the kept heads in the attention output, and their q/k/v rows
+                columns = torch.cat([torch.arange(h * head_dim, (h + 1) * head_dim) for h in keep_heads[new_index]])
+                inner = self._layer_heads(old_index) * head_dim
+                rows = torch.cat([columns + block * inner for block in range(3)])
+            for name, tensor in state.items():
+                if not name.startswith(prefix):
+                    continue
+                suffix = name[len(prefix):]
+                if channels is not None:
+                    if suffix in ('linear1.weight', 'linear1.bias'):
+                        tensor = tensor[channels]
+                    elif suffix == 'linear2.weight':
+                        tensor = tensor[:, channels]
+                if keep_heads is not None:
+                    if suffix in ('self_attn.in_proj_weight', 'self_attn.in_proj_bias'):
+                        tensor = tensor[rows]
+                    elif suffix == 'self_attn.out_proj.weight':
+                        tensor = tensor[:, columns]
+                new_state[f'transformer_layers.{new_index}.{suffix}'] = tensor.clone()
+        pruned.load_state_dict(new_state)
+        return pruned.eval()
+        
+    def prune(
+        self,
+        max_layers_removed: int = 1,
+        ffn_keep_ratio: float = 0.5,
+        max_score_drift: float = 0.02,
+        max_nll_increase: float = 0.1,
+        max_heads_removed: int = 0
+    ) -> Tuple[WAFTransformer, Dict[str, Any]]:
+        """Greedily remove low-impact layers, then heads, then FFN channels, within the guardrails
+        
+        Guardrails are checked before fine-tuning: a step is kept only if the
+        pruned model's mean score drift and relative NLL increase stay within
+        the limits. The FFN keep ratio is relaxed towards 1.0 until it passes.
+        """
+        head_scores = self.head_importance()
+        layer_scores = self.layer_importance()
+        num_layers = len(layer_scores)
+        
+        def within(metrics: Dict[str, float]) -> bool:
+            return metrics['mean_score_drift'] <= max_score_drift and metrics['nll_increase'] <= max_nll_increase
+            
+        # Layers, least important first (always keep one)
+        keep_layers = list(range(num_layers))
+        removed_layers = []
+        for index in sorted(range(num_layers), key=lambda i: layer_scores[i]):
+            if len(removed_layers) >= max_layers_removed or len(keep_layers) <= 1:
+                break
+            candidate = [i for i in keep_layers if i != index]
+            metrics = self.drift(self.build_pruned(candidate))
+            if within(metrics):
+                keep_layers = candidate
+                removed_layers.append(index)
+            else:
+                self.logger.info(f"Keeping layer {index}: drift {metrics['mean_score_drift']:.4f}, NLL +{metrics['nll_increase']:.1%}")
+                
+        # Attention heads of the kept layers, least important first (always keep one per layer)
+        keep_heads = None
+        removed_heads = []
+        if max_heads_removed > 0:
+            keep_heads = [list(range(self._layer_heads(i))) for i in keep_layers]
+            candidates = sorted(
+                ((position, head) for position, layer in enumerate(keep_layers) for head in range(len(head_scores[layer]))),
+                key=lambda item: head_scores[keep_layers[item[0]]][item[1]]
+            )
+            for position, head in candidates:
+                if len(removed_heads) >= max_heads_removed:
+                    break
+                if len(keep_heads[position]) <= 1:
+                    continue
+                candidate = [list(heads) for heads in keep_heads]
+                candidate[position].remove(head)
+                if within(self.drift(self.build_pruned(keep_layers, keep_heads=candidate))):
+                    keep_heads = candidate
+                    removed_heads.append([keep_layers[position], head])
+            if not removed_heads:
+                keep_heads = None
+                
+        # FFN channels (ranked per layer, same count everywhere)
+        channel_scores = self.ffn_importance()
+        intermediate = self.model.config.intermediate_size
+        keep_channels = None
+        ratio = ffn_keep_ratio
+        while ratio < 1.0:
+            count = max(1, int(intermediate * ratio))
+            candidate = [channel_scores[i].topk(count).indices.sort().values for i in keep_layers]
+            if within(self.drift(self.build_pruned(keep_layers, candidate, keep_heads))):
+                keep_channels = candidate
+                break
+            ratio = min(1.0, ratio + 0.125)
+            
+        pruned = self.build_pruned(keep_layers, keep_channels, keep_heads)
+        report = {
+            'timestamp': datetime.utcnow().isoformat(),
+            'head_importance': head_scores,
+            'low_impact_heads': [
+                [layer, head] for layer, scores in enumerate(head_scores)
+                for head, score in enumerate(scores) if score <= 0
+            ],
+            'layer_importance': layer_scores,
+            'removed_layers': sorted(removed_layers),
+            'removed_heads': sorted(removed_heads),
+            'attention_heads': [layer.self_attn.num_heads for layer in pruned.transformer_layers],
+            'ffn_channels': {'before': intermediate, 'after': pruned.config.intermediate_size},
+            'guardrails': {'max_score_drift': max_score_drift, 'max_nll_increase': max_nll_increase},
+            'before_fine_tune': self.drift(pruned)
+        }
+        return pruned, report
+        
+    def fine_tune(self, model: WAFTransformer, sequences: List[List[str]], num_epochs: int = 1, batch_size: int = 32) -> List[Dict[str, float]]:
+        """Briefly fine-tune a pruned model with the standard WAFTrainer recipe"""
+        dataset = LogSequenceDataset(sequences, self.tokenizer, max_length=self.max_length)
+        dataloader = create_dataloader(dataset, batch_size=batch_size, shuffle=True)
+        trainer = WAFTrainer(model, self.tokenizer, device=self.device)
+        history = [trainer.train_epoch(dataloader) for _ in range(num_epochs)]
+        model.eval()
+        return history
+        
+    def latency(self, model: WAFTransformer, repeat: int = 3) -> float:
+        """Best scoring time per validation batch (ms)"""
+        model.eval()
+        best = float('inf')
+        with torch.no_grad():
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for input_ids, attention_mask in self.val_batches:
+                    model.score(input_ids, attention_mask)
+                best = min(best, time.perf_counter() - start)
+        return best * 1000 / max(1, len(self.val_batches))
+        
+    def compare(self, pruned: WAFTransformer) -> Dict[str, Any]:
+        """Latency, memory and drift of a pruned model against the original"""
+        original_ms, pruned_ms = self.latency(self.model), self.latency(pruned)
+        original_bytes, pruned_bytes = parameter_bytes(self.model), parameter_bytes(pruned)
+        return {
+            'original_batch_ms': original_ms,
+            'pruned_batch_ms': pruned_ms,
+            'latency_reduction': 1 - pruned_ms / original_ms if original_ms else 0.0,
+            'original_parameter_bytes': original_bytes,
+            'pruned_parameter_bytes': pruned_bytes,
+            'memory_reduction': 1 - pruned_bytes / original_bytes,
+            **self.drift(pruned)
+        }
+
+def save_pruned_model(
+    model: WAFTransformer,
+    tokenizer: WAFTokenizer,
+    path: str,
+    report: Dict[str, Any],
+    featurizer_config: Optional[Dict[str, Any]] = None
+):
+    """Save a pruned model in the standard checkpoint format (loadable by the inference service)"""
+    torch.save({
+        'model_state_dict': model.state_dict(),
+        'model_config': model.config.__dict__,
+        'tokenizer_vocab_size': tokenizer.vocab_size,
+        'featurizer_config': featurizer_config,
+        'pruning': report
+    }, path)
+    tokenizer.save_vocabulary(str(path).replace('.pt', '_tokenizer.json'))
@@ -0,0 +1,182 @@
+"""
+Pre-tokenized Token Store for WAF Transformer Training
+Converts a sequence corpus once into a memory-mapped int32 token array with
+per-sequence offsets and lengths and a frozen vocabulary, and serves MLM
+training batches straight from it
+"""
+
+import torch
+from torch.utils.data import Dataset
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+import numpy as np
+import json
+import logging
+import time
+from pathlib import Path
+
+from waf_model import WAFTokenizer, load_tokenizer
+from trainer import MLMCollator
+
+STORE_FORMAT_VERSION = 1
+TOKENS_FILE = 'tokens.bin'
+OFFSETS_FILE = 'offsets.npy'
+LENGTHS_FILE = 'lengths.npy'
+VOCAB_FILE = 'vocab.json'
+METADATA_FILE = 'metadata.json'
+TOKEN_DTYPE = np.int32
+
+logger = logging.getLogger(__name__)
+
+def write_token_store(
+    sequences: Iterable[List[str]],
+    tokenizer: WAFTokenizer,
+    store_path: str,
+    chunk_size: int = 8192,
+    featurizer_config: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Tokenize a corpus once into a store directory
+    
+    The tokenizer's vocabulary must already be built; it is saved with the
+    store and not extended (unknown tokens become [UNK]). Sequences are
+    tokenized in chunks and appended to the token file, so the corpus does
+    not need to fit in memory as token ids.
+    """
+    start = time.perf_counter()
+    store_path = Path(store_path)
+    store_path.mkdir(parents=True, exist_ok=True)
+    
+    lengths = []
+    with open(store_path / TOKENS_FILE, 'wb') as f:
+        chunk = []
+        for sequence in sequences:
+            chunk.append(sequence)
+            if len(chunk) == chunk_size:
+                lengths.append(_write_chunk(f, tokenizer, chunk))
+                chunk = []
+        if chunk:
+            lengths.append(_write_chunk(f, tokenizer, chunk))
+            
+    lengths = np.concatenate(lengths) if lengths else np.empty(0, dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    np.save(store_path / OFFSETS_FILE, offsets)
+    np.save(store_path / LENGTHS_FILE, lengths.astype(TOKEN_DTYPE))
+    tokenizer.save_vocabulary(str(store_path / VOCAB_FILE))
+    
+    # Metadata is written last: it marks the store as complete
+    metadata = {
+        'format_version': STORE_FORMAT_VERSION,
+        'sequences': len(lengths),
+        'tokens': int(offsets[-1]),
+        'max_sequence_length': int(lengths.max()) if len(lengths) else 0,
+        'vocab_size': tokenizer.vocab_size,
+        'vocabulary_tokens': tokenizer.next_id,
+        'featurizer_config': featurizer_config,
+        'build_s': time.perf_counter() - start
+    }
+    with open(store_path / METADATA_FILE, 'w') as f:
+        json.dump(metadata, f, indent=2)
+        
+    logger.info(f"Token store of {metadata['sequences']} sequences ({metadata['tokens']} tokens) written to {store_path}")
+    return metadata
+
+def _write_chunk(f, tokenizer: WAFTokenizer, chunk: List[List[str]]) -> np.ndarray:
+    """Append one chunk's token ids; returns its sequence lengths"""
+    ids, lengths = tokenizer.token_ids_batch(chunk)
+    f.write(ids.astype(TOKEN_DTYPE).tobytes())
+    return lengths
+
+class TokenStoreDataset(Dataset):
+    """MLM training dataset reading a token store
+    
+    The token, offset and length arrays are memory-mapped read-only, so
+    epochs, training runs and DataLoader workers share the page cache and the
+    dataset holds no per-sequence Python objects. Sequences are read as
+    array views and only copied into the padded batch block. Batches are
+    masked by MLMCollator, as for LogSequenceDataset.
+    """
+    
+    def __init__(
+        self,
+        store_path: str,
+        max_length: int = 512,
+        mlm_probability: float = 0.15,
+        indices: Optional[np.ndarray] = None,
+        tokenizer: Optional[WAFTokenizer] = None,
+        dynamic_padding: bool = True
+    ):
+        self.store_path = Path(store_path)
+        with open(self.store_path / METADATA_FILE, 'r') as f:
+            self.metadata = json.load(f)
+        if self.metadata.get('format_version', 0) > STORE_FORMAT_VERSION:
+            raise ValueError(f"Token store format {self.metadata['format_version']} is newer than supported format {STORE_FORMAT_VERSION}")
+            
+        # The vocabulary frozen with the store (train the model with this tokenizer)
+        self.tokenizer = tokenizer or load_tokenizer(str(self.store_path / VOCAB_FILE), vocab_size=self.metadata['vocab_size'])
+        self.max_length = max_length
+        self.mlm_probability = mlm_probability
+        # Lengths are known up front, so batches are encoded at their own width
+        self.dynamic_padding = dynamic_padding
+        self.collator = MLMCollator(self.tokenizer, mlm_probability, dynamic_padding=False)
+        self.indices = indices
+        self._arrays = None
+        
+    @property
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Memory-mapped tokens, offsets and lengths (opened on first use, once per process)"""
+        if self._arrays is None:
+            self._arrays = (
+                np.memmap(self.store_path / TOKENS_FILE, dtype=TOKEN_DTYPE, mode='r', shape=(self.metadata['tokens'],)),
+                np.load(self.store_path / OFFSETS_FILE, mmap_mode='r'),
+                np.load(self.store_path / LENGTHS_FILE, mmap_mode='r')
+            )
+        return self._arrays
+        
+    @property
+    def lengths(self) -> np.ndarray:
+        """Token count of every sequence in the dataset (before [CLS]/[SEP] and truncation)"""
+        lengths = self.arrays[2]
+        return lengths if self.indices is None else lengths[self.indices]
+        
+    def __getstate__(self) -> Dict[str, Any]:
+        # Worker processes reopen the memory maps instead of receiving copies of the arrays
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+        
+    def __len__(self):
+        return self.metadata['sequences'] if self.indices is None else len(self.indices)
+        
+    def split(self, val_fraction: float = 0.2, seed: int = 42) -> Tuple['TokenStoreDataset', 'TokenStoreDataset']:
+        """Random train/validation views of the store (index arrays only, no data is copied)"""
+        order = np.random.default_rng(seed).permutation(len(self))
+        if self.indices is not None:
+            order = self.indices[order]
+        train_size = len(order) - int(len(order) * val_fraction)
+        return (
+            TokenStoreDataset(str(self.store_path), self.max_length, self.mlm_probability, order[:train_size], self.tokenizer, self.dynamic_padding),
+            TokenStoreDataset(str(self.store_path), self.max_length, self.mlm_probability, order[train_size:], self.tokenizer, self.dynamic_padding)
+        )
+        
+    def encode(self, indices: List[int]) -> Dict[str, torch.Tensor]:
+        """Unmasked [B, L] ids and attention mask of dataset rows"""
+        tokens, offsets, lengths = self.arrays
+        rows = np.asarray(indices) if self.indices is None else self.indices[indices]
+        # One gather of the truncated rows from the token array, packed back to back
+        row_lengths = np.minimum(lengths[rows], self.max_length - 2).astype(np.int64)
+        ends = np.cumsum(row_lengths)
+        positions = np.arange(ends[-1] if len(ends) else 0) + np.repeat(offsets[rows] - ends + row_lengths, row_lengths)
+        max_length = int(row_lengths.max()) + 2 if self.dynamic_padding and len(row_lengths) else self.max_length
+        return self.tokenizer.encode_packed_ids(tokens[positions], row_lengths, max_length=max_length)
+        
+    def __getitem__(self, idx):
+        encoded = self.encode([idx])
+        input_ids, labels = self.collator.mask(encoded['input_ids'], encoded['attention_mask'])
+        return {
+            'input_ids': input_ids[0],
+            'attention_mask': encoded['attention_mask'][0],
+            'labels': labels[0]
+        }
+        
+    def __getitems__(self, indices: List[int]) -> Dict[str, torch.Tensor]:
+        """Fetch a whole batch, encoded into one [B, L] block and masked by the collator (returned already collated)"""
+        return self.collator(self.encode(indices))
@@ -5,8 +5,10 @@ Implements LogBERT-style training with masked language modeling and contrastive
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader, random_split
+from torch.nn.utils.rnn import pad_sequence
+from torch.utils.data import Dataset, DataLoader, Sampler, Subset, WeightedRandomSampler, random_split
 from typing import Dict, List, Any, Optional, Tuple
 import numpy as np
 import json
@@ -16,10 +18,58 @@ from pathlib import Path
 import time
 from datetime import datetime
 import random
-from tqdm import tqdm
-from sklearn.metrics import roc_auc_score, precision_recall_fscore_support
 
-from waf_model import WAFTransformer, WAFTokenizer, ContrastiveLoss, HypersphereLoss, create_waf_model
+from waf_model import WAFTransformer, WAFTokenizer, ContrastiveLoss, HypersphereLoss, create_waf_model, exit_head_loss, distance_percentiles, hypersphere_distance
+
+class MLMCollator:
+    """Batched MLM masking of encoded [B, L] blocks
+    
+    Each real, non-special token is selected with probability mlm_probability;
+    selected tokens are replaced with [MASK] (80%), a random vocabulary token
+    (10%) or kept (10%), and only they carry labels. Padding and special
+    tokens are never selected. Random replacements are drawn from the tokens
+    the tokenizer actually holds (next_id), not from its capacity. With
+    dynamic_padding the block is cut to the batch's longest row.
+    """
+    
+    def __init__(self, tokenizer: WAFTokenizer, mlm_probability: float = 0.15, dynamic_padding: bool = True):
+        self.tokenizer = tokenizer
+        self.mlm_probability = mlm_probability
+        self.dynamic_padding = dynamic_padding
+        self.mask_token_id = tokenizer.special_tokens['[MASK]']
+        self.special_ids = torch.tensor(sorted(tokenizer.special_tokens.values()))
+        self.first_token_id = len(tokenizer.special_tokens)
+        
+    def mask(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Masked input ids and labels (-100 where not selected)"""
+        candidates = attention_mask.bool() & ~torch.isin(input_ids, self.special_ids)
+        selected = candidates & (torch.rand(input_ids.shape) < self.mlm_probability)
+        labels = torch.where(selected, input_ids, torch.full_like(input_ids, -100))
+        
+        choice = torch.rand(input_ids.shape)
+        input_ids = torch.where(selected & (choice < 0.8), torch.full_like(input_ids, self.mask_token_id), input_ids)
+        # Without regular tokens in the vocabulary the random 10% keep their token
+        if self.tokenizer.next_id > self.first_token_id:
+            random_ids = torch.randint(self.first_token_id, self.tokenizer.next_id, input_ids.shape, dtype=input_ids.dtype)
+            input_ids = torch.where(selected & (choice >= 0.8) & (choice < 0.9), random_ids, input_ids)
+        return input_ids, labels
+        
+    def __call__(self, batch) -> Dict[str, torch.Tensor]:
+        """Collate encoded rows (or an encoded block) into a masked batch"""
+        if isinstance(batch, dict):
+            input_ids, attention_mask = batch['input_ids'], batch['attention_mask']
+        else:
+            input_ids = torch.stack([item['input_ids'] for item in batch])
+            attention_mask = torch.stack([item['attention_mask'] for item in batch])
+        if self.dynamic_padding:
+            length = max(1, int(attention_mask.sum(dim=1).max()))
+            input_ids, attention_mask = input_ids[:, :length].contiguous(), attention_mask[:, :length].contiguous()
+        masked_ids, labels = self.mask(input_ids, attention_mask)
+        return {
+            'input_ids': masked_ids,
+            'attention_mask': attention_mask,
+            'labels': labels
+        }
 
 class LogSequenceDataset(Dataset):
     """Dataset for log sequences"""
@@ -29,45 +79,188 @@ class LogSequenceDataset(Dataset):
         sequences: List[List[str]],
         tokenizer: WAFTokenizer,
         max_length: int = 512,
-        mlm_probability: float = 0.15
+        mlm_probability: float = 0.15,
+        dynamic_padding: bool = True,
+        counts: Optional[np.ndarray] = None
     ):
         self.sequences = sequences
         self.tokenizer = tokenizer
         self.max_length = max_length
         self.mlm_probability = mlm_probability
+        # Batches are padded to their longest sequence, not to max_length
+        self.collator = MLMCollator(tokenizer, mlm_probability, dynamic_padding=dynamic_padding)
+        # Occurrences of each sequence in the corpus it was deduplicated from (None: once each)
+        self.counts = counts
         
     def __len__(self):
         return len(self.sequences)
         
+    @property
+    def lengths(self) -> np.ndarray:
+        """Token count of every sequence (before [CLS]/[SEP] and truncation; pre-subword for subword tokenizers)"""
+        return np.fromiter((len(sequence) for sequence in self.sequences), dtype=np.int64, count=len(self.sequences))
+        
     def __getitem__(self, idx):
         sequence = self.sequences[idx]
         
         # Tokenize sequence
         encoded = self.tokenizer.encode(sequence, max_length=self.max_length)
         
+        input_ids, attention_mask = encoded['input_ids'], encoded['attention_mask']
+        if self.collator.dynamic_padding:
+            # Unpadded row; collate_fn pads the batch to its longest row
+            length = max(1, int(attention_mask.sum()))
+            input_ids, attention_mask = input_ids[:length], attention_mask[:length]
+            
         # Create masked LM labels
-        input_ids = encoded['input_ids'].clone()
-        labels = input_ids.clone()
-        
-        # Mask tokens for MLM
-        for i in range(1, len(input_ids) - 1):  # Skip CLS and SEP tokens
-            if torch.rand(1).item() < self.mlm_probability:
-                # 80% replace with MASK, 10% replace with random, 10% keep original
-                prob = torch.rand(1).item()
-                if prob < 0.8:
-                    input_ids[i] = self.tokenizer.special_tokens['[MASK]']
-                elif prob < 0.9:
-                    input_ids[i] = torch.randint(5, self.tokenizer.vocab_size, (1,)).item()
-                # else keep original
-            else:
-                labels[i] = -100  # Ignore in loss calculation
-                
-        return {
-            'input_ids': input_ids,
-            'attention_mask': encoded['attention_mask'],
-            'labels': labels,
+        input_ids, labels = self.collator.mask(input_ids.unsqueeze(0), attention_mask.unsqueeze(0))
+        
+        item = {
+            'input_ids': input_ids[0],
+            'attention_mask': attention_mask,
+            'labels': labels[0],
             'original_sequence': sequence
         }
+        if self.counts is not None:
+            item['counts'] = torch.tensor(self.counts[idx])
+        return item
+        
+    def __getitems__(self, indices: List[int]) -> Dict[str, torch.Tensor]:
+        """Fetch a whole batch, encoded into one [B, L] block and masked by the collator (returned already collated)"""
+        encoded = self.tokenizer.encode_batch([self.sequences[idx] for idx in indices], max_length=self.max_length)
+        batch = self.collator(encoded)
+        if self.counts is not None:
+            batch['counts'] = torch.as_tensor(self.counts[indices])
+        return batch
+
+def sequence_lengths(dataset: Dataset) -> np.ndarray:
+    """Per-item token counts of a dataset exposing lengths (or a Subset of one)"""
+    if isinstance(dataset, Subset):
+        return sequence_lengths(dataset.dataset)[np.asarray(dataset.indices)]
+    return np.asarray(dataset.lengths)
+
+def sequence_counts(dataset: Dataset) -> Optional[np.ndarray]:
+    """Per-item corpus frequencies of a deduplicated dataset (or a Subset of one); None if not deduplicated"""
+    if isinstance(dataset, Subset):
+        counts = sequence_counts(dataset.dataset)
+        return None if counts is None else counts[np.asarray(dataset.indices)]
+    counts = getattr(dataset, 'counts', None)
+    return None if counts is None else np.asarray(counts)
+
+def deduplicate_sequences(sequences: List[List[str]]) -> Tuple[List[List[str]], np.ndarray]:
+    """Unique sequences (in first-seen order) and the number of times each occurs"""
+    index: Dict[Tuple[str, ...], int] = {}
+    unique, counts = [], []
+    for sequence in sequences:
+        key = tuple(sequence)
+        position = index.get(key)
+        if position is None:
+            index[key] = len(unique)
+            unique.append(sequence)
+            counts.append(1)
+        else:
+            counts[position] += 1
+    return unique, np.asarray(counts, dtype=np.int64)
+
+class LengthBucketSampler(Sampler):
+    """Batch sampler grouping sequences of similar length
+    
+    With shuffle, indices are shuffled and cut into pools of pool_batches
+    batches; each pool is sorted by length and cut into batches, and the
+    batch order is shuffled again. Batches stay random across epochs while
+    their rows have similar lengths, so dynamic padding adds little. Without
+    shuffle, batches follow the global length order.
+    
+    With weights (corpus frequencies of deduplicated sequences) a shuffled
+    epoch is len(lengths) draws with replacement in proportion to the
+    weights, so sequences are seen as often as in the duplicated corpus,
+    in fewer steps. Without shuffle (evaluation) the weights are ignored
+    and every sequence is visited exactly once.
+    """
+    
+    def __init__(
+        self,
+        lengths: np.ndarray,
+        batch_size: int,
+        shuffle: bool = True,
+        pool_batches: int = 50,
+        drop_last: bool = False,
+        seed: Optional[int] = None,
+        weights: Optional[np.ndarray] = None
+    ):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.pool_size = batch_size * pool_batches
+        self.drop_last = drop_last
+        self.seed = seed
+        self.generator = np.random.default_rng(seed)
+        self.weights = None if weights is None else np.asarray(weights, dtype=np.float64) / np.sum(weights)
+        
+    def __iter__(self):
+        if self.weights is not None and self.shuffle:
+            order = self.generator.choice(len(self.lengths), len(self.lengths), p=self.weights)
+        else:
+            order = self.generator.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        if self.shuffle:
+            pools = [order[i:i + self.pool_size] for i in range(0, len(order), self.pool_size)]
+            order = np.concatenate([pool[np.argsort(self.lengths[pool], kind='stable')] for pool in pools]) if pools else order
+        else:
+            order = order[np.argsort(self.lengths[order], kind='stable')]
+        batches = [order[i:i + self.batch_size].tolist() for i in range(0, len(order), self.batch_size)]
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches.pop()
+        if self.shuffle:
+            batches = [batches[i] for i in self.generator.permutation(len(batches))]
+        return iter(batches)
+        
+    def __len__(self):
+        if self.drop_last:
+            return len(self.lengths) // self.batch_size
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+def create_dataloader(dataset: Dataset, batch_size: int = 32, shuffle: bool = True, bucketed: bool = True, num_workers: int = 0) -> DataLoader:
+    """DataLoader for MLM training, batching sequences of similar length together when bucketed
+    
+    Shuffled loaders over deduplicated datasets (with counts) are sampled in
+    proportion to their corpus frequencies; unshuffled (evaluation) loaders
+    visit each unique sequence once and batches carry the counts, which
+    evaluate uses as weights.
+    """
+    counts = sequence_counts(dataset) if shuffle else None
+    if not bucketed:
+        if counts is None:
+            return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, collate_fn=collate_fn, num_workers=num_workers)
+        sampler = WeightedRandomSampler(torch.as_tensor(counts, dtype=torch.double), len(counts))
+        return DataLoader(dataset, batch_size=batch_size, sampler=sampler, collate_fn=collate_fn, num_workers=num_workers)
+    sampler = LengthBucketSampler(sequence_lengths(dataset), batch_size, shuffle=shuffle, weights=counts)
+    return DataLoader(dataset, batch_sampler=sampler, collate_fn=collate_fn, num_workers=num_workers)
+
+def masked_mlm_loss(loss_fn: nn.Module, mlm_logits: torch.Tensor, masked_labels: torch.Tensor) -> torch.Tensor:
+    """Mean MLM loss over the masked positions
+    
+    Short batches can have no masked token at all; their loss is a zero
+    that stays in the graph instead of the NaN mean of an empty tensor.
+    """
+    if masked_labels.numel() == 0:
+        return mlm_logits.sum() * 0.0
+    return loss_fn(mlm_logits, masked_labels)
+
+def weighted_mean(values: torch.Tensor, weights: torch.Tensor) -> float:
+    """Mean of values weighted by (corpus count) weights"""
+    return ((values * weights).sum() / weights.sum()).item()
+
+def sequence_perplexities(token_losses: torch.Tensor, masked: torch.Tensor) -> torch.Tensor:
+    """Perplexity of every row with masked tokens (exp of its mean token loss)
+    
+    token_losses holds the unreduced loss of each masked position in
+    row-major order, as gathered with mlm_positions=masked.
+    """
+    counts = masked.sum(dim=1)
+    rows = torch.arange(len(counts), device=counts.device).repeat_interleave(counts)
+    sums = torch.zeros(len(counts), dtype=token_losses.dtype, device=token_losses.device).index_add_(0, rows, token_losses)
+    scored = counts > 0
+    return torch.exp(sums[scored] / counts[scored])
 
 class WAFTrainer:
     """Trainer for WAF Transformer model"""
@@ -81,16 +274,21 @@ class WAFTrainer:
         weight_decay: float = 0.01,
         mlm_weight: float = 1.0,
         contrastive_weight: float = 0.1,
-        hypersphere_weight: float = 0.1
+        hypersphere_weight: float = 0.1,
+        exit_weight: float = 0.1,
+        featurizer_config: Optional[Dict[str, Any]] = None
     ):
         self.model = model.to(device)
         self.tokenizer = tokenizer
         self.device = device
+        # Featurization rules the training sequences were built with (saved with checkpoints)
+        self.featurizer_config = featurizer_config
         
         # Loss weights
         self.mlm_weight = mlm_weight
         self.contrastive_weight = contrastive_weight
         self.hypersphere_weight = hypersphere_weight
+        self.exit_weight = exit_weight
         
         # Optimizer
         self.optimizer = optim.AdamW(
@@ -103,6 +301,11 @@ class WAFTrainer:
         self.mlm_loss_fn = nn.CrossEntropyLoss(ignore_index=-100)
         self.contrastive_loss_fn = ContrastiveLoss()
         self.hypersphere_loss_fn = HypersphereLoss()
+        # Benign distance-to-center quantiles (saved with checkpoints); recomputed on save
+        # from the last validation loader when the weights changed since the last calibration
+        self.hypersphere_percentiles: Optional[List[float]] = None
+        self.calibration_loader: Optional[DataLoader] = None
+        self.percentiles_stale = False
         
         # Metrics
         self.training_history = []
@@ -111,12 +314,15 @@ class WAFTrainer:
     def train_epoch(self, dataloader: DataLoader) -> Dict[str, float]:
         """Train one epoch"""
         self.model.train()
+        self.percentiles_stale = True
         total_loss = 0.0
         mlm_loss_total = 0.0
         contrastive_loss_total = 0.0
         hypersphere_loss_total = 0.0
+        exit_loss_total = 0.0
         num_batches = 0
         
+        from tqdm import tqdm
         progress_bar = tqdm(dataloader, desc="Training")
         
         for batch in progress_bar:
@@ -126,20 +332,18 @@ class WAFTrainer:
             input_ids = batch['input_ids'].to(self.device)
             attention_mask = batch['attention_mask'].to(self.device)
             labels = batch['labels'].to(self.device)
+            masked = labels != -100
             
-            # Forward pass
+            # Forward pass (vocabulary logits at the masked positions only)
             outputs = self.model(
                 input_ids=input_ids,
-                attention_mask=attention_mask
+                attention_mask=attention_mask,
+                mlm_positions=masked
             )
             
             # Compute losses
             # MLM Loss
-            mlm_logits = outputs['mlm_logits']
-            mlm_loss = self.mlm_loss_fn(
-                mlm_logits.view(-1, self.model.config.vocab_size),
-                labels.view(-1)
-            )
+            mlm_loss = masked_mlm_loss(self.mlm_loss_fn, outputs['mlm_logits'], labels[masked])
             
             # Contrastive Loss
             contrastive_repr = outputs['contrastive_repr']
@@ -155,6 +359,12 @@ class WAFTrainer:
                 self.hypersphere_weight * hypersphere_loss
             )
             
+            # Early-exit heads learn to reproduce the final anomaly score
+            if 'exit_logits' in outputs:
+                exit_loss = exit_head_loss(outputs['exit_logits'], outputs['anomaly_score'])
+                total_batch_loss = total_batch_loss + self.exit_weight * exit_loss
+                exit_loss_total += exit_loss.item()
+                
             # Backward pass
             total_batch_loss.backward()
             
@@ -178,73 +388,122 @@ class WAFTrainer:
                 'hyper': hypersphere_loss.item()
             })
             
-        return {
+        metrics = {
             'total_loss': total_loss / num_batches,
             'mlm_loss': mlm_loss_total / num_batches,
             'contrastive_loss': contrastive_loss_total / num_batches,
             'hypersphere_loss': hypersphere_loss_total / num_batches
         }
+        if self.model.exit_heads:
+            metrics['exit_loss'] = exit_loss_total / num_batches
+        return metrics
         
     def evaluate(self, dataloader: DataLoader) -> Dict[str, float]:
-        """Evaluate model"""
+        """Evaluate model
+        
+        The loader is kept as the calibration set of the hypersphere
+        percentiles, which are only computed when a checkpoint is saved.
+        Batches of deduplicated datasets carry corpus counts; each unique
+        sequence then weighs in the losses and statistics as often as it
+        occurred.
+        """
         self.model.eval()
-        total_loss = 0.0
-        mlm_loss_total = 0.0
+        self.calibration_loader = dataloader
         num_batches = 0
         
-        all_anomaly_scores = []
-        all_perplexities = []
+        # Metrics accumulate in preallocated tensors (filled: rows seen, scored: rows with a perplexity)
+        num_sequences = len(dataloader.dataset)
+        # Summed token losses and masked-token counts per batch (a batch can have no masked token)
+        batch_losses = torch.zeros(len(dataloader), device=self.device)
+        batch_tokens = torch.zeros(len(dataloader), device=self.device)
+        anomaly_scores = torch.empty(num_sequences, device=self.device)
+        perplexities = torch.empty(num_sequences, device=self.device)
+        # Corpus count of every row and of every row with a perplexity (1 without counts)
+        row_weights = torch.empty(num_sequences, device=self.device)
+        scored_weights = torch.empty(num_sequences, device=self.device)
+        filled, scored = 0, 0
         
         with torch.no_grad():
+            from tqdm import tqdm
             for batch in tqdm(dataloader, desc="Evaluating"):
                 # Move to device
                 input_ids = batch['input_ids'].to(self.device)
                 attention_mask = batch['attention_mask'].to(self.device)
                 labels = batch['labels'].to(self.device)
+                masked = labels != -100
+                batch_size = input_ids.size(0)
+                weights = batch['counts'].to(self.device, torch.float) if 'counts' in batch else torch.ones(batch_size, device=self.device)
                 
-                # Forward pass
+                # Forward pass (vocabulary logits at the masked positions only)
                 outputs = self.model(
                     input_ids=input_ids,
-                    attention_mask=attention_mask
+                    attention_mask=attention_mask,
+                    mlm_positions=masked
                 )
                 
-                # Compute MLM loss
-                mlm_logits = outputs['mlm_logits']
-                mlm_loss = self.mlm_loss_fn(
-                    mlm_logits.view(-1, self.model.config.vocab_size),
-                    labels.view(-1)
-                )
-                
-                total_loss += mlm_loss.item()
-                mlm_loss_total += mlm_loss.item()
+                # Per-position MLM losses (weighted by their row's count), summed per batch with their count
+                token_losses = F.cross_entropy(outputs['mlm_logits'], labels[masked], reduction='none')
+                token_weights = weights.repeat_interleave(masked.sum(dim=1))
+                batch_losses[num_batches] = (token_losses * token_weights).sum()
+                batch_tokens[num_batches] = token_weights.sum()
                 num_batches += 1
                 
-                # Collect anomaly scores and perplexities
-                anomaly_scores = outputs['anomaly_score'].cpu().numpy()
-                all_anomaly_scores.extend(anomaly_scores)
+                anomaly_scores[filled:filled + batch_size] = outputs['anomaly_score']
+                row_weights[filled:filled + batch_size] = weights
+                filled += batch_size
                 
-                # Calculate perplexity for each sequence
-                for i in range(input_ids.size(0)):
-                    # Get non-masked tokens
-                    seq_labels = labels[i]
-                    valid_positions = seq_labels != -100
-                    
-                    if valid_positions.sum() > 0:
-                        seq_logits = mlm_logits[i][valid_positions]
-                        seq_labels_valid = seq_labels[valid_positions]
-                        
-                        # Compute perplexity
-                        seq_loss = nn.CrossEntropyLoss()(seq_logits, seq_labels_valid)
-                        perplexity = torch.exp(seq_loss).item()
-                        all_perplexities.append(perplexity)
-                        
-        return {
-            'total_loss': total_loss / num_batches,
-            'mlm_loss': mlm_loss_total / num_batches,
-            'perplexity': np.mean(all_perplexities) if all_perplexities else 0.0,
-            'avg_anomaly_score': np.mean(all_anomaly_scores) if all_anomaly_scores else 0.0,
-            'std_anomaly_score': np.std(all_anomaly_scores) if all_anomaly_scores else 0.0
+                # Perplexity of each sequence with masked tokens
+                batch_perplexities = sequence_perplexities(token_losses, masked)
+                perplexities[scored:scored + len(batch_perplexities)] = batch_perplexities
+                scored_weights[scored:scored + len(batch_perplexities)] = weights[masked.any(dim=1)]
+                scored += len(batch_perplexities)
+                
+        anomaly_scores, row_weights = anomaly_scores[:filled], row_weights[:filled]
+        avg_anomaly_score = weighted_mean(anomaly_scores, row_weights) if filled else 0.0
+        metrics = {
+            'perplexity': weighted_mean(perplexities[:scored], scored_weights[:scored]) if scored else 0.0,
+            'avg_anomaly_score': avg_anomaly_score,
+            'std_anomaly_score': weighted_mean((anomaly_scores - avg_anomaly_score) ** 2, row_weights) ** 0.5 if filled else 0.0
         }
+        # mlm_loss: mean of the per-batch mean losses (batches without a masked token skipped);
+        # mlm_loss_per_token: mean over all masked tokens. Both are left out when the split has none
+        with_tokens = batch_tokens > 0
+        if with_tokens.any():
+            mlm_loss = (batch_losses[with_tokens] / batch_tokens[with_tokens]).mean().item()
+            metrics['total_loss'] = mlm_loss
+            metrics['mlm_loss'] = mlm_loss
+            metrics['mlm_loss_per_token'] = (batch_losses.sum() / batch_tokens.sum()).item()
+        return metrics
+        
+    def calibrate_hypersphere(self, dataloader: DataLoader) -> Optional[List[float]]:
+        """Distance-to-center percentiles of the unmasked sequences of a validation loader
+        
+        One encoder pass per batch on the original ids (masked positions
+        restored from the labels), so the table matches unmasked serving
+        traffic, with deduplicated sequences weighted by their counts. None
+        before the center exists.
+        """
+        center = self.hypersphere_loss_fn.center
+        if center is None:
+            return None
+        self.model.eval()
+        distances = []
+        with torch.no_grad():
+            for batch in dataloader:
+                input_ids = batch['input_ids'].to(self.device)
+                attention_mask = batch['attention_mask'].to(self.device)
+                labels = batch['labels'].to(self.device)
+                original_ids = torch.where(labels != -100, labels, input_ids)
+                contrastive_repr = self.model.contrastive_representation(original_ids, attention_mask)
+                batch_distances = hypersphere_distance(contrastive_repr, center)
+                # Deduplicated sequences count as often as they occurred in the corpus
+                if 'counts' in batch:
+                    batch_distances = batch_distances.repeat_interleave(batch['counts'].to(self.device))
+                distances.append(batch_distances)
+        if distances:
+            self.hypersphere_percentiles = distance_percentiles(torch.cat(distances))
+            self.percentiles_stale = False
+        return self.hypersphere_percentiles
         
     def train(
         self,
@@ -278,8 +537,9 @@ class WAFTrainer:
             log_msg = f"Epoch {epoch+1}/{num_epochs} ({epoch_time:.2f}s)"
             log_msg += f" - Train Loss: {train_metrics['total_loss']:.4f}"
             
-            if val_metrics:
+            if 'total_loss' in val_metrics:
                 log_msg += f" - Val Loss: {val_metrics['total_loss']:.4f}"
+            if val_metrics:
                 log_msg += f" - Val Perplexity: {val_metrics['perplexity']:.2f}"
                 
             self.logger.info(log_msg)
@@ -295,8 +555,11 @@ class WAFTrainer:
             }
             self.training_history.append(epoch_data)
             
-            # Early stopping and model saving
-            current_val_loss = val_metrics.get('total_loss', train_metrics['total_loss'])
+            # Early stopping and model saving (a validation split without masked tokens has no loss to compare)
+            if val_dataloader:
+                current_val_loss = val_metrics.get('total_loss', float('inf'))
+            else:
+                current_val_loss = train_metrics['total_loss']
             
             if current_val_loss < best_val_loss:
                 best_val_loss = current_val_loss
@@ -325,12 +588,16 @@ class WAFTrainer:
         self.logger.info("Training completed!")
         
     def save_model(self, path: str):
-        """Save model and tokenizer"""
+        """Save model and tokenizer (recalibrating the hypersphere percentiles if the weights changed)"""
+        if self.percentiles_stale and self.calibration_loader is not None:
+            self.calibrate_hypersphere(self.calibration_loader)
         torch.save({
             'model_state_dict': self.model.state_dict(),
             'optimizer_state_dict': self.optimizer.state_dict(),
             'model_config': self.model.config.__dict__,
-            'tokenizer_vocab_size': self.tokenizer.vocab_size
+            'tokenizer_vocab_size': self.tokenizer.vocab_size,
+            'featurizer_config': self.featurizer_config,
+            'hypersphere': self.hypersphere_state()
         }, path)
         
         # Save tokenizer vocabulary
@@ -342,27 +609,49 @@ class WAFTrainer:
         checkpoint = torch.load(path, map_location=self.device)
         self.model.load_state_dict(checkpoint['model_state_dict'])
         self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+        self.featurizer_config = checkpoint.get('featurizer_config', self.featurizer_config)
+        hypersphere = checkpoint.get('hypersphere')
+        if hypersphere:
+            self.hypersphere_loss_fn.register_buffer('center', torch.tensor(hypersphere['center'], device=self.device))
+            self.hypersphere_percentiles = hypersphere.get('percentiles')
         
         # Load tokenizer vocabulary
         tokenizer_path = str(path).replace('.pt', '_tokenizer.json')
         if Path(tokenizer_path).exists():
             self.tokenizer.load_vocabulary(tokenizer_path)
             
+    def hypersphere_state(self) -> Optional[Dict[str, Any]]:
+        """Hypersphere center and distance calibration table (None before the first training step)"""
+        center = self.hypersphere_loss_fn.center
+        if center is None:
+            return None
+        return {'center': center.cpu().tolist(), 'percentiles': self.hypersphere_percentiles}
+        
     def save_training_history(self, path: str):
         """Save training history"""
         with open(path, 'w') as f:
             json.dump(self.training_history, f, indent=2)
 
-def prepare_training_data(log_sequences: List[List[str]], tokenizer: WAFTokenizer) -> Tuple[Dataset, Dataset]:
-    """Prepare training and validation datasets"""
-    # Build vocabulary from sequences
-    all_tokens = set()
-    for sequence in log_sequences:
-        all_tokens.update(sequence)
-        
-    # Add tokens to tokenizer
-    for token in all_tokens:
-        tokenizer.add_token(token)
+def prepare_training_data(log_sequences: List[List[str]], tokenizer: WAFTokenizer, deduplicate: bool = False) -> Tuple[Dataset, Dataset]:
+    """Prepare training and validation datasets
+    
+    With deduplicate (opt-in), identical sequences are collapsed into one
+    item with its corpus count (sampled by frequency, see create_dataloader)
+    and the split is made over unique sequences, so no sequence is in both
+    sets. The validation split then holds only sequences never trained on,
+    so its losses are not comparable with a duplicated split's.
+    """
+    # Build vocabulary from sequences (trains the subword model for subword tokenizers)
+    tokenizer.build_vocabulary(log_sequences)
+    
+    if deduplicate:
+        unique, counts = deduplicate_sequences(log_sequences)
+        logging.getLogger(__name__).info(f"Deduplicated {len(log_sequences)} sequences to {len(unique)} unique")
+        order = torch.randperm(len(unique)).numpy()
+        train, val = order[:int(0.8 * len(unique))], order[int(0.8 * len(unique)):]
+        train_dataset = LogSequenceDataset([unique[i] for i in train], tokenizer, counts=counts[train])
+        val_dataset = LogSequenceDataset([unique[i] for i in val], tokenizer, counts=counts[val])
+        return train_dataset, val_dataset
         
     # Create datasets
     full_dataset = LogSequenceDataset(log_sequences, tokenizer)
@@ -376,16 +665,29 @@ def prepare_training_data(log_sequences: List[List[str]], tokenizer: WAFTokenize
     return train_dataset, val_dataset
 
 def collate_fn(batch):
-    """Custom collate function for DataLoader"""
-    input_ids = torch.stack([item['input_ids'] for item in batch])
-    attention_mask = torch.stack([item['attention_mask'] for item in batch])
-    labels = torch.stack([item['labels'] for item in batch])
+    """Custom collate function for DataLoader
+    
+    Per-item rows (unpadded with dynamic padding) are right-padded to the
+    longest row of the batch, so batches match the [B, L] blocks that
+    __getitems__ returns already collated.
+    """
+    if isinstance(batch, dict):
+        return batch
+        
+    # [PAD] is id 0 for every tokenizer; padded positions carry no label
+    input_ids = pad_sequence([item['input_ids'] for item in batch], batch_first=True, padding_value=0)
+    attention_mask = pad_sequence([item['attention_mask'] for item in batch], batch_first=True, padding_value=0)
+    labels = pad_sequence([item['labels'] for item in batch], batch_first=True, padding_value=-100)
     
-    return {
+    collated = {
         'input_ids': input_ids,
         'attention_mask': attention_mask,
         'labels': labels
     }
+    # Corpus counts of deduplicated items (evaluation weights)
+    if 'counts' in batch[0]:
+        collated['counts'] = torch.stack([item['counts'] for item in batch])
+    return collated
 
 if __name__ == "__main__":
     # Test training pipeline
@@ -407,8 +709,8 @@ if __name__ == "__main__":
     train_dataset, val_dataset = prepare_training_data(sample_sequences, tokenizer)
     
     # Create dataloaders
-    train_dataloader = DataLoader(train_dataset, batch_size=16, shuffle=True, collate_fn=collate_fn)
-    val_dataloader = DataLoader(val_dataset, batch_size=16, shuffle=False, collate_fn=collate_fn)
+    train_dataloader = create_dataloader(train_dataset, batch_size=16, shuffle=True)
+    val_dataloader = create_dataloader(val_dataset, batch_size=16, shuffle=False)
     
     # Create trainer
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
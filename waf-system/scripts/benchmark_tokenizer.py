@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Tokenizer Benchmarks
+Measures encode throughput and vocabulary coverage of the WAF tokenizers
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import torch
+
+# Resolve WAF root
+WAF_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'preprocessing'))
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'training'))
+
+from columnar_processor import ColumnarLogProcessor  # type: ignore
+from featurizer import SequenceFeaturizer  # type: ignore
+from waf_model import EncodeBuffer, HashedTokenizer, SubwordTokenizer, WAFTokenizer  # type: ignore
+
+DEFAULT_LOG_PATH = WAF_ROOT / 'data' / 'logs' / 'benign_synth.log'
+
+def load_sequences(path: Path, limit: int) -> List[List[str]]:
+    """Featurize up to limit log lines, keeping query strings as tokens"""
+    featurizer = SequenceFeaturizer({'include_query': True})
+    processor = ColumnarLogProcessor(featurizer=featurizer)
+    return processor.build_sequences([str(path)], max_sequences=limit)
+
+def timed(fn: Callable[[], Any], repeat: int = 3) -> float:
+    """Best wall time of several runs"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def peak_bytes(fn: Callable[[], Any]) -> int:
+    """Peak traced memory while running fn"""
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def legacy_encode(tokenizer: WAFTokenizer, tokens: List[str], max_length: int) -> Dict[str, torch.Tensor]:
+    """Per-sequence list building and padding as done before batch encoding (baseline)"""
+    tokens = ['[CLS]'] + tokens[:max_length-2] + ['[SEP]']
+    input_ids = [tokenizer.token_to_id.get(token, tokenizer.special_tokens['[UNK]']) for token in tokens]
+    while len(input_ids) < max_length:
+        input_ids.append(tokenizer.special_tokens['[PAD]'])
+    input_ids = input_ids[:max_length]
+    attention_mask = [1 if id != tokenizer.special_tokens['[PAD]'] else 0 for id in input_ids]
+    return {
+        'input_ids': torch.tensor(input_ids, dtype=torch.long),
+        'attention_mask': torch.tensor(attention_mask, dtype=torch.long)
+    }
+
+def unk_rate(tokenizer: WAFTokenizer, sequences: List[List[str]], max_length: int) -> float:
+    """Fraction of non-padding positions encoded as [UNK]"""
+    input_ids = torch.stack([tokenizer.encode(sequence, max_length=max_length)['input_ids'] for sequence in sequences])
+    used = input_ids != tokenizer.special_tokens['[PAD]']
+    return float((input_ids == tokenizer.special_tokens['[UNK]']).sum() / used.sum())
+
+def bench_throughput(sequences: List[List[str]], max_length: int = 128, vocab_size: int = 10000) -> Dict[str, Any]:
+    """Compare dict-lookup encoding against the subword tokenizer (per call and Rust batch)"""
+    split = len(sequences) // 2
+    train, held_out = sequences[:split], sequences[split:]
+    
+    word = WAFTokenizer(vocab_size=vocab_size)
+    word.build_vocabulary(train)
+    subword = SubwordTokenizer(vocab_size=vocab_size)
+    start = time.perf_counter()
+    subword.build_vocabulary(train)
+    train_time = time.perf_counter() - start
+    
+    def word_encode():
+        encoded = [word.encode(sequence, max_length=max_length) for sequence in sequences]
+        return torch.stack([e['input_ids'] for e in encoded]), torch.stack([e['attention_mask'] for e in encoded])
+        
+    def subword_per_call():
+        encoded = [subword.encode(sequence, max_length=max_length) for sequence in sequences]
+        return torch.stack([e['input_ids'] for e in encoded]), torch.stack([e['attention_mask'] for e in encoded])
+        
+    def subword_batch():
+        return subword.encode_batch(sequences, max_length=max_length)
+        
+    results = {}
+    for name, fn in [('word_dict', word_encode), ('subword_per_call', subword_per_call), ('subword_batch', subword_batch)]:
+        elapsed = timed(fn)
+        results[name] = {
+            'seconds': elapsed,
+            'sequences_per_s': len(sequences) / elapsed
+        }
+        
+    subword_ids = subword.encode_batch(sequences, max_length=max_length)['input_ids']
+    return {
+        'sequences': len(sequences),
+        'subword_train_s': train_time,
+        'subword_vocab': subword.next_id,
+        'word_vocab': word.next_id,
+        'encode': results,
+        'held_out_unk_rate': {
+            'word_dict': unk_rate(word, held_out, max_length),
+            'subword': unk_rate(subword, held_out, max_length)
+        },
+        'subword_avg_tokens': float((subword_ids != 0).sum(dim=1).float().mean())
+    }
+
+def bench_hashed(sequences: List[List[str]], max_length: int = 128, vocab_size: int = 10000) -> Dict[str, Any]:
+    """Compare the growing dict vocabulary with the fixed-bucket hashed mode"""
+    word = WAFTokenizer(vocab_size=vocab_size)
+    word.build_vocabulary(sequences)
+    hashed = HashedTokenizer(vocab_size=vocab_size)
+    
+    def hashed_per_call():
+        encoded = [hashed.encode(sequence, max_length=max_length) for sequence in sequences]
+        return torch.stack([e['input_ids'] for e in encoded]), torch.stack([e['attention_mask'] for e in encoded])
+        
+    def hashed_batch():
+        return hashed.encode_batch(sequences, max_length=max_length)
+        
+    distinct = {token for sequence in sequences for token in sequence}
+    buckets = {hashed.add_token(token) for token in distinct}
+    results = {}
+    for name, fn in [('hashed_per_call', hashed_per_call), ('hashed_batch', hashed_batch)]:
+        elapsed = timed(fn)
+        results[name] = {
+            'seconds': elapsed,
+            'sequences_per_s': len(sequences) / elapsed
+        }
+        
+    return {
+        'sequences': len(sequences),
+        'encode': results,
+        'distinct_tokens': len(distinct),
+        'buckets_used': len(buckets),
+        'collision_rate': 1 - len(buckets) / max(1, len(distinct)),
+        'vocab_entries': {
+            'word_dict': len(word.token_to_id),
+            'hashed': len(hashed.token_to_id)
+        }
+    }
+
+def bench_batch(sequences: List[List[str]], max_length: int = 128, batch_size: int = 32) -> Dict[str, Any]:
+    """Compare per-sequence encode + torch.stack with encode_batch (fresh, reused buffer, array lookup)"""
+    tokenizer = WAFTokenizer()
+    tokenizer.build_vocabulary(sequences)
+    batches = [sequences[i:i + batch_size] for i in range(0, len(sequences), batch_size)]
+    buffer = EncodeBuffer(max_length=max_length, capacity=batch_size)
+    
+    def stacked():
+        for batch in batches:
+            encoded = [legacy_encode(tokenizer, sequence, max_length) for sequence in batch]
+            torch.stack([e['input_ids'] for e in encoded])
+            torch.stack([e['attention_mask'] for e in encoded])
+            
+    def batched():
+        for batch in batches:
+            tokenizer.encode_batch(batch, max_length=max_length)
+            
+    def batched_reused():
+        for batch in batches:
+            tokenizer.encode_batch(batch, max_length=max_length, buffer=buffer)
+            
+    def batched_array_lookup():
+        for batch in batches:
+            tokenizer.encode_batch(batch, max_length=max_length, buffer=buffer, array_lookup=True)
+            
+    # Tensors per batch: 2 per sequence + 2 stacked results before; one id/mask block after
+    tensors_per_batch = {
+        'stacked': 2 * batch_size + 2,
+        'batched': 1,
+        'batched_reused': 0,
+        'batched_array_lookup': 0
+    }
+    results = {}
+    for name, fn in [('stacked', stacked), ('batched', batched), ('batched_reused', batched_reused), ('batched_array_lookup', batched_array_lookup)]:
+        elapsed = timed(fn)
+        results[name] = {
+            'sequences_per_s': len(sequences) / elapsed,
+            'block_allocations_per_batch': tensors_per_batch[name],
+            'peak_traced_bytes': peak_bytes(fn)
+        }
+    results['batched_reused']['buffer_allocations_total'] = buffer.allocations
+    return {
+        'sequences': len(sequences),
+        'batch_size': batch_size,
+        'encode': results,
+        'speedup': results['batched_reused']['sequences_per_s'] / results['stacked']['sequences_per_s']
+    }
+
+BENCHMARKS = {
+    'batch': bench_batch,
+    'hashed': bench_hashed,
+    'throughput': bench_throughput,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS) + ['all'], nargs='?', default='all')
+    parser.add_argument('--log', type=Path, default=DEFAULT_LOG_PATH)
+    parser.add_argument('--requests', type=int, default=10_000)
+    args = parser.parse_args()
+    
+    sequences = load_sequences(args.log, args.requests)
+    names = sorted(BENCHMARKS) if args.benchmark == 'all' else [args.benchmark]
+    results = {name: BENCHMARKS[name](sequences) for name in names}
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+"""
+Training Benchmarks
+Measures the data-loading and loss costs of the WAF training path
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Subset
+
+# Resolve WAF root
+WAF_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'preprocessing'))
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'training'))
+
+from columnar_processor import ColumnarLogProcessor  # type: ignore
+from featurizer import SequenceFeaturizer  # type: ignore
+from token_store import TokenStoreDataset, write_token_store  # type: ignore
+from trainer import (  # type: ignore
+    LogSequenceDataset, WAFTrainer, collate_fn, create_dataloader, deduplicate_sequences, prepare_training_data, sequence_perplexities
+)
+from waf_model import WAFTokenizer, create_waf_model  # type: ignore
+
+DEFAULT_LOG_PATH = WAF_ROOT / 'data' / 'logs' / 'benign_synth.log'
+
+def load_sequences(path: Path, limit: int) -> List[List[str]]:
+    """Featurize up to limit log lines, keeping query strings as tokens"""
+    featurizer = SequenceFeaturizer({'include_query': True})
+    processor = ColumnarLogProcessor(featurizer=featurizer)
+    return processor.build_sequences([str(path)], max_sequences=limit)
+
+def timed(fn: Callable[[], Any], repeat: int = 3) -> float:
+    """Best wall time of several runs"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def legacy_mask_row(tokenizer: WAFTokenizer, input_ids: torch.Tensor, labels: torch.Tensor, mlm_probability: float = 0.15):
+    """Per-token MLM masking as done in LogSequenceDataset before the batched collator (baseline)"""
+    for i in range(1, len(input_ids) - 1):  # Skip CLS and SEP tokens
+        if torch.rand(1).item() < mlm_probability:
+            prob = torch.rand(1).item()
+            if prob < 0.8:
+                input_ids[i] = tokenizer.special_tokens['[MASK]']
+            elif prob < 0.9:
+                input_ids[i] = torch.randint(5, tokenizer.vocab_size, (1,)).item()
+        else:
+            labels[i] = -100
+
+def legacy_batch(dataset: LogSequenceDataset, indices: List[int]) -> Dict[str, torch.Tensor]:
+    """Batch fetch with per-row masking (baseline)"""
+    encoded = dataset.tokenizer.encode_batch([dataset.sequences[idx] for idx in indices], max_length=dataset.max_length)
+    input_ids = encoded['input_ids']
+    labels = input_ids.clone()
+    for row in range(len(indices)):
+        legacy_mask_row(dataset.tokenizer, input_ids[row], labels[row], dataset.mlm_probability)
+    return {'input_ids': input_ids, 'attention_mask': encoded['attention_mask'], 'labels': labels}
+
+def masking_stats(dataset: LogSequenceDataset, original: torch.Tensor, batch: Dict[str, torch.Tensor]) -> Dict[str, float]:
+    """Selection rate and 80/10/10 split of a masked batch, plus what should never be selected"""
+    tokenizer = dataset.tokenizer
+    selected = batch['labels'] != -100
+    special = torch.isin(original, torch.tensor(list(tokenizer.special_tokens.values())))
+    candidates = batch['attention_mask'].bool() & ~special
+    masked = selected & (batch['input_ids'] == tokenizer.special_tokens['[MASK]'])
+    replaced = selected & ~masked & (batch['input_ids'] != original)
+    return {
+        'selected_rate': float(selected[candidates].float().mean()),
+        'mask_share': float(masked.sum() / selected.sum()),
+        'random_share': float(replaced.sum() / selected.sum()),
+        'kept_share': float((selected & (batch['input_ids'] == original)).sum() / selected.sum()),
+        'padding_or_special_selected': int((selected & ~candidates).sum()),
+        'random_ids_outside_vocabulary': int((replaced & (batch['input_ids'] >= tokenizer.next_id)).sum())
+    }
+
+def bench_masking(sequences: List[List[str]], batch_size: int = 32, vocab_size: int = 10000) -> Dict[str, Any]:
+    """Per-token masking loop against the batched collator, at short and long max_length"""
+    tokenizer = WAFTokenizer(vocab_size=vocab_size)
+    tokenizer.build_vocabulary(sequences)
+    batches = [list(range(i, i + batch_size)) for i in range(0, min(len(sequences), 64 * batch_size) - batch_size + 1, batch_size)]
+    rows = len(batches) * batch_size
+    results = {'vocabulary_tokens': tokenizer.next_id, 'vocab_size': vocab_size}
+    for max_length in (128, 512):
+        dataset = LogSequenceDataset(sequences, tokenizer, max_length=max_length)
+        legacy_s = timed(lambda: [legacy_batch(dataset, indices) for indices in batches], repeat=1)
+        collator_s = timed(lambda: [dataset.__getitems__(indices) for indices in batches])
+        
+        # Masking statistics over the whole sample (same sequences for both)
+        indices = [index for batch in batches for index in batch]
+        original = tokenizer.encode_batch([sequences[i] for i in indices], max_length=max_length)['input_ids']
+        results[f'max_length_{max_length}'] = {
+            'legacy_samples_per_s': rows / legacy_s,
+            'collator_samples_per_s': rows / collator_s,
+            'speedup': legacy_s / collator_s,
+            'legacy': masking_stats(dataset, original, legacy_batch(dataset, indices)),
+            'collator': masking_stats(dataset, original, dataset.__getitems__(indices))
+        }
+    return results
+
+def corpus_copy(sequences: List[List[str]], size: int) -> List[List[str]]:
+    """size sequences cycling through the corpus, each with its own string objects (like freshly parsed lines)"""
+    return [[token.encode().decode() for token in sequences[i % len(sequences)]] for i in range(size)]
+
+def traced(fn: Callable[[], Any]) -> Tuple[Any, int]:
+    """Result of fn and the bytes it left allocated"""
+    tracemalloc.start()
+    result = fn()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, held
+
+def epoch_seconds(dataset, batch_size: int) -> float:
+    """Wall time of one shuffled DataLoader epoch of MLM batches"""
+    start = time.perf_counter()
+    for _ in DataLoader(dataset, batch_size=batch_size, shuffle=True, collate_fn=collate_fn):
+        pass
+    return time.perf_counter() - start
+
+def bench_token_store(
+    sequences: List[List[str]],
+    batch_size: int = 32,
+    max_length: int = 128,
+    sizes: Tuple[int, ...] = (10_000, 100_000, 1_000_000)
+) -> Dict[str, Any]:
+    """String-list dataset against the memory-mapped token store as the corpus grows"""
+    tokenizer = WAFTokenizer()
+    tokenizer.build_vocabulary(sequences)
+    results = {}
+    for size in sizes:
+        corpus, corpus_bytes = traced(lambda: corpus_copy(sequences, size))
+        list_dataset = LogSequenceDataset(corpus, tokenizer, max_length=max_length)
+        list_epoch_s = epoch_seconds(list_dataset, batch_size)
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            metadata = write_token_store(corpus, tokenizer, tmp)
+            del corpus, list_dataset
+            store_dataset, store_bytes = traced(lambda: TokenStoreDataset(tmp, max_length=max_length, tokenizer=tokenizer))
+            store_epoch_s = epoch_seconds(store_dataset, batch_size)
+            
+            # Same rows, same encoding (masking aside)
+            indices = list(range(0, size, max(1, size // 256)))
+            expected = tokenizer.encode_batch([sequences[i % len(sequences)] for i in indices], max_length=max_length)
+            identical = torch.equal(store_dataset.encode(indices)['input_ids'], expected['input_ids'])
+            results[size] = {
+                'list_heap_mb': corpus_bytes / 2 ** 20,
+                'store_heap_mb': store_bytes / 2 ** 20,
+                'store_disk_mb': sum(f.stat().st_size for f in Path(tmp).iterdir()) / 2 ** 20,
+                'store_build_s': metadata['build_s'],
+                'list_samples_per_s': size / list_epoch_s,
+                'store_samples_per_s': size / store_epoch_s,
+                'identical_encoding': identical
+            }
+    return results
+
+EPOCH_PROBE = """
+import json, resource, sys, time
+sys.path[:0] = {paths!r}
+import numpy as np, torch
+from torch.utils.data import DataLoader
+from columnar_processor import ColumnarLogProcessor
+from featurizer import SequenceFeaturizer
+from trainer import LogSequenceDataset, WAFTrainer, collate_fn, create_dataloader
+from waf_model import create_waf_model
+torch.manual_seed(0)
+sequences = ColumnarLogProcessor(featurizer=SequenceFeaturizer({{'include_query': True}})).build_sequences([{log_path!r}], max_sequences={limit})
+train, val = sequences[:{train_size}], sequences[{train_size}:]
+model, tokenizer = create_waf_model()
+tokenizer.build_vocabulary(sequences)
+trainer = WAFTrainer(model, tokenizer)
+dynamic = {mode!r} != 'fixed'
+datasets = [LogSequenceDataset(part, tokenizer, max_length=512, dynamic_padding=dynamic) for part in (train, val)]
+if {mode!r} == 'bucketed':
+    loaders = [create_dataloader(datasets[0], {batch_size}, shuffle=True), create_dataloader(datasets[1], {batch_size}, shuffle=False)]
+else:
+    loaders = [DataLoader(datasets[0], batch_size={batch_size}, shuffle=True, collate_fn=collate_fn), DataLoader(datasets[1], batch_size={batch_size}, collate_fn=collate_fn)]
+widths = [batch['input_ids'].shape[1] for batch in loaders[0]]
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+trainer.train_epoch(loaders[0])
+trained = time.perf_counter()
+trainer.evaluate(loaders[1])
+print(json.dumps({{
+    'train_epoch_s': trained - start,
+    'evaluate_s': time.perf_counter() - trained,
+    'mean_batch_width': float(np.mean(widths)),
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'training_peak_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024
+}}))
+"""
+
+def bench_bucketing(sequences: List[List[str]], batch_size: int = 16, train_size: int = 1024, val_size: int = 256) -> Dict[str, Any]:
+    """One training epoch and one evaluation with fixed max_length=512 padding, dynamic padding, and length buckets
+    
+    Each mode runs in a fresh interpreter so peak RSS is its own; a mode
+    killed for running out of memory is reported with its exit code.
+    """
+    paths = [str(WAF_ROOT / 'ml-pipeline' / name) for name in ('preprocessing', 'training')]
+    lengths = [len(sequence) for sequence in sequences]
+    results = {'train_sequences': train_size, 'mean_tokens': float(np.mean(lengths)), 'max_tokens': max(lengths)}
+    for mode in ('fixed', 'dynamic', 'bucketed'):
+        probe = EPOCH_PROBE.format(
+            paths=paths, log_path=str(DEFAULT_LOG_PATH), limit=train_size + val_size,
+            train_size=train_size, mode=mode, batch_size=batch_size
+        )
+        process = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True)
+        results[mode] = json.loads(process.stdout.strip().splitlines()[-1]) if process.returncode == 0 else {'exit_code': process.returncode}
+    if 'train_epoch_s' in results['fixed']:
+        for mode in ('dynamic', 'bucketed'):
+            if 'train_epoch_s' in results[mode]:
+                results[mode]['epoch_speedup'] = results['fixed']['train_epoch_s'] / results[mode]['train_epoch_s']
+    return results
+
+def packed_sequences(sequences: List[List[str]], length: int, count: int) -> List[List[str]]:
+    """count sequences of length tokens, cut from the concatenated corpus (long multi-request windows)"""
+    tokens = [token for sequence in sequences for token in sequence]
+    needed = length * count
+    tokens = (tokens * (needed // len(tokens) + 1))[:needed]
+    return [tokens[i * length:(i + 1) * length] for i in range(count)]
+
+def mlm_step(trainer: WAFTrainer, batch: Dict[str, torch.Tensor], masked_only: bool) -> torch.Tensor:
+    """MLM forward and backward; projects every position to the vocabulary unless masked_only (baseline)"""
+    trainer.optimizer.zero_grad()
+    labels = batch['labels']
+    masked = labels != -100
+    if masked_only:
+        outputs = trainer.model(batch['input_ids'], batch['attention_mask'], mlm_positions=masked)
+        loss = trainer.mlm_loss_fn(outputs['mlm_logits'], labels[masked])
+    else:
+        outputs = trainer.model(batch['input_ids'], batch['attention_mask'])
+        loss = trainer.mlm_loss_fn(outputs['mlm_logits'].view(-1, trainer.model.config.vocab_size), labels.view(-1))
+    loss.backward()
+    return loss
+
+MLM_PROBE = """
+import json, resource, sys, time
+sys.path.insert(0, {scripts!r})
+from pathlib import Path
+import torch
+from benchmark_training import load_sequences, mlm_step, packed_sequences
+from trainer import LogSequenceDataset, WAFTrainer
+from waf_model import create_waf_model
+torch.manual_seed(0)
+sequences = packed_sequences(load_sequences(Path({log_path!r}), {limit}), {length}, {count})
+model, tokenizer = create_waf_model()
+tokenizer.build_vocabulary(sequences)
+trainer = WAFTrainer(model, tokenizer)
+dataset = LogSequenceDataset(sequences, tokenizer, max_length={length} + 2)
+batches = [dataset.__getitems__(list(range(i, i + {batch_size}))) for i in range(0, {count}, {batch_size})]
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+for batch in batches:
+    mlm_step(trainer, batch, {masked_only})
+print(json.dumps({{
+    'step_ms': (time.perf_counter() - start) / len(batches) * 1000,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'step_peak_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024
+}}))
+"""
+
+def bench_mlm_loss(sequences: List[List[str]], batch_size: int = 16, count: int = 64) -> Dict[str, Any]:
+    """MLM forward/backward projecting all positions against masked positions only, on long packed windows
+    
+    Losses and gradients are compared on one batch (dropout off); step time
+    and peak RSS come from a fresh interpreter per mode and width.
+    """
+    results = {}
+    for length in (126, 510):
+        packed = packed_sequences(sequences, length, batch_size)
+        torch.manual_seed(0)
+        model, tokenizer = create_waf_model()
+        tokenizer.build_vocabulary(packed)
+        trainer = WAFTrainer(model, tokenizer)
+        model.eval()
+        batch = LogSequenceDataset(packed, tokenizer, max_length=length + 2).__getitems__(list(range(batch_size)))
+        full_loss = mlm_step(trainer, batch, masked_only=False).item()
+        full_grads = [param.grad.clone() for param in model.parameters() if param.grad is not None]
+        masked_loss = mlm_step(trainer, batch, masked_only=True).item()
+        masked_grads = [param.grad for param in model.parameters() if param.grad is not None]
+        result = {
+            'masked_fraction': float((batch['labels'] != -100).float().mean()),
+            'loss_abs_diff': abs(full_loss - masked_loss),
+            'max_grad_abs_diff': max(float((a - b).abs().max()) for a, b in zip(full_grads, masked_grads))
+        }
+        for mode, masked_only in (('full', False), ('masked', True)):
+            probe = MLM_PROBE.format(
+                scripts=str(WAF_ROOT / 'scripts'), log_path=str(DEFAULT_LOG_PATH), limit=len(sequences),
+                length=length, count=count, batch_size=batch_size, masked_only=masked_only
+            )
+            process = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True)
+            result[mode] = json.loads(process.stdout.strip().splitlines()[-1]) if process.returncode == 0 else {'exit_code': process.returncode}
+        if 'step_ms' in result['full'] and 'step_ms' in result['masked']:
+            result['speedup'] = result['full']['step_ms'] / result['masked']['step_ms']
+        results[f'length_{length + 2}'] = result
+    return results
+
+def legacy_sequence_metrics(outputs: Dict[str, torch.Tensor], labels: torch.Tensor, anomaly_scores: List[float], perplexities: List[float]) -> float:
+    """Batch MLM loss, with per-sequence perplexity in a Python loop and numpy score collection (evaluate before vectorizing, baseline)"""
+    masked = labels != -100
+    mlm_logits, masked_labels = outputs['mlm_logits'], labels[masked]
+    mlm_loss = nn.CrossEntropyLoss()(mlm_logits, masked_labels).item()
+    anomaly_scores.extend(outputs['anomaly_score'].cpu().numpy())
+    counts = masked.sum(dim=1).tolist()
+    for seq_logits, seq_labels in zip(mlm_logits.split(counts), masked_labels.split(counts)):
+        if len(seq_labels) > 0:
+            perplexities.append(torch.exp(nn.CrossEntropyLoss()(seq_logits, seq_labels)).item())
+    return mlm_loss
+
+def legacy_evaluate(trainer: WAFTrainer, dataloader: DataLoader) -> Dict[str, float]:
+    """WAFTrainer.evaluate metrics computed with legacy_sequence_metrics (no hypersphere center)"""
+    trainer.model.eval()
+    losses, anomaly_scores, perplexities = [], [], []
+    with torch.no_grad():
+        for batch in dataloader:
+            masked = batch['labels'] != -100
+            outputs = trainer.model(batch['input_ids'], batch['attention_mask'], mlm_positions=masked)
+            losses.append(legacy_sequence_metrics(outputs, batch['labels'], anomaly_scores, perplexities))
+    return {
+        'mlm_loss': float(np.mean(losses)),
+        'perplexity': float(np.mean(perplexities)),
+        'avg_anomaly_score': float(np.mean(anomaly_scores)),
+        'std_anomaly_score': float(np.std(anomaly_scores))
+    }
+
+def bench_evaluate(sequences: List[List[str]], batch_size: int = 32, cached_batches: int = 64) -> Dict[str, Any]:
+    """Validation pass with the per-sequence perplexity loop against the vectorized metrics
+    
+    End to end on the whole corpus as validation split (same masks for both,
+    seeded), and the metric computation alone on cached model outputs.
+    """
+    torch.manual_seed(0)
+    model, tokenizer = create_waf_model()
+    tokenizer.build_vocabulary(sequences)
+    trainer = WAFTrainer(model, tokenizer)
+    dataloader = create_dataloader(LogSequenceDataset(sequences, tokenizer), batch_size=batch_size, shuffle=False)
+    
+    def seeded(fn: Callable[[], Dict[str, float]]) -> Callable[[], Dict[str, float]]:
+        return lambda: (torch.manual_seed(0), fn())[1]
+        
+    legacy_metrics = seeded(lambda: legacy_evaluate(trainer, dataloader))()
+    metrics = seeded(lambda: trainer.evaluate(dataloader))()
+    legacy_s = timed(seeded(lambda: legacy_evaluate(trainer, dataloader)))
+    evaluate_s = timed(seeded(lambda: trainer.evaluate(dataloader)))
+    
+    # Metrics alone, on model outputs cached for the first batches
+    cached = []
+    with torch.no_grad():
+        for batch, _ in zip(dataloader, range(cached_batches)):
+            masked = batch['labels'] != -100
+            cached.append((model(batch['input_ids'], batch['attention_mask'], mlm_positions=masked), batch['labels']))
+            
+    def vectorized_metrics():
+        for outputs, labels in cached:
+            masked = labels != -100
+            token_losses = F.cross_entropy(outputs['mlm_logits'], labels[masked], reduction='none')
+            token_losses.mean(), sequence_perplexities(token_losses, masked)
+            
+    legacy_metrics_s = timed(lambda: [legacy_sequence_metrics(outputs, labels, [], []) for outputs, labels in cached])
+    vectorized_metrics_s = timed(vectorized_metrics)
+    return {
+        'validation_sequences': len(sequences),
+        'legacy_evaluate_s': legacy_s,
+        'evaluate_s': evaluate_s,
+        'evaluate_speedup': legacy_s / evaluate_s,
+        'metrics_per_batch_ms': {'legacy': legacy_metrics_s / len(cached) * 1000, 'vectorized': vectorized_metrics_s / len(cached) * 1000},
+        'metrics_speedup': legacy_metrics_s / vectorized_metrics_s,
+        'metric_abs_diff': {name: abs(metrics[name] - legacy_metrics[name]) for name in legacy_metrics}
+    }
+
+def split_sequences(dataset) -> List[List[str]]:
+    """Sequences of a LogSequenceDataset or of a Subset of one"""
+    if isinstance(dataset, Subset):
+        return [dataset.dataset.sequences[i] for i in dataset.indices]
+    return dataset.sequences
+
+def bench_dedup(sequences: List[List[str]], batch_size: int = 32, traffic_size: int = 2048, epochs: int = 10) -> Dict[str, Any]:
+    """One training epoch on every duplicate against the deduplicated, frequency-sampled corpus
+    
+    Reports train/validation leakage of each split, how closely the
+    frequency sampler reproduces the corpus distribution (total variation
+    distance of sampled item frequencies) and the MLM loss of both models
+    on the same traffic sample (duplicates included, seeded masks), with the
+    deduplicated model also after a second epoch (about as many samples).
+    """
+    unique, counts = deduplicate_sequences(sequences)
+    results = {'sequences': len(sequences), 'unique': len(unique), 'dedup_ratio': len(sequences) / len(unique), 'top_count': int(counts.max())}
+    for mode, deduplicate in (('duplicated', False), ('deduplicated', True)):
+        torch.manual_seed(0)
+        model, tokenizer = create_waf_model()
+        train_dataset, val_dataset = prepare_training_data(sequences, tokenizer, deduplicate=deduplicate)
+        train_loader = create_dataloader(train_dataset, batch_size=batch_size, shuffle=True)
+        trainer = WAFTrainer(model, tokenizer)
+        train = {tuple(sequence) for sequence in split_sequences(train_dataset)}
+        result = {
+            'train_items': len(train_dataset),
+            'val_leakage': sum(tuple(sequence) in train for sequence in split_sequences(val_dataset)) / max(1, len(val_dataset))
+        }
+        if deduplicate:
+            sampled = np.bincount(np.concatenate([np.concatenate(list(train_loader.batch_sampler)) for _ in range(epochs)]), minlength=len(train_dataset))
+            target = train_dataset.counts / train_dataset.counts.sum()
+            result['sampling_tv_distance'] = float(np.abs(sampled / sampled.sum() - target).sum() / 2)
+        start = time.perf_counter()
+        trainer.train_epoch(train_loader)
+        result['train_epoch_s'] = time.perf_counter() - start
+        torch.manual_seed(1)
+        traffic = create_dataloader(LogSequenceDataset(sequences[:traffic_size], tokenizer), batch_size=batch_size, shuffle=False)
+        result['traffic_mlm_loss'] = trainer.evaluate(traffic)['mlm_loss']
+        if deduplicate:
+            # A second epoch: about as many samples as one duplicated epoch
+            start = time.perf_counter()
+            trainer.train_epoch(train_loader)
+            result['two_epochs_s'] = result['train_epoch_s'] + time.perf_counter() - start
+            torch.manual_seed(1)
+            result['two_epochs_traffic_mlm_loss'] = trainer.evaluate(traffic)['mlm_loss']
+        results[mode] = result
+    results['epoch_speedup'] = results['duplicated']['train_epoch_s'] / results['deduplicated']['train_epoch_s']
+    return results
+
+BENCHMARKS = {
+    'bucketing': bench_bucketing,
+    'dedup': bench_dedup,
+    'evaluate': bench_evaluate,
+    'masking': bench_masking,
+    'mlm_loss': bench_mlm_loss,
+    'token_store': bench_token_store
+}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS) + ['all'], nargs='?', default='all')
+    parser.add_argument('--log', type=Path, default=DEFAULT_LOG_PATH)
+    parser.add_argument('--requests', type=int, default=10_000)
+    args = parser.parse_args()
+    
+    sequences = load_sequences(args.log, args.requests)
+    names = sorted(BENCHMARKS) if args.benchmark == 'all' else [args.benchmark]
+    results = {name: BENCHMARKS[name](sequences) for name in names}
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
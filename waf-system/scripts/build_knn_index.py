@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Build kNN Benign Index
+Encodes the benign training corpus of a trained checkpoint into deduplicated
+pooled embeddings, writes the memory-mapped index next to the checkpoint and
+calibrates the kNN distance score on held-out traffic
+"""
+
+import argparse
+import json
+import logging
+import random
+import sys
+from pathlib import Path
+
+import torch
+
+# Resolve WAF root
+WAF_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'preprocessing'))
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'training'))
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'inference'))
+
+from columnar_processor import ColumnarLogProcessor  # type: ignore
+from featurizer import SequenceFeaturizer  # type: ignore
+from knn_index import DEFAULT_K, DEFAULT_NPROBE, INDEX_DTYPES, BenignIndexBuilder, index_path_for  # type: ignore
+from waf_model import WAFTransformer, WAFTransformerConfig, load_tokenizer  # type: ignore
+
+DEFAULT_MODEL_PATH = WAF_ROOT / 'data' / 'models' / 'best_model.pt'
+DEFAULT_LOG_PATH = WAF_ROOT / 'data' / 'logs' / 'benign_synth.log'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', type=Path, default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--output', type=Path, default=None, help='Index directory (default: <model>.knn)')
+    parser.add_argument('--log', type=Path, action='append', help='Benign log file (repeatable)')
+    parser.add_argument('--max-lines', type=int, default=1_000_000)
+    parser.add_argument('--calibration-size', type=int, default=2000, help='Held-out sequences for the score calibration')
+    parser.add_argument('--k', type=int, default=DEFAULT_K)
+    parser.add_argument('--dtype', choices=INDEX_DTYPES, default='float32', help='Stored vector type (float16 halves the index)')
+    parser.add_argument('--partitions', type=int, default=0, help='k-means partitions (0: exact search; about sqrt(size) for large corpora)')
+    parser.add_argument('--nprobe', type=int, default=DEFAULT_NPROBE, help='Partitions searched per query')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--max-length', type=int, default=128)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    
+    checkpoint = torch.load(str(args.model), map_location='cpu')
+    model = WAFTransformer(WAFTransformerConfig(**checkpoint['model_config']))
+    model.load_state_dict(checkpoint['model_state_dict'])
+    tokenizer = load_tokenizer(str(args.model).replace('.pt', '_tokenizer.json'), vocab_size=model.config.vocab_size)
+    featurizer = SequenceFeaturizer.from_checkpoint(checkpoint.get('featurizer_config'))
+    
+    log_paths = [str(path) for path in (args.log or [DEFAULT_LOG_PATH])]
+    sequences = ColumnarLogProcessor(featurizer=featurizer).build_sequences(log_paths, max_sequences=args.max_lines)
+    random.Random(42).shuffle(sequences)
+    calibration_size = min(args.calibration_size, len(sequences) // 10)
+    calibration, corpus = sequences[:calibration_size], sequences[calibration_size:]
+    
+    builder = BenignIndexBuilder(model, tokenizer, max_length=args.max_length, batch_size=args.batch_size)
+    metadata = builder.build(
+        corpus,
+        str(args.output or index_path_for(args.model)),
+        calibration_sequences=calibration,
+        k=args.k,
+        dtype=args.dtype,
+        partitions=args.partitions,
+        nprobe=args.nprobe
+    )
+    print(json.dumps({key: value for key, value in metadata.items() if key != 'percentiles'}, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Build Token Store
+Featurizes and tokenizes a training log corpus once into a memory-mapped
+token store (int32 tokens, offsets, lengths and the frozen vocabulary) for
+TokenStoreDataset
+"""
+
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+
+import torch
+
+# Resolve WAF root
+WAF_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'preprocessing'))
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'training'))
+
+from columnar_processor import ColumnarLogProcessor  # type: ignore
+from featurizer import SequenceFeaturizer  # type: ignore
+from token_store import write_token_store  # type: ignore
+from waf_model import TOKENIZER_TYPES, load_tokenizer  # type: ignore
+
+DEFAULT_LOG_PATH = WAF_ROOT / 'data' / 'logs' / 'benign_synth.log'
+DEFAULT_STORE_PATH = WAF_ROOT / 'data' / 'token_store'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--log', type=Path, action='append', help='Training log file (repeatable)')
+    parser.add_argument('--output', type=Path, default=DEFAULT_STORE_PATH)
+    parser.add_argument('--max-lines', type=int, default=1_000_000)
+    parser.add_argument('--model', type=Path, default=None, help='Reuse the vocabulary and featurization of a trained checkpoint')
+    parser.add_argument('--tokenizer-type', choices=sorted(TOKENIZER_TYPES), default='word')
+    parser.add_argument('--vocab-size', type=int, default=10000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    
+    if args.model is not None:
+        checkpoint = torch.load(str(args.model), map_location='cpu')
+        featurizer = SequenceFeaturizer.from_checkpoint(checkpoint.get('featurizer_config'))
+        tokenizer = load_tokenizer(str(args.model).replace('.pt', '_tokenizer.json'), vocab_size=checkpoint['model_config']['vocab_size'])
+    else:
+        featurizer = SequenceFeaturizer()
+        tokenizer = TOKENIZER_TYPES[args.tokenizer_type](vocab_size=args.vocab_size)
+        
+    log_paths = [str(path) for path in (args.log or [DEFAULT_LOG_PATH])]
+    sequences = ColumnarLogProcessor(featurizer=featurizer).build_sequences(log_paths, max_sequences=args.max_lines)
+    if args.model is None:
+        tokenizer.build_vocabulary(sequences)
+        
+    metadata = write_token_store(sequences, tokenizer, str(args.output), featurizer_config=featurizer.to_config())
+    print(json.dumps(metadata, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Distill WAF Model
+Trains a small student from a trained teacher checkpoint on log traffic and
+saves it in the standard checkpoint format for the inference service
+"""
+
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+
+import torch
+
+# Resolve WAF root
+WAF_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'preprocessing'))
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'training'))
+
+from columnar_processor import ColumnarLogProcessor  # type: ignore
+from featurizer import SequenceFeaturizer  # type: ignore
+from distillation import STUDENT_PRESETS, DistillationTrainer, create_student_config  # type: ignore
+from waf_model import WAFTransformer, WAFTransformerConfig, load_tokenizer  # type: ignore
+
+DEFAULT_TEACHER_PATH = WAF_ROOT / 'data' / 'models' / 'best_model.pt'
+DEFAULT_LOG_PATH = WAF_ROOT / 'data' / 'logs' / 'benign_synth.log'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--teacher', type=Path, default=DEFAULT_TEACHER_PATH)
+    parser.add_argument('--output', type=Path, default=None, help='Student checkpoint (default: <teacher>_student.pt)')
+    parser.add_argument('--log', type=Path, action='append', help='Training log file (repeatable)')
+    parser.add_argument('--max-lines', type=int, default=50_000)
+    parser.add_argument('--preset', choices=sorted(STUDENT_PRESETS), default='small')
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=64)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    
+    # Teacher and its tokenizer/featurization
+    checkpoint = torch.load(str(args.teacher), map_location='cpu')
+    teacher = WAFTransformer(WAFTransformerConfig(**checkpoint['model_config']))
+    teacher.load_state_dict(checkpoint['model_state_dict'])
+    tokenizer = load_tokenizer(str(args.teacher).replace('.pt', '_tokenizer.json'), vocab_size=teacher.config.vocab_size)
+    featurizer = SequenceFeaturizer.from_checkpoint(checkpoint.get('featurizer_config'))
+    
+    log_paths = [str(path) for path in (args.log or [DEFAULT_LOG_PATH])]
+    sequences = ColumnarLogProcessor(featurizer=featurizer).build_sequences(log_paths, max_sequences=args.max_lines)
+    
+    student = WAFTransformer(create_student_config(teacher.config, args.preset))
+    distiller = DistillationTrainer(teacher, student, tokenizer, featurizer_config=featurizer.to_config())
+    report = distiller.distill(sequences, num_epochs=args.epochs, batch_size=args.batch_size)
+    
+    output = args.output or args.teacher.with_name(args.teacher.stem + '_student.pt')
+    distiller.save_student(str(output), report=report)
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
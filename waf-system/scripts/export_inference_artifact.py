@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Export Inference Artifact
+Converts a training checkpoint into the serving artifact (safetensors weights,
+compact vocabulary, featurizer and Drain metadata)
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+# Resolve WAF root
+WAF_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'preprocessing'))
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'training'))
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'inference'))
+
+from log_processor import DEFAULT_DRAIN_PARAMS  # type: ignore
+from model_artifact import export_checkpoint  # type: ignore
+
+DEFAULT_MODEL_PATH = WAF_ROOT / 'data' / 'models' / 'best_model.pt'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('checkpoint', type=Path, nargs='?', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--output', type=Path, default=None, help='Artifact directory (default: <checkpoint>.artifact)')
+    args = parser.parse_args()
+    
+    artifact_path = export_checkpoint(str(args.checkpoint), args.output, drain_params=dict(DEFAULT_DRAIN_PARAMS))
+    size = sum(f.stat().st_size for f in artifact_path.iterdir())
+    print(f"Exported {args.checkpoint} -> {artifact_path} ({size / 1024:.1f} KB)")
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,7 @@ import subprocess
 import signal
 import sys
 import yaml
+import torch
 
 # Import our modules
 sys.path.append('../ml-pipeline/ingestion')
@@ -23,7 +24,8 @@ sys.path.append('../ml-pipeline/inference')
 
 from log_ingestion import LogIngestion
 from log_processor import LogPreprocessor
-from trainer import WAFTrainer, prepare_training_data, collate_fn
+from featurizer import SequenceFeaturizer
+from trainer import WAFTrainer, prepare_training_data, create_dataloader
 from lora_trainer import IncrementalUpdateManager
 from waf_model import create_waf_model
 
@@ -36,7 +38,12 @@ class WAFPipelineOrchestrator:
         
         # Initialize components
         self.log_ingestion = None
-        self.preprocessor = LogPreprocessor()
+        data_config = self.config['data']
+        self.preprocessor = LogPreprocessor(
+            log_format=data_config.get('log_format', 'auto'),
+            json_field_map=data_config.get('json_field_map')
+        )
+        self.featurizer = SequenceFeaturizer(self.config['model'].get('featurizer', {'preset': 'pipeline'}))
         self.model = None
         self.tokenizer = None
         self.trainer = None
@@ -67,24 +74,30 @@ class WAFPipelineOrchestrator:
                         '/Users/majjipradeepkumar/Downloads/WAF/Sample-apps-for-training-a-transformer-based-WAF-pipleline/waf-system/data/logs/access.log'
                     ],
                     'training_data_dir': '/Users/majjipradeepkumar/Downloads/WAF/Sample-apps-for-training-a-transformer-based-WAF-pipleline/waf-system/data/training',
-                    'model_dir': '/Users/majjipradeepkumar/Downloads/WAF/Sample-apps-for-training-a-transformer-based-WAF-pipleline/waf-system/data/models'
+                    'model_dir': '/Users/majjipradeepkumar/Downloads/WAF/Sample-apps-for-training-a-transformer-based-WAF-pipleline/waf-system/data/models',
+                    'log_format': 'auto',  # auto | combined | json (detected per source when auto)
+                    'json_field_map': None  # Overrides for JSON log keys, e.g. {'http_user_agent': 'ua'}
                 },
                 'model': {
                     'vocab_size': 10000,
                     'hidden_size': 256,
                     'num_layers': 4,
-                    'max_sequence_length': 512
+                    'max_sequence_length': 512,
+                    'tokenizer': 'word',  # word | subword (byte-level BPE; pair with featurizer include_query) | hashed
+                    'featurizer': {'preset': 'pipeline'}  # Token rules, saved with checkpoints
                 },
                 'training': {
                     'batch_size': 32,
                     'learning_rate': 5e-5,
                     'num_epochs': 10,
                     'validation_split': 0.2,
-                    'early_stopping_patience': 3
+                    'early_stopping_patience': 3,
+                    'deduplicate': False  # Collapse repeated sequences, sampled by frequency
                 },
                 'pipeline': {
                     'min_sequences_for_training': 1000,
                     'incremental_update_threshold': 500,
+                    'max_buffered_sequences': 100000,  # Cap on sequences kept in memory
                     'training_schedule_hours': 24  # Retrain every 24 hours
                 },
                 'traffic_generation': {
@@ -130,7 +143,7 @@ class WAFPipelineOrchestrator:
         
         # Initialize log ingestion
         log_paths = self.config['data']['log_paths']
-        self.log_ingestion = LogIngestion(log_paths)
+        self.log_ingestion = LogIngestion(log_paths, log_format=self.config['data'].get('log_format', 'auto'))
         
         # Initialize or load model
         model_path = Path(self.config['data']['model_dir']) / 'best_model.pt'
@@ -154,7 +167,8 @@ class WAFPipelineOrchestrator:
         
         model_config = self.config['model']
         self.model, self.tokenizer = create_waf_model(
-            vocab_size=model_config['vocab_size']
+            vocab_size=model_config['vocab_size'],
+            tokenizer_type=model_config.get('tokenizer', 'word')
         )
         
         # Initialize trainer
@@ -162,13 +176,21 @@ class WAFPipelineOrchestrator:
         self.trainer = WAFTrainer(
             self.model,
             self.tokenizer,
-            learning_rate=training_config['learning_rate']
+            learning_rate=training_config['learning_rate'],
+            featurizer_config=self.featurizer.to_config()
         )
         
     async def load_existing_model(self, model_path: str):
         """Load existing trained model"""
         self.logger.info(f"Loading existing model from {model_path}")
         
+        # Keep the token rules the checkpoint was trained with; a mismatch with the config is an error
+        checkpoint = torch.load(model_path, map_location='cpu')
+        self.featurizer = SequenceFeaturizer.from_checkpoint(
+            checkpoint.get('featurizer_config'),
+            expected=self.config['model'].get('featurizer', {'preset': 'pipeline'})
+        )
+        
         # This would load the trained model
         # For now, create new model
         await self.initialize_new_model()
@@ -236,11 +258,11 @@ class WAFPipelineOrchestrator:
             
             async for log_entry in self.log_ingestion.get_log_stream():
                 # Process log entry
-                processed = self.preprocessor.process_log_entry(log_entry['raw_log'])
+                processed = self.preprocessor.process_log_entry(log_entry['raw_log'], log_entry.get('log_format'))
                 
                 if processed:
                     # Create sequence from processed log
-                    sequence = self._create_training_sequence(processed)
+                    sequence = self.featurizer.featurize(processed['parsed'])
                     if sequence:
                         sequence_buffer.append(sequence)
                         processed_count += 1
@@ -259,49 +281,15 @@ class WAFPipelineOrchestrator:
         finally:
             self.log_ingestion.stop_ingestion()
             
-        # Store processed sequences
+        # Store processed sequences, keeping only the most recent ones
         self.processed_sequences.extend(sequence_buffer)
+        max_buffered = self.config['pipeline'].get('max_buffered_sequences', 100000)
+        if len(self.processed_sequences) > max_buffered:
+            del self.processed_sequences[:-max_buffered]
         
         self.logger.info(f"Processed {processed_count} log entries into {len(sequence_buffer)} sequences")
         return len(sequence_buffer)
         
-    def _create_training_sequence(self, processed: Dict[str, Any]) -> List[str]:
-        """Create training sequence from processed log entry"""
-        parsed = processed['parsed']
-        
-        sequence = [
-            parsed.get('method', 'GET'),
-            self._normalize_path(parsed.get('path_only', '/')),
-            str(parsed.get('status', 200)),
-        ]
-        
-        # Add additional features
-        features = processed.get('features', {})
-        
-        if features.get('has_referer'):
-            sequence.append('HAS_REFERER')
-            
-        if features.get('is_error'):
-            sequence.append('ERROR_STATUS')
-            
-        # Add user agent category
-        user_agent = parsed.get('http_user_agent', '')
-        if 'Mozilla' in user_agent:
-            sequence.append('BROWSER')
-        elif any(bot in user_agent.lower() for bot in ['curl', 'wget', 'python']):
-            sequence.append('API_CLIENT')
-        else:
-            sequence.append('OTHER_AGENT')
-            
-        return sequence
-        
-    def _normalize_path(self, path: str) -> str:
-        """Normalize URL path for training"""
-        # Replace numeric IDs with placeholder
-        import re
-        normalized = re.sub(r'/\d+', '/<ID>', path)
-        return normalized
-        
     async def train_initial_model(self):
         """Train the initial model on collected sequences"""
         if len(self.processed_sequences) < self.config['pipeline']['min_sequences_for_training']:
@@ -313,27 +301,24 @@ class WAFPipelineOrchestrator:
         
         try:
             # Prepare datasets
+            training_config = self.config['training']
             train_dataset, val_dataset = prepare_training_data(
                 self.processed_sequences,
-                self.tokenizer
+                self.tokenizer,
+                deduplicate=training_config.get('deduplicate', False)
             )
             
-            # Create data loaders
-            from torch.utils.data import DataLoader
-            
-            training_config = self.config['training']
-            train_dataloader = DataLoader(
+            # Create data loaders (length-bucketed, padded per batch)
+            train_dataloader = create_dataloader(
                 train_dataset,
                 batch_size=training_config['batch_size'],
-                shuffle=True,
-                collate_fn=collate_fn
+                shuffle=True
             )
             
-            val_dataloader = DataLoader(
+            val_dataloader = create_dataloader(
                 val_dataset,
                 batch_size=training_config['batch_size'],
-                shuffle=False,
-                collate_fn=collate_fn
+                shuffle=False
             ) if val_dataset else None
             
             # Train model
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Prune WAF Model
+Removes low-impact encoder layers, attention heads (opt-in) and FFN channels from a trained checkpoint
+within score-drift guardrails, fine-tunes briefly and saves the pruned model
+in the standard checkpoint format for the inference service
+"""
+
+import argparse
+import json
+import logging
+import random
+import sys
+from pathlib import Path
+
+import torch
+
+# Resolve WAF root
+WAF_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'preprocessing'))
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'training'))
+
+from columnar_processor import ColumnarLogProcessor  # type: ignore
+from featurizer import SequenceFeaturizer  # type: ignore
+from pruning import StructuredPruner, save_pruned_model  # type: ignore
+from waf_model import WAFTransformer, WAFTransformerConfig, load_tokenizer  # type: ignore
+
+DEFAULT_MODEL_PATH = WAF_ROOT / 'data' / 'models' / 'best_model.pt'
+DEFAULT_LOG_PATH = WAF_ROOT / 'data' / 'logs' / 'benign_synth.log'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', type=Path, default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--output', type=Path, default=None, help='Pruned checkpoint (default: <model>_pruned.pt)')
+    parser.add_argument('--log', type=Path, action='append', help='Log file for validation/fine-tuning (repeatable)')
+    parser.add_argument('--max-lines', type=int, default=20_000)
+    parser.add_argument('--val-size', type=int, default=1000)
+    parser.add_argument('--max-layers-removed', type=int, default=1)
+    parser.add_argument('--max-heads-removed', type=int, default=0, help='Attention heads to remove (pruned layers lose the nested-tensor fast path)')
+    parser.add_argument('--ffn-keep-ratio', type=float, default=0.5)
+    parser.add_argument('--max-score-drift', type=float, default=0.02)
+    parser.add_argument('--max-nll-increase', type=float, default=0.1)
+    parser.add_argument('--fine-tune-epochs', type=int, default=1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    
+    # Trained model and its tokenizer/featurization
+    checkpoint = torch.load(str(args.model), map_location='cpu')
+    model = WAFTransformer(WAFTransformerConfig(**checkpoint['model_config']))
+    model.load_state_dict(checkpoint['model_state_dict'])
+    tokenizer = load_tokenizer(str(args.model).replace('.pt', '_tokenizer.json'), vocab_size=model.config.vocab_size)
+    featurizer = SequenceFeaturizer.from_checkpoint(checkpoint.get('featurizer_config'))
+    
+    log_paths = [str(path) for path in (args.log or [DEFAULT_LOG_PATH])]
+    sequences = ColumnarLogProcessor(featurizer=featurizer).build_sequences(log_paths, max_sequences=args.max_lines)
+    random.Random(42).shuffle(sequences)
+    val_sequences, train_sequences = sequences[:args.val_size], sequences[args.val_size:]
+    
+    pruner = StructuredPruner(model, tokenizer, val_sequences)
+    pruned, report = pruner.prune(
+        max_layers_removed=args.max_layers_removed,
+        ffn_keep_ratio=args.ffn_keep_ratio,
+        max_score_drift=args.max_score_drift,
+        max_nll_increase=args.max_nll_increase,
+        max_heads_removed=args.max_heads_removed
+    )
+    if args.fine_tune_epochs > 0 and train_sequences:
+        report['fine_tune'] = pruner.fine_tune(pruned, train_sequences, num_epochs=args.fine_tune_epochs)
+    report['comparison'] = pruner.compare(pruned)
+    report['config'] = dict(pruned.config.__dict__)
+    
+    output = args.output or args.model.with_name(args.model.stem + '_pruned.pt')
+    save_pruned_model(pruned, tokenizer, str(output), report, featurizer_config=featurizer.to_config())
+    print(json.dumps({k: v for k, v in report.items() if k != 'head_importance'}, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -22,14 +22,15 @@ sys.path.insert(0, str(ml_pkg / 'preprocessing'))
 # Robust imports
 try:
     from ml_pipeline.preprocessing.log_processor import LogPreprocessor
-    from ml_pipeline.training.trainer import WAFTrainer, prepare_training_data, collate_fn
+    from ml_pipeline.preprocessing.featurizer import SequenceFeaturizer
+    from ml_pipeline.training.trainer import WAFTrainer, prepare_training_data, create_dataloader
     from ml_pipeline.training.waf_model import create_waf_model
 except Exception:
     from log_processor import LogPreprocessor  # type: ignore
-    from trainer import WAFTrainer, prepare_training_data, collate_fn  # type: ignore
+    from featurizer import SequenceFeaturizer  # type: ignore
+    from trainer import WAFTrainer, prepare_training_data, create_dataloader  # type: ignore
     from waf_model import create_waf_model  # type: ignore
 
-from torch.utils.data import DataLoader
 import torch
 from sklearn.metrics import precision_recall_fscore_support, accuracy_score, roc_auc_score
 
@@ -147,7 +148,7 @@ def ensure_benign_dataset():
 
 # Build sequences from logs
 
-def build_sequences(max_lines: int = 10_000):
+def build_sequences(featurizer: SequenceFeaturizer, max_lines: int = 10_000):
     preprocessor = LogPreprocessor()
     log_paths = [str(BENIGN_SYNTH_PATH)] if USE_SYNTHETIC_BENIGN else [
         str(WAF_ROOT / 'data' / 'logs' / 'access.log'),
@@ -170,22 +171,7 @@ def build_sequences(max_lines: int = 10_000):
                     processed = preprocessor.process_log_entry(pl)
                     if not processed:
                         continue
-                    parsed = processed['parsed']
-                    seq = [
-                        parsed.get('method', 'GET'),
-                        parsed.get('path_only', '/'),
-                        str(parsed.get('status', 200)),
-                    ]
-                    ua = parsed.get('http_user_agent', '') or ''
-                    if 'Mozilla' in ua:
-                        seq.append('Mozilla')
-                    elif 'curl' in ua:
-                        seq.append('curl')
-                    elif 'python' in ua.lower():
-                        seq.append('python')
-                    else:
-                        seq.append('Other-Agent')
-                    sequences.append(seq)
+                    sequences.append(featurizer.featurize(processed['parsed']))
     if len(sequences) < 50:
         base = [
             ['GET', '/ecommerce/', '200', 'Mozilla'],
@@ -197,23 +183,13 @@ def build_sequences(max_lines: int = 10_000):
     return sequences
 
 @torch.no_grad()
-def score_request(trainer, tokenizer, preprocessor, method: str, uri: str, user_agent: str = 'Mozilla/5.0', threshold: float = 0.5):
+def score_request(trainer, tokenizer, preprocessor, featurizer, method: str, uri: str, user_agent: str = 'Mozilla/5.0', threshold: float = 0.5):
     ts = datetime.utcnow().strftime('%d/%b/%Y:%H:%M:%S +0000')
     line = f'127.0.0.1 - - [{ts}] "{method} {uri} HTTP/1.1" 200 0 "-" "{user_agent}"'
     processed = preprocessor.process_log_entry(line)
     if not processed:
         return 0.0, False
-    parsed = processed['parsed']
-    seq = [parsed.get('method', 'GET'), parsed.get('path_only', '/'), str(parsed.get('status', 200))]
-    ua = parsed.get('http_user_agent', '') or ''
-    if 'Mozilla' in ua:
-        seq.append('Mozilla')
-    elif 'curl' in ua:
-        seq.append('curl')
-    elif 'python' in ua.lower():
-        seq.append('python')
-    else:
-        seq.append('Other-Agent')
+    seq = featurizer.featurize(processed['parsed'])
     enc = tokenizer.encode(seq, max_length=128)
     input_ids = enc['input_ids'].unsqueeze(0)
     attention_mask = enc['attention_mask'].unsqueeze(0)
@@ -241,13 +217,15 @@ def to_native(obj):
 
 def main():
     ensure_benign_dataset()
-    sequences = build_sequences(max_lines=SYNTH_COUNT)
+    # Demo token rules; saved with the checkpoint so the service featurizes alike
+    featurizer = SequenceFeaturizer.from_preset('demo')
+    sequences = build_sequences(featurizer, max_lines=SYNTH_COUNT)
     model, tokenizer = create_waf_model()
     train_ds, val_ds = prepare_training_data(sequences, tokenizer)
-    train_loader = DataLoader(train_ds, batch_size=32, shuffle=True, collate_fn=collate_fn)
-    val_loader = DataLoader(val_ds, batch_size=32, shuffle=False, collate_fn=collate_fn)
+    train_loader = create_dataloader(train_ds, batch_size=32, shuffle=True)
+    val_loader = create_dataloader(val_ds, batch_size=32, shuffle=False)
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    trainer = WAFTrainer(model, tokenizer, device=device)
+    trainer = WAFTrainer(model, tokenizer, device=device, featurizer_config=featurizer.to_config())
     train_metrics = trainer.train_epoch(train_loader)
     val_metrics = trainer.evaluate(val_loader)
     # Save model
@@ -269,10 +247,10 @@ def main():
     ]
     rows = []
     for uri in random.sample(benign_uris, min(50, len(benign_uris))):
-        s, yhat = score_request(trainer, tokenizer, preprocessor, 'GET', uri)
+        s, yhat = score_request(trainer, tokenizer, preprocessor, featurizer, 'GET', uri)
         rows.append({'uri': uri, 'label': 0, 'score': s, 'pred': int(yhat)})
     for uri in malicious_payloads:
-        s, yhat = score_request(trainer, tokenizer, preprocessor, 'GET', uri)
+        s, yhat = score_request(trainer, tokenizer, preprocessor, featurizer, 'GET', uri)
         rows.append({'uri': uri, 'label': 1, 'score': s, 'pred': int(yhat)})
     df = pd.DataFrame(rows)
     y_true = df['label'].values
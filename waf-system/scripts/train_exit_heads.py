@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Train Early-Exit Heads
+Adds per-layer anomaly heads to a trained checkpoint, fits them to the final
+anomaly score on log traffic (backbone frozen), calibrates the exit margin and
+saves the model in the standard checkpoint format for the inference service
+"""
+
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+
+import torch
+
+# Resolve WAF root
+WAF_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'preprocessing'))
+sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / 'training'))
+
+from columnar_processor import ColumnarLogProcessor  # type: ignore
+from featurizer import SequenceFeaturizer  # type: ignore
+from early_exit import ExitHeadTrainer  # type: ignore
+from waf_model import WAFTransformer, WAFTransformerConfig, load_tokenizer  # type: ignore
+
+DEFAULT_MODEL_PATH = WAF_ROOT / 'data' / 'models' / 'best_model.pt'
+DEFAULT_LOG_PATH = WAF_ROOT / 'data' / 'logs' / 'benign_synth.log'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--model', type=Path, default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--output', type=Path, default=None, help='Output checkpoint (default: <model>_early_exit.pt)')
+    parser.add_argument('--log', type=Path, action='append', help='Training log file (repeatable)')
+    parser.add_argument('--max-lines', type=int, default=20_000)
+    parser.add_argument('--exit-layers', type=int, nargs='+', default=None, help='Layers followed by an exit head (default: all but the last)')
+    parser.add_argument('--epochs', type=int, default=100)
+    parser.add_argument('--threshold', type=float, default=0.5, help='Serving threshold the margin is calibrated for')
+    parser.add_argument('--min-agreement', type=float, default=0.995, help='Required decision agreement with the full model')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    
+    checkpoint = torch.load(str(args.model), map_location='cpu')
+    model = WAFTransformer(WAFTransformerConfig(**checkpoint['model_config']))
+    model.load_state_dict(checkpoint['model_state_dict'])
+    tokenizer = load_tokenizer(str(args.model).replace('.pt', '_tokenizer.json'), vocab_size=model.config.vocab_size)
+    featurizer = SequenceFeaturizer.from_checkpoint(checkpoint.get('featurizer_config'))
+    
+    exit_layers = args.exit_layers if args.exit_layers is not None else list(range(model.config.num_hidden_layers - 1))
+    model.add_exit_heads(exit_layers)
+    
+    log_paths = [str(path) for path in (args.log or [DEFAULT_LOG_PATH])]
+    sequences = ColumnarLogProcessor(featurizer=featurizer).build_sequences(log_paths, max_sequences=args.max_lines)
+    
+    trainer = ExitHeadTrainer(model, tokenizer, featurizer_config=featurizer.to_config())
+    report = trainer.train(sequences, num_epochs=args.epochs, threshold=args.threshold, min_agreement=args.min_agreement)
+    
+    output = args.output or args.model.with_name(args.model.stem + '_early_exit.pt')
+    trainer.save_model(str(output), report=report, hypersphere=checkpoint.get('hypersphere'))
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
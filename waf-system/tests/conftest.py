@@ -0,0 +1,47 @@
+"""
+Shared test setup: ml-pipeline module paths and small log corpora
+"""
+
+import sys
+from pathlib import Path
+from typing import List
+
+import pytest
+
+# Resolve WAF root
+WAF_ROOT = Path(__file__).resolve().parents[1]
+for package in ['preprocessing', 'training', 'inference']:
+    sys.path.insert(0, str(WAF_ROOT / 'ml-pipeline' / package))
+
+BENIGN_LOG = WAF_ROOT / 'data' / 'logs' / 'benign_synth.log'
+
+# Edge cases the synthetic log does not hold: queries, attacks, Apache/unknown lines, escapes
+EXTRA_LINES = [
+    '10.0.0.1 - - [23/Sep/2025:10:00:00 +0000] "GET /ecommerce/search?q=shoes&page=2 HTTP/1.1" 200 512 "-" "curl/8.4.0"',
+    '10.0.0.2 - - [23/Sep/2025:10:00:01 +0000] "GET /blog-cms/post?id=1%27%20OR%201=1-- HTTP/1.1" 500 0 "-" "sqlmap/1.7"',
+    '10.0.0.3 - - [23/Sep/2025:10:00:02 +0000] "POST /rest-api/api/users HTTP/1.1" 201 87 "https://example.com/" "python-requests/2.31"',
+    '10.0.0.4 - alice [23/Sep/2025:10:00:03 +0000] "GET /ecommerce/product/77?ref=%3Cscript%3E HTTP/1.1" 404 153 "-" "Mozilla/5.0 (X11; Linux x86_64)"',
+    '10.0.0.5 - - [23/Sep/2025:10:00:04 +0000] "GET /assets/app.js HTTP/2.0" 304 - "-" "-"',
+    '10.0.0.6 - - [23/Sep/2025:10:00:05 +0000] "-" 400 0 "-" "-"',
+    'not a log line',
+    '',
+]
+
+JSON_LINES = [
+    '{"remote_addr": "10.0.0.1", "time_local": "23/Sep/2025:10:00:00 +0000", "request": "GET /ecommerce/search?q=shoes HTTP/1.1", "status": 200, "body_bytes_sent": 512, "http_referer": "-", "http_user_agent": "curl/8.4.0"}',
+    '{"client_ip": "10.0.0.2", "timestamp": "2025-09-23T10:00:01+00:00", "method": "POST", "uri": "/rest-api/api/users", "protocol": "HTTP/1.1", "status": "201", "bytes_sent": "87", "user_agent": "python-requests/2.31"}',
+    '{"remote_addr": "10.0.0.3", "request": "GET /blog-cms/post?id=1%27%20OR%201=1-- HTTP/1.1", "status": 500, "http_user_agent": "sqlmap/1.7"}',
+    '{"remote_addr": "10.0.0.4", "status": 200}',
+    '{broken json',
+]
+
+@pytest.fixture(scope='session')
+def log_lines() -> List[str]:
+    """First lines of the synthetic benign log plus the edge cases (duplicated, as in real traffic)"""
+    with open(BENIGN_LOG, 'r') as f:
+        lines = [line.rstrip('\n') for _, line in zip(range(500), f)]
+    return lines + EXTRA_LINES + EXTRA_LINES[:3]
+
+@pytest.fixture(scope='session')
+def json_lines() -> List[str]:
+    return JSON_LINES
@@ -0,0 +1,61 @@
+"""
+Columnar batch processing must produce what the per-line path produces
+"""
+
+import pytest
+
+from columnar_processor import ColumnarLogProcessor
+from featurizer import FEATURIZER_PRESETS, SequenceFeaturizer
+from log_processor import LogPreprocessor
+
+def per_line(lines, featurizer, log_format=None):
+    """Sequences and features of the lines the per-line parser accepts"""
+    preprocessor = LogPreprocessor()
+    sequences, features = [], []
+    for line in lines:
+        parsed = preprocessor.parser.parse_log_line(line, log_format)
+        if parsed:
+            sequences.append(featurizer.featurize(parsed))
+            features.append(preprocessor._extract_features(parsed))
+    return sequences, features
+
+def columnar_features(batch):
+    columns = batch.features()
+    return [{name: columns[name][row] for name in columns} for row in range(len(batch))]
+
+@pytest.mark.parametrize('preset', sorted(FEATURIZER_PRESETS))
+def test_sequences_match_per_line(log_lines, preset):
+    expected, _ = per_line(log_lines, SequenceFeaturizer.from_preset(preset))
+    batch = ColumnarLogProcessor(LogPreprocessor()).load_chunk(log_lines)
+    assert batch.sequences(SequenceFeaturizer.from_preset(preset)) == expected
+
+def test_features_match_per_line(log_lines):
+    _, expected = per_line(log_lines, SequenceFeaturizer())
+    batch = ColumnarLogProcessor(LogPreprocessor()).load_chunk(log_lines)
+    assert columnar_features(batch) == expected
+
+def test_json_lines_match_per_line(json_lines):
+    featurizer = SequenceFeaturizer()
+    expected_sequences, expected_features = per_line(json_lines, featurizer, 'json')
+    batch = ColumnarLogProcessor(LogPreprocessor(log_format='json')).load_chunk(json_lines)
+    assert len(batch) == len(expected_sequences) == 3
+    assert batch.sequences(featurizer) == expected_sequences
+    assert columnar_features(batch) == expected_features
+
+def test_templates_match_per_line(log_lines):
+    preprocessor = LogPreprocessor()
+    expected = []
+    for line in log_lines:
+        processed = preprocessor.process_log_entry(line)
+        if processed:
+            expected.append((processed['template'], processed['template_id'], processed['cluster_count']))
+    batch = ColumnarLogProcessor(LogPreprocessor()).load_chunk(log_lines)
+    assert batch.mine_templates() == expected
+
+def test_build_sequences_matches_per_line(tmp_path, log_lines):
+    path = tmp_path / 'access.log'
+    path.write_text('\n'.join(log_lines) + '\n')
+    expected, _ = per_line(log_lines, SequenceFeaturizer())
+    processor = ColumnarLogProcessor(chunk_size=64)
+    assert processor.build_sequences([str(path)]) == expected
+    assert processor.build_sequences([str(path)], max_sequences=100) == expected[:100]
@@ -0,0 +1,85 @@
+"""
+MLM masking statistics and DataLoader batch parity
+"""
+
+import numpy as np
+import torch
+
+from trainer import LogSequenceDataset, MLMCollator, collate_fn, create_dataloader, deduplicate_sequences
+from token_store import TokenStoreDataset, write_token_store
+from waf_model import WAFTokenizer
+
+SEQUENCES = [[f'tok{i % 10}', f'path{i % 7}'] * (1 + i % 30) for i in range(400)]
+
+def make_tokenizer() -> WAFTokenizer:
+    tokenizer = WAFTokenizer(vocab_size=1000)
+    tokenizer.build_vocabulary(SEQUENCES)
+    return tokenizer
+
+def test_collator_masking_statistics():
+    torch.manual_seed(0)
+    tokenizer = make_tokenizer()
+    collator = MLMCollator(tokenizer, mlm_probability=0.15)
+    encoded = tokenizer.encode_batch(SEQUENCES * 5, max_length=64)
+    input_ids, attention_mask = encoded['input_ids'], encoded['attention_mask']
+    masked_ids, labels = collator.mask(input_ids, attention_mask)
+    
+    special = torch.isin(input_ids, collator.special_ids)
+    candidates = attention_mask.bool() & ~special
+    selected = labels != -100
+    # Only real, non-special tokens are selected, at the configured rate, and labelled with their original id
+    assert not (selected & ~candidates).any()
+    assert abs(selected.sum().item() / candidates.sum().item() - 0.15) < 0.01
+    assert torch.equal(labels[selected], input_ids[selected])
+    # Unselected positions are untouched
+    assert torch.equal(masked_ids[~selected], input_ids[~selected])
+    
+    # 80% [MASK], 10% random vocabulary token, 10% kept (a random draw can hit the original token)
+    replaced = masked_ids[selected]
+    is_mask = replaced == collator.mask_token_id
+    kept = replaced == input_ids[selected]
+    random_rows = ~is_mask & ~kept
+    total = selected.sum().item()
+    assert abs(is_mask.sum().item() / total - 0.8) < 0.02
+    assert abs(kept.sum().item() / total - 0.1) < 0.02
+    assert abs(random_rows.sum().item() / total - 0.1) < 0.02
+    assert (replaced[random_rows] >= collator.first_token_id).all()
+    assert (replaced[random_rows] < tokenizer.next_id).all()
+
+def unmasked(batch):
+    return torch.where(batch['labels'] != -100, batch['labels'], batch['input_ids'])
+
+def test_per_item_batches_match_block_batches(tmp_path):
+    tokenizer = make_tokenizer()
+    write_token_store(SEQUENCES, tokenizer, str(tmp_path))
+    indices = [3, 17, 40, 8, 29]
+    for dataset in [
+        LogSequenceDataset(SEQUENCES, tokenizer, max_length=64),
+        LogSequenceDataset(SEQUENCES, tokenizer, max_length=64, dynamic_padding=False),
+        TokenStoreDataset(str(tmp_path), max_length=64)
+    ]:
+        per_item = collate_fn([dataset[i] for i in indices])
+        block = collate_fn(dataset.__getitems__(indices))
+        assert per_item['input_ids'].shape == block['input_ids'].shape
+        assert torch.equal(per_item['attention_mask'], block['attention_mask'])
+        assert torch.equal(unmasked(per_item), unmasked(block))
+        assert (per_item['labels'][per_item['attention_mask'] == 0] == -100).all()
+
+def test_deduplicated_evaluation_visits_each_sequence_once():
+    tokenizer = make_tokenizer()
+    unique, counts = deduplicate_sequences(SEQUENCES)
+    assert len(unique) < len(SEQUENCES) and counts.sum() == len(SEQUENCES)
+    dataset = LogSequenceDataset(unique, tokenizer, max_length=64, counts=counts)
+    for bucketed in [True, False]:
+        loader = create_dataloader(dataset, batch_size=8, shuffle=False, bucketed=bucketed)
+        batch_counts = torch.cat([batch['counts'] for batch in loader])
+        assert len(batch_counts) == len(unique)
+        assert batch_counts.sum().item() == len(SEQUENCES)
+
+def test_deduplicated_training_samples_by_frequency():
+    counts = np.array([1, 1, 1, 97])
+    dataset = LogSequenceDataset([['a'], ['b'], ['c'], ['d']], make_tokenizer(), counts=counts)
+    loader = create_dataloader(dataset, batch_size=4, shuffle=True)
+    drawn = np.concatenate([np.concatenate(list(loader.batch_sampler)) for _ in range(50)])
+    assert len(drawn) == 50 * len(counts)
+    assert np.mean(drawn == 3) > 0.9
@@ -0,0 +1,58 @@
+"""
+Inference artifacts must score exactly like the training checkpoints they are exported from
+"""
+
+import pytest
+import torch
+
+from featurizer import SequenceFeaturizer
+from model_artifact import export_checkpoint, is_artifact_current, load_artifact
+from trainer import LogSequenceDataset, WAFTrainer, create_dataloader
+from waf_model import WAFTokenizer, WAFTransformer, WAFTransformerConfig, load_tokenizer
+
+SEQUENCES = [['GET', f'/api/users/{i % 13}', str(200 + i % 5), f'agent{i % 3}'] * (1 + i % 4) for i in range(96)]
+
+@pytest.fixture(scope='module', params=[None, [4, 3]], ids=['full', 'head-pruned'])
+def checkpoint_path(request, tmp_path_factory):
+    """Checkpoint of a small model after one training epoch (full or with pruned attention heads)"""
+    torch.manual_seed(0)
+    config = WAFTransformerConfig(
+        vocab_size=500, hidden_size=64, num_hidden_layers=2, num_attention_heads=4,
+        intermediate_size=128, max_position_embeddings=64, attention_heads=request.param
+    )
+    tokenizer = WAFTokenizer(vocab_size=500)
+    tokenizer.build_vocabulary(SEQUENCES)
+    trainer = WAFTrainer(WAFTransformer(config), tokenizer, featurizer_config=SequenceFeaturizer().to_config())
+    dataset = LogSequenceDataset(SEQUENCES, tokenizer, max_length=64)
+    trainer.train_epoch(create_dataloader(dataset, batch_size=16))
+    trainer.evaluate(create_dataloader(dataset, batch_size=16, shuffle=False))
+    path = tmp_path_factory.mktemp('models') / 'best_model.pt'
+    trainer.save_model(str(path))
+    return path
+
+def load_checkpoint(path):
+    """Model and tokenizer as loaded from a training checkpoint"""
+    checkpoint = torch.load(str(path), map_location='cpu')
+    model = WAFTransformer(WAFTransformerConfig(**checkpoint['model_config']))
+    model.load_state_dict(checkpoint['model_state_dict'])
+    model.eval()
+    tokenizer = load_tokenizer(str(path).replace('.pt', '_tokenizer.json'), vocab_size=model.config.vocab_size)
+    return model, tokenizer, checkpoint
+
+def test_artifact_scores_match_checkpoint(checkpoint_path):
+    model, tokenizer, checkpoint = load_checkpoint(checkpoint_path)
+    artifact_path = export_checkpoint(str(checkpoint_path))
+    assert is_artifact_current(artifact_path, checkpoint_path)
+    artifact_model, artifact_tokenizer, metadata = load_artifact(str(artifact_path))
+    
+    assert artifact_tokenizer.token_to_id == tokenizer.token_to_id
+    assert metadata['featurizer_config'] == checkpoint['featurizer_config']
+    assert metadata['hypersphere'] == checkpoint['hypersphere']
+    assert metadata['hypersphere']['percentiles']
+    
+    encoded = artifact_tokenizer.encode_batch(SEQUENCES, max_length=64)
+    with torch.no_grad():
+        for fast_path in [True, False]:
+            expected = model.score(encoded['input_ids'], encoded['attention_mask'], fast_path=fast_path)
+            scores = artifact_model.score(encoded['input_ids'], encoded['attention_mask'], fast_path=fast_path)
+            assert torch.equal(scores, expected)